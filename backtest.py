@@ -0,0 +1,198 @@
+# Phoenix Analyzer Bot — offline back-test of the scoring rules
+# Loads the snapshot chunks the bot writes (SNAPSHOT_DIR), labels every snapshot with its outcome
+# from later snapshots of the same mint (liquidity or price collapsed within the horizon = rug),
+# then re-scores the whole history with the declarative rules of bot.py in one vectorised pass.
+#
+#   python backtest.py                                  # snapshots/ with the current rules
+#   python backtest.py --synthetic 5000                 # generated history (written as real chunks)
+#   python backtest.py --score lp --vary lp:0:0:30000,50000,80000   # sweep "liq >= 50k" of LP group 0
+#   python backtest.py --horizon 48 --liq-drop 0.7
+#
+# --vary <ruleset>:<group>:<rule>:<v1,v2,...> replaces the threshold of that rule's first condition
+# (indices into the RuleSet in bot.py) and reports how well each variant separates rugs.
+
+import os, time, argparse, tempfile
+import numpy as np
+
+os.environ.setdefault("BOT_TOKEN", "0:backtest")   # bot.py refuses to import without one
+import bot
+
+# ================== SYNTHETIC HISTORY ==================
+def synthetic_history(n_mints: int, seed: int = 7, days: float = 7) -> dict:
+    """Snapshot columns for n_mints tokens revisited every 1-12h; riskier features rug more often."""
+    rng = np.random.default_rng(seed)
+    mint_auth = (rng.random(n_mints) < 0.35).astype(float)
+    freeze_auth = (rng.random(n_mints) < 0.2).astype(float)
+    top1 = np.clip(rng.gamma(2.0, 7.0, n_mints), 0.5, 95)
+    top10 = np.clip(top1 + rng.gamma(3.0, 8.0, n_mints), top1, 100)
+    liq0 = np.exp(rng.normal(np.log(30_000), 1.3, n_mints))
+    age0 = rng.exponential(60, n_mints)
+    density = np.clip(rng.beta(1.5, 4.0, n_mints), 0, 1)
+    hub = np.clip(density + rng.normal(0.1, 0.15, n_mints), 0, 1)
+    share = np.clip(rng.gamma(1.5, 6.0, n_mints), 0, 100)
+    risk = (-3.0 + 1.6 * mint_auth + 0.6 * freeze_auth + 0.04 * top1 + 2.2 * density
+            - 0.5 * np.log10(liq0 / 10_000) - 0.01 * np.minimum(age0, 100))
+    rugs = rng.random(n_mints) < 1 / (1 + np.exp(-risk))
+    rug_at = np.where(rugs, rng.uniform(2, days * 24, n_mints), np.inf)   # hours after the first snapshot
+
+    rows = []
+    t0 = time.time() - days * 86400
+    for m in range(n_mints):
+        mint, start, h = f"synthetic{m:08d}", t0 + rng.uniform(0, 86400), 0.0
+        price, pulled = float(np.exp(rng.normal(-9, 2))), False
+        while h < days * 24:
+            rugged = h >= rug_at[m]
+            liq = liq0[m] * (0.02 if rugged else np.exp(rng.normal(0, 0.15)))
+            price *= 0.03 if rugged and not pulled else np.exp(rng.normal(0, 0.1))
+            pulled = rugged
+            rows.append((mint, start + h * 3600, mint_auth[m], freeze_auth[m], top1[m], top10[m], liq,
+                         liq * rng.uniform(0.05, 4), age0[m] + h, price, density[m], hub[m], share[m]))
+            h += rng.uniform(1, 12)
+    mint, ts, ma, fa, t1, t10, liq, vol, age, price, dens, hr, ts_share = map(np.array, zip(*rows))
+    cols = {"mint": mint.astype("U44"), "ts": ts, "mint_auth": ma, "freeze_auth": fa, "top1": t1, "top10": t10,
+            "has_pair": np.ones(len(ts)), "price": price, "liq": liq, "vol24": vol, "age_h": age,
+            "vol_liq": vol / liq, "density": dens, "hub_ratio": hr, "top_share": ts_share}
+    cols.update({k: v for k, v in bot.rescore(cols).items()})
+    cols["rug_flags"] = ma + fa + (t1 >= 30) + (liq < 5000)
+    return cols
+
+def write_chunks(path: str, cols: dict, chunk: int = bot.SNAPSHOT_CHUNK) -> int:
+    order = np.argsort(cols["ts"], kind="stable")
+    n = 0
+    for i in range(0, len(order), chunk):
+        idx = order[i:i + chunk]
+        bot.write_snapshot_chunk(path, {k: cols[k][idx] for k in (*bot.SNAPSHOT_FIELDS, "mint")})
+        n += 1
+    return n
+
+# ================== OUTCOMES ==================
+def outcomes(cols: dict, horizon_h: float, liq_drop: float, price_drop: float) -> np.ndarray:
+    """Per snapshot: 1 = rugged within the horizon, 0 = survived it, -1 = unknown (no later snapshot)."""
+    n = len(cols["ts"])
+    if not n:
+        return np.empty(0, dtype=np.int8)
+    _, gid = np.unique(cols["mint"], return_inverse=True)
+    order = np.lexsort((cols["ts"], gid))
+    g, ts = gid[order], cols["ts"][order]
+    liq = np.where(cols["has_pair"][order] > 0, np.nan_to_num(cols["liq"][order], nan=0.0), 0.0)   # pair gone = drained
+    price = cols["price"][order]
+    # one monotone key across mints, so each forward window is a single searchsorted
+    span = ts.max() - ts.min() + horizon_h * 3600 + 1
+    key = g * span + (ts - ts.min())
+    end = np.searchsorted(key, key + horizon_h * 3600, side="right")
+    start = np.arange(n) + 1
+    has_next = end > start
+    # min over [start, end) for every row in one reduceat (even slots); arrays are padded so end == n is valid
+    idx = np.empty(2 * int(has_next.sum()), dtype=np.int64)
+    idx[0::2], idx[1::2] = start[has_next], end[has_next]
+    window_min = lambda a: np.minimum.reduceat(np.append(np.nan_to_num(a, nan=np.inf), np.inf), idx)[0::2]
+    liq_min, price_min = np.full(n, np.inf), np.full(n, np.inf)
+    if len(idx):
+        liq_min[has_next], price_min[has_next] = window_min(liq), window_min(price)
+    with np.errstate(invalid="ignore"):   # NaN price (no quote) never counts as a price rug
+        rug = (liq_min <= (1 - liq_drop) * liq) | (price_min <= (1 - price_drop) * price)
+    known = has_next & (cols["has_pair"][order] > 0)
+    out = np.full(n, -1, dtype=np.int8)
+    out[order] = np.where(known, rug.astype(np.int8), -1)
+    return out
+
+def auc(score: np.ndarray, rug: np.ndarray) -> float:
+    """P(a rugged snapshot scored lower than a surviving one); ties count half."""
+    pos, neg = (rug == 1).sum(), (rug == 0).sum()
+    if not pos or not neg:
+        return float("nan")
+    _, inv, cnt = np.unique(-score, return_inverse=True, return_counts=True)
+    ranks = (np.cumsum(cnt) - (cnt - 1) / 2)[inv]   # average rank of tied values
+    return float((ranks[rug == 1].sum() - pos * (pos + 1) / 2) / (pos * neg))
+
+# ================== REPORT ==================
+def report(cols: dict, a) -> list:
+    lines = []
+    n = len(cols["ts"])
+    lines.append(f"snapshots: {n} rows, {len(np.unique(cols['mint']))} mints"
+                 + (f", {(cols['ts'].max() - cols['ts'].min()) / 86400:.1f} days" if n else ""))
+    if not n:
+        return lines
+
+    t = time.perf_counter()
+    scores = bot.rescore(cols)
+    dt = time.perf_counter() - t
+    lines.append(f"re-score: {n} rows x {len(scores)} rule sets in {dt * 1000:.1f} ms ({n / max(dt, 1e-9):,.0f} rows/s)")
+    for name, s in scores.items():
+        rec = cols[name]
+        both = ~np.isnan(rec)
+        bad = int((s[both] != rec[both]).sum())
+        lines.append(f"  {name:<8} {int(both.sum())} recorded, {bad} differ from the current rules")
+
+    t = time.perf_counter()
+    rug = outcomes(cols, a.horizon, a.liq_drop, a.price_drop)
+    known = rug >= 0
+    lines.append(f"outcomes ({a.horizon:g}h horizon, liq -{a.liq_drop:.0%} / price -{a.price_drop:.0%}): "
+                 f"{int(known.sum())} labelled in {(time.perf_counter() - t) * 1000:.1f} ms, "
+                 f"rug rate {rug[known].mean() if known.any() else 0:.1%}")
+    if not known.any():
+        return lines
+
+    rules = bot.RULE_SETS[a.score]
+    s, r = scores[a.score], rug
+    ok = known & ~np.isnan(s)
+    s, r = s[ok], r[ok]
+    lines.append(f"\n{a.score} score  (AUC {auc(s, r):.3f})")
+    labels = rules.label(s)
+    for _, lab in rules.labels:
+        m = labels == lab
+        if m.any():
+            lines.append(f"  {lab:<24} {int(m.sum()):>7} snapshots  rug rate {r[m].mean():6.1%}")
+    lines.append(f"  {'flag below':<10} {'flagged':>8} {'precision':>10} {'recall':>8}")
+    for cut in range(10, 100, 10):
+        f = s < cut
+        tp = int((f & (r == 1)).sum())
+        lines.append(f"  {cut:<10} {f.mean():>8.1%} {tp / max(1, f.sum()):>10.1%} {tp / max(1, (r == 1).sum()):>8.1%}")
+
+    if a.vary:
+        name, group, rule, values = a.vary.split(":")
+        base = bot.RULE_SETS[name]
+        when = base.groups[int(group)][int(rule)][0][0]
+        lines.append(f"\nvary {name} group {group} rule {rule}: {when[0]} {when[1]} <value>  (AUC of {a.score})")
+        for v in values.split(","):
+            variant = base.vary(int(group), int(rule), float(v))
+            sv = bot.rescore(cols, {name: variant})[a.score][ok]
+            mark = "  (current)" if float(v) == when[2] else ""
+            lines.append(f"  {float(v):>12g}  AUC {auc(sv, r):.3f}  mean score rugged {sv[r == 1].mean():5.1f} "
+                         f"/ survived {sv[r == 0].mean():5.1f}{mark}")
+    return lines
+
+def main():
+    p = argparse.ArgumentParser(description="Back-test the scoring rules against recorded snapshots")
+    p.add_argument("--dir", help=f"snapshot directory (default {bot.SNAPSHOT_DIR or 'snapshots'})")
+    p.add_argument("--synthetic", type=int, default=0, help="generate a history of N mints instead of reading one")
+    p.add_argument("--horizon", type=float, default=72, help="hours after a snapshot in which a collapse counts")
+    p.add_argument("--liq-drop", type=float, default=0.8, help="liquidity drop that counts as a rug")
+    p.add_argument("--price-drop", type=float, default=0.9, help="price drop that counts as a rug")
+    p.add_argument("--score", default="safety", choices=sorted(bot.RULE_SETS), help="rule set to evaluate")
+    p.add_argument("--vary", help="ruleset:group:rule:v1,v2,... threshold sweep")
+    p.add_argument("--seed", type=int, default=7)
+    p.add_argument("--out", help="also write the report to this file")
+    a = p.parse_args()
+
+    tmp = None
+    path = a.dir or bot.SNAPSHOT_DIR or "snapshots"
+    if a.synthetic:
+        if not a.dir:
+            tmp = tempfile.TemporaryDirectory(prefix="phoenix-snap-"); path = tmp.name
+        t = time.perf_counter()
+        cols = synthetic_history(a.synthetic, a.seed)
+        files = write_chunks(path, cols)
+        print(f"synthetic: {len(cols['ts'])} snapshots of {a.synthetic} mints -> {files} chunks in {path} "
+              f"({time.perf_counter() - t:.1f}s)")
+    t = time.perf_counter()
+    cols = bot.load_snapshots(path)
+    print(f"loaded {path} in {(time.perf_counter() - t) * 1000:.0f} ms")
+    text = "\n".join(report(cols, a))
+    print(text)
+    if a.out:
+        with open(a.out, "w", encoding="utf-8") as f: f.write(text + "\n")
+    if tmp: tmp.cleanup()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,610 @@
+# Phoenix Analyzer Bot — offline benchmark
+# Starts local stand-ins for Solana RPC (HTTP + WebSocket), Dexscreener and Helius that replay
+# fixtures with configurable latency / jitter / 429 rate / failure rate, then drives the real
+# handlers (check_receive_ca, price_alerts_job, whale watch) with synthetic concurrent users.
+#
+#   python bench.py --users 20 --checks 10 --mints 40 --latency 80 --jitter 30 --rate429 0.02
+#   python bench.py --save-fixtures fixtures.json      # dump the synthetic fixture set
+#   python bench.py --fixtures fixtures.json           # replay a recorded / edited set
+#   python bench.py --deep 300000                      # deep-holder decode of a 300k-account mint
+#   python bench.py --webhook 1,2,4                    # bot.py in webhook mode with 1/2/4 worker processes
+#
+# Fixture file: {"mints": {mint: {"account": <getAccountInfo result>, "largest": <getTokenLargestAccounts
+# result>}}, "owners": {token_account: wallet}, "dexscreener": {mint: [pairs]}, "helius": {wallet: [txs]}}
+
+import os, sys, time, json, base64, random, shutil, signal, socket, asyncio, argparse, tempfile, threading, itertools, subprocess
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+
+import httpx
+
+os.environ.setdefault("BOT_TOKEN", "0:bench")   # bot.py refuses to import without one
+os.environ.setdefault("SNAPSHOT_DIR", "")        # synthetic checks are not history
+import bot
+
+try:
+    import websockets
+except ImportError:
+    websockets = None
+
+# ================== FIXTURES ==================
+B58 = "123456789ABCDEFGHJKLMNPQRSTUVWXYZabcdefghijkmnopqrstuvwxyz"
+
+def fake_addr(rng: random.Random) -> str:
+    """Random 32-byte public key, base58-encoded (passes the bot's address validation)."""
+    raw = rng.randbytes(32)
+    n, out = int.from_bytes(raw, "big"), ""
+    while n:
+        n, r = divmod(n, 58)
+        out = B58[r] + out
+    return "1" * (len(raw) - len(raw.lstrip(b"\0"))) + out
+
+def synthetic_fixtures(n_mints=40, n_wallets=1500, seed=7) -> dict:
+    rng = random.Random(seed)
+    wallets = [fake_addr(rng) for _ in range(n_wallets)]
+    hubs = wallets[:5]                 # exchange / LP-vault style wallets everybody touches
+    funders = wallets[5:40]
+    fx = {"mints": {}, "owners": {}, "dexscreener": {}, "helius": {}}
+    for _ in range(n_mints):
+        mint = fake_addr(rng)
+        decimals = 6
+        supply = 10**9 * 10**decimals
+        holders = rng.sample(wallets[40:], 18) + rng.sample(hubs, 2)
+        amounts = sorted((rng.paretovariate(1.2) for _ in holders), reverse=True)
+        scale = supply * 0.8 / sum(amounts)
+        largest = []
+        for w, a in zip(holders, amounts):
+            ta = fake_addr(rng)
+            fx["owners"][ta] = w
+            raw = int(a * scale)
+            largest.append({"address": ta, "amount": str(raw), "decimals": decimals,
+                            "uiAmount": raw / 10**decimals, "uiAmountString": str(raw / 10**decimals)})
+        fx["mints"][mint] = {
+            "account": {"value": {"data": {"program": "spl-token", "parsed": {"info": {
+                "mintAuthority": None if rng.random() < 0.7 else fake_addr(rng),
+                "freezeAuthority": None if rng.random() < 0.8 else fake_addr(rng),
+                "decimals": decimals, "supply": str(supply)}}}}},
+            "largest": {"value": largest},
+        }
+        fx["dexscreener"][mint] = [{
+            "chainId": "solana", "url": f"https://dexscreener.com/solana/{mint}", "pairAddress": fake_addr(rng),
+            "priceUsd": f"{rng.uniform(0.00001, 2):.8f}", "liquidity": {"usd": rng.uniform(1_000, 500_000)},
+            "fdv": rng.uniform(1e4, 1e8), "volume": {"h24": rng.uniform(1e3, 2e6)},
+            "pairCreatedAt": int((time.time() - rng.uniform(3600, 30*86400)) * 1000),
+            "baseToken": {"address": mint, "symbol": "B" + mint[:3].upper(), "name": "Bench " + mint[:4]},
+            "info": {"websites": [{"url": "https://example.org"}]} if rng.random() < 0.6 else {},
+        }]
+    all_mints = list(fx["mints"])
+    for w in wallets:
+        txs = []
+        for k in range(bot.HELIUS_TX_WINDOW):
+            cp = rng.choice(hubs) if rng.random() < 0.3 else rng.choice(funders) if rng.random() < 0.1 else rng.choice(wallets)
+            txs.append({"signature": f"{w[:8]}{k:04d}", "timestamp": 1_700_000_000 - k * 60,
+                        "tokenTransfers": [{"fromUserAccount": w, "toUserAccount": cp, "mint": rng.choice(all_mints), "tokenAmount": 1}],
+                        "nativeTransfers": [{"fromUserAccount": cp, "toUserAccount": w, "amount": 5000}] if rng.random() < 0.2 else []})
+        fx["helius"][w] = txs
+    return fx
+
+# ================== STAND-IN SERVERS ==================
+class Upstream:
+    """Latency / error model plus call counters for one stand-in server."""
+    def __init__(self, name, latency_ms, jitter_ms, rate429, fail_rate, seed):
+        self.name, self.latency_ms, self.jitter_ms = name, latency_ms, jitter_ms
+        self.rate429, self.fail_rate = rate429, fail_rate
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.calls = self.throttled = self.failed = self.bytes = 0
+
+    def roll(self):
+        """Sleep for the simulated latency; returns 429 / 500 / None."""
+        with self.lock:
+            self.calls += 1
+            delay = max(0.0, self.rng.gauss(self.latency_ms, self.jitter_ms)) / 1000
+            r = self.rng.random()
+        time.sleep(delay)
+        if r < self.rate429:
+            with self.lock: self.throttled += 1
+            return 429
+        if r < self.rate429 + self.fail_rate:
+            with self.lock: self.failed += 1
+            return 500
+        return None
+
+    def reset(self):
+        with self.lock: self.calls = self.throttled = self.failed = self.bytes = 0
+
+def make_handler(up: Upstream, route):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+        def log_message(self, *a): pass
+
+        def _reply(self, code, body, headers=()):
+            data = json.dumps(body).encode()
+            with up.lock: up.bytes += len(data)
+            try:
+                self.send_response(code)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                for k, v in headers: self.send_header(k, v)
+                self.end_headers()
+                self.wfile.write(data)
+            except (BrokenPipeError, ConnectionResetError):   # the client cancelled (a lost hedge race)
+                self.close_connection = True
+
+        def _handle(self, payload):
+            err = up.roll()
+            if err == 429: return self._reply(429, {"error": "rate limited"}, [("Retry-After", "1")])
+            if err:        return self._reply(500, {"error": "upstream failure"})
+            code, body = route(urlparse(self.path), payload)
+            self._reply(code, body)
+
+        def do_GET(self):  self._handle(None)
+        def do_POST(self):
+            n = int(self.headers.get("Content-Length") or 0)
+            self._handle(json.loads(self.rfile.read(n) or b"null"))
+    return Handler
+
+def program_accounts(n: int, seed: int) -> list:
+    """n token accounts (40-byte owner+amount slices, as requested by the deep-holder mode);
+    a few wallets hold several accounts and every 7th account is empty."""
+    rng = random.Random(seed)
+    owners = [rng.randbytes(32) for _ in range(max(1, n - n // 50))]
+    out = []
+    for i in range(n):
+        amount = 0 if i % 7 == 0 else int(rng.paretovariate(1.1) * 1000)
+        data = base64.b64encode(owners[i % len(owners)] + amount.to_bytes(8, "little")).decode()
+        out.append({"account": {"data": [data, "base64"], "executable": False, "lamports": 2039280,
+                                "owner": bot.TOKEN_PROGRAM, "rentEpoch": 18446744073709551615, "space": 165},
+                    "pubkey": "T" * 44})
+    return out
+
+def rpc_route(fx, deep=0, seed=7):
+    gpa = []
+    def one(req):
+        method, params = req.get("method"), req.get("params") or []
+        m = fx["mints"].get(params[0]) if params and isinstance(params[0], str) else None
+        if method == "getAccountInfo":
+            result = m["account"] if m else {"value": None}
+        elif method == "getTokenLargestAccounts":
+            result = m["largest"] if m else {"value": []}
+        elif method == "getMultipleAccounts":
+            result = {"value": [{"data": {"program": "spl-token", "parsed": {"info": {"owner": fx["owners"][a]}}}}
+                                if a in fx["owners"] else None for a in params[0]]}
+        elif method == "getSlot":
+            result = 250_000_000
+        elif method == "getProgramAccounts" and deep:
+            if not gpa: gpa.extend(program_accounts(deep, seed))
+            result = gpa
+        else:
+            return {"jsonrpc": "2.0", "id": req.get("id"), "error": {"code": -32601, "message": "method not found"}}
+        return {"jsonrpc": "2.0", "id": req.get("id"), "result": result}
+    def route(url, payload):
+        return 200, [one(r) for r in payload] if isinstance(payload, list) else one(payload)
+    return route
+
+def dex_route(fx):
+    def route(url, payload):
+        if url.path.startswith("/token-boosts/"):
+            return 200, [{"chainId": "solana", "tokenAddress": m, "amount": 100} for m in fx.get("boosts", [])]
+        mints = url.path.rsplit("/", 1)[-1].split(",")
+        return 200, {"pairs": [p for m in mints for p in fx["dexscreener"].get(m, [])]}
+    return route
+
+def helius_route(fx):
+    def route(url, payload):
+        addr = url.path.split("/addresses/")[1].split("/")[0]
+        q = {k: v[0] for k, v in parse_qs(url.query).items()}
+        txs = fx["helius"].get(addr, [])
+        sigs = [t["signature"] for t in txs]
+        lo = sigs.index(q["before"]) + 1 if q.get("before") in sigs else 0   # older than `before`
+        hi = sigs.index(q["until"]) if q.get("until") in sigs else len(txs)  # newer than `until`
+        return 200, txs[lo:min(hi, lo + int(q.get("limit", 100)))]
+    return route
+
+def add_activity(fx, per_wallet: int, seed: int):
+    """Prepends `per_wallet` new transactions to every wallet history (time moves on)."""
+    rng = random.Random(seed)
+    wallets, mints = list(fx["helius"]), list(fx["mints"])
+    for w, txs in fx["helius"].items():
+        fresh = [{"signature": f"{w[:8]}n{len(txs) + k:05d}", "timestamp": int(time.time()) + k,
+                  "tokenTransfers": [{"fromUserAccount": w, "toUserAccount": rng.choice(wallets), "mint": rng.choice(mints), "tokenAmount": 1}],
+                  "nativeTransfers": []} for k in range(per_wallet)]
+        fx["helius"][w] = fresh[::-1] + txs
+
+def serve(handler) -> ThreadingHTTPServer:
+    srv = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    srv.daemon_threads = True
+    threading.Thread(target=srv.serve_forever, daemon=True).start()
+    return srv
+
+class FakeBotApi:
+    """Stand-in Telegram Bot API (TELEGRAM_API_BASE) for webhook mode: answers the methods the bot
+    calls and counts per chat the CA prompts and the reports that arrived complete (no section loading)."""
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.ids = itertools.count(1)
+        self.calls, self.prompts, self.reports = {}, {}, {}   # method -> n | chat_id -> n
+
+    def call(self, method: str, p: dict):
+        with self.lock: self.calls[method] = self.calls.get(method, 0) + 1
+        if method == "getMe":
+            return {"id": 1, "is_bot": True, "first_name": "Phoenix", "username": "phoenix_bench_bot"}
+        if method == "getChatMember":
+            return {"status": "member", "user": {"id": int(p.get("user_id", 0)), "is_bot": False, "first_name": "u"}}
+        if method in ("sendMessage", "editMessageText"):
+            chat = int(p.get("chat_id", 0))
+            text = str(p.get("text", ""))
+            seen = self.prompts if "contract address" in text else \
+                   self.reports if "Safety" in text and "⏳" not in text else None   # complete, or the edit that completed it
+            if seen is not None:
+                with self.lock: seen[chat] = seen.get(chat, 0) + 1
+            return {"message_id": int(p.get("message_id") or next(self.ids)), "date": int(time.time()),
+                    "chat": {"id": chat, "type": "private"}, "text": str(p.get("text", ""))}
+        return True
+
+    def count(self, method: str) -> int:
+        with self.lock: return self.calls.get(method, 0)
+
+def make_botapi_handler(api: FakeBotApi):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+        def log_message(self, *a): pass
+
+        def do_POST(self):
+            raw = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+            if "json" in (self.headers.get("Content-Type") or ""):
+                p = json.loads(raw or b"{}")
+            else:   # PTB posts form fields, non-strings JSON-encoded
+                p = {k: v[0] for k, v in parse_qs(raw.decode()).items()}
+            data = json.dumps({"ok": True, "result": api.call(self.path.rsplit("/", 1)[-1], p)}).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+        do_GET = do_POST
+    return Handler
+
+class WsReplay:
+    """Stand-in RPC WebSocket: acks subscriptions and replays balance changes on subscribed accounts."""
+    def __init__(self, fx, rate_hz, seed):
+        self.fx, self.rate_hz, self.rng = fx, rate_hz, random.Random(seed)
+        self.sent = 0
+
+    async def handler(self, ws):
+        subs, sid = {}, 0
+        async def pump():
+            while True:
+                await asyncio.sleep(1 / self.rate_hz)
+                if not subs: continue
+                s, acct = self.rng.choice(list(subs.items()))
+                amount = int(self.rng.uniform(1, 5e8) * 10**6)
+                await ws.send(json.dumps({"jsonrpc": "2.0", "method": "accountNotification", "params": {
+                    "subscription": s, "result": {"value": {"data": {"parsed": {"info": {"tokenAmount": {"amount": str(amount)}}}}}}}}))
+                self.sent += 1
+        task = asyncio.create_task(pump())
+        try:
+            async for raw in ws:
+                m = json.loads(raw)
+                if m["method"] == "accountSubscribe":
+                    sid += 1; subs[sid] = m["params"][0]
+                    await ws.send(json.dumps({"jsonrpc": "2.0", "id": m["id"], "result": sid}))
+                elif m["method"].endswith("Subscribe"):
+                    sid += 1
+                    await ws.send(json.dumps({"jsonrpc": "2.0", "id": m["id"], "result": sid}))
+                elif m["method"].endswith("Unsubscribe"):
+                    subs.pop(m["params"][0], None)
+                    await ws.send(json.dumps({"jsonrpc": "2.0", "id": m["id"], "result": True}))
+        except websockets.ConnectionClosed:
+            pass
+        finally:
+            task.cancel()
+
+# ================== FAKE TELEGRAM OBJECTS ==================
+class FakeBot:
+    def __init__(self): self.sent = 0
+    async def get_chat_member(self, chat_id, user_id): return type("M", (), {"status": "member"})()
+    async def send_message(self, chat_id, text, **kw): self.sent += 1
+    async def edit_message_text(self, text, **kw): self.sent += 1
+
+class FakeMessage:
+    def __init__(self, text, bot): self.text, self.bot, self.chat_id, self.message_id = text, bot, 1, 1
+    async def reply_text(self, text, **kw):
+        self.bot.sent += 1
+        return self
+    async def edit_text(self, text, **kw):
+        self.bot.sent += 1
+        return self
+
+class FakeUpdate:
+    def __init__(self, uid, text, bot):
+        self.message = self.effective_message = FakeMessage(text, bot)
+        self.effective_user = type("U", (), {"id": uid})()
+        self.effective_chat = type("C", (), {"id": uid})()
+
+class FakeContext:
+    def __init__(self, bot): self.bot, self.args, self.bot_data, self.user_data = bot, [], {}, {}
+
+# ================== DRIVER ==================
+def pct(xs, p):
+    if not xs: return 0.0
+    xs = sorted(xs)
+    return xs[min(len(xs)-1, int(round(p/100 * (len(xs)-1))))]
+
+async def run_checks(mints, users, checks, skew, seed):
+    rng = random.Random(seed)
+    fbot = FakeBot()
+    weights = [1 / (i + 1) ** skew for i in range(len(mints))]   # Zipf-like: a few trending mints
+    lat, errors = [], 0
+    async def user(uid):
+        nonlocal errors
+        for _ in range(checks):
+            mint = rng.choices(mints, weights)[0]
+            t0 = time.perf_counter()
+            try:
+                await bot.check_receive_ca(FakeUpdate(uid, mint, fbot), FakeContext(fbot))
+            except Exception:
+                errors += 1
+            lat.append((time.perf_counter() - t0) * 1000)
+    t0 = time.perf_counter()
+    await asyncio.gather(*(user(u) for u in range(1, users + 1)))
+    return lat, time.perf_counter() - t0, errors
+
+async def run_price_job(mints, alerts, seed):
+    rng = random.Random(seed)
+    for i in range(alerts):
+        bot.alert_book.add(1, i, rng.choice(mints), "price", rng.choice(["above", "below"]), rng.uniform(0.00001, 2))
+    fbot = FakeBot()
+    t0 = time.perf_counter()
+    await bot.price_alerts_job(FakeContext(fbot))
+    return (time.perf_counter() - t0) * 1000, fbot.sent
+
+async def run_whale(mints, seconds):
+    fbot = FakeBot()
+    w = bot.whale_watcher
+    w.bot = fbot
+    for m in mints: w.watch(m, 1, 1, 1.0)
+    task = asyncio.create_task(w.run())
+    await asyncio.sleep(seconds)
+    task.cancel()
+    await asyncio.gather(task, return_exceptions=True)
+    return w.stats(), fbot.sent
+
+async def run_webhook(workers, upstreams, mints, users, checks, skew, seed, helius_rps=None, timeout=300):
+    """bot.py as a subprocess in webhook mode against the stand-ins; users post /check and, once
+    asked for it, the CA, as Telegram would deliver them; a check ends when its report is complete.
+    (Like a person, a user repeats an unanswered /check: while the previous check_receive_ca is
+    still finishing, the conversation ignores the user.)"""
+    api = FakeBotApi()
+    api_srv = serve(make_botapi_handler(api))
+    with socket.socket() as sk:
+        sk.bind(("127.0.0.1", 0)); port = sk.getsockname()[1]
+    tmp = tempfile.mkdtemp(prefix="phoenix-webhook-")
+    env = {**os.environ, "ENV_FILE": os.devnull, "BOT_TOKEN": "0:bench", "GROUP_USERNAME": "@bench",
+           "TELEGRAM_API_BASE": f"http://127.0.0.1:{api_srv.server_address[1]}",
+           "WEBHOOK_URL": f"http://127.0.0.1:{port}/telegram", "WEBHOOK_LISTEN": "127.0.0.1", "WEBHOOK_PORT": str(port),
+           "WEBHOOK_SECRET": "bench", "WEBHOOK_WORKERS": str(workers), "CACHE_DB": os.path.join(tmp, "cache.sqlite"),
+           "RPC_URL": upstreams["rpc"] + "/a", "FALLBACK_RPC": upstreams["rpc"] + "/b", "SECOND_RPC": "",
+           "DEXSCREENER_BASE": upstreams["dexscreener"], "HELIUS_BASE": upstreams["helius"], "HELIUS_KEY": "bench",
+           "HELIUS_RPS": str(helius_rps or 1000), "HELIUS_BURST": str(int(helius_rps or 1000)),
+           "USER_CHECK_RATE": "1e6", "USER_CHECK_BURST": "1000000", "SNAPSHOT_DIR": "", "PREWARM_MAX": "0", "METRICS_PORT": "0"}
+    proc = subprocess.Popen([sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), "bot.py")],
+                            env=env, stdout=subprocess.DEVNULL, stderr=subprocess.STDOUT)
+    try:
+        t0 = time.perf_counter()
+        while api.count("setWebhook") < 1 or api.count("getMe") < workers + 1:   # ingress + every worker up
+            if proc.poll() is not None or time.perf_counter() - t0 > 60:
+                raise RuntimeError("webhook mode did not start")
+            await asyncio.sleep(0.05)
+        rng = random.Random(seed)
+        weights = [1 / (i + 1) ** skew for i in range(len(mints))]
+        ids, lat = itertools.count(1), []
+        async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{port}", headers={"X-Telegram-Bot-Api-Secret-Token": "bench"}) as http:
+            async def post(uid, text):
+                n = next(ids)
+                msg = {"message_id": n, "date": int(time.time()), "text": text, "chat": {"id": uid, "type": "private"},
+                       "from": {"id": uid, "is_bot": False, "first_name": f"u{uid}"}}
+                if text.startswith("/"): msg["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text)}]
+                r = await http.post("/telegram", json={"update_id": n, "message": msg})
+                r.raise_for_status()
+            async def wait_for(seen, uid, n, t, patience):
+                while seen.get(uid, 0) < n:
+                    if time.perf_counter() - t > patience: return False
+                    await asyncio.sleep(0.01)
+                return True
+            async def user(uid):
+                for k in range(checks):
+                    t = time.perf_counter()
+                    while True:
+                        await post(uid, "/check")
+                        if await wait_for(api.prompts, uid, api.prompts.get(uid, 0) + 1, time.perf_counter(), 0.5): break
+                        if time.perf_counter() - t > timeout: raise TimeoutError(f"user {uid}: /check unanswered")
+                    await post(uid, rng.choices(mints, weights)[0])
+                    if not await wait_for(api.reports, uid, k + 1, t, timeout):
+                        raise TimeoutError(f"user {uid}: no report")
+                    lat.append((time.perf_counter() - t) * 1000)
+            t0 = time.perf_counter()
+            await asyncio.gather(*(user(u) for u in range(1, users + 1)))
+            wall = time.perf_counter() - t0
+        return lat, wall, dict(api.calls)
+    finally:
+        proc.send_signal(signal.SIGINT)
+        try: proc.wait(60)
+        except subprocess.TimeoutExpired: proc.kill()
+        api_srv.shutdown()
+        shutil.rmtree(tmp, ignore_errors=True)
+
+def check_cache_counts():
+    return (bot._counters.get(("check_cache", (("result", "hit"),)), 0),
+            bot._counters.get(("check_cache", (("result", "miss"),)), 0))
+
+def check_hit_ratio(hits, misses):
+    return hits / (hits + misses) if hits + misses else 0.0
+
+def report(title, rows):
+    width = max(len(k) for k, _ in rows)
+    return "\n".join([title] + [f"  {k:<{width}}  {v}" for k, v in rows])
+
+async def main_async(a):
+    fx = json.load(open(a.fixtures)) if a.fixtures else synthetic_fixtures(a.mints, a.wallets, a.seed)
+    if a.save_fixtures:
+        json.dump(fx, open(a.save_fixtures, "w")); print("fixtures written to", a.save_fixtures); return
+    ups = {name: Upstream(name, a.latency, a.jitter, a.rate429, a.fail_rate, a.seed + i)
+           for i, name in enumerate(("rpc", "dexscreener", "helius"))}
+    routes = {"rpc": rpc_route(fx, a.deep, a.seed), "dexscreener": dex_route(fx), "helius": helius_route(fx)}
+    srv = {n: serve(make_handler(ups[n], routes[n])) for n in ups}
+    url = lambda n: f"http://127.0.0.1:{srv[n].server_address[1]}"
+    bot.configure_upstreams(rpc_urls=[url("rpc") + "/a", url("rpc") + "/b"], dexscreener=url("dexscreener"),
+                            helius=url("helius"), helius_key="bench")
+    bot.USER_CHECK_RATE, bot.USER_CHECK_BURST = 1e6, 10**6   # per-user limits guard humans, not synthetic load
+    if a.helius_rps:         # what-if for a different Helius plan
+        bot._helius_bucket = bot.TokenBucket(a.helius_rps, max(1, int(a.helius_rps)))
+    mints = list(fx["mints"])
+    out = []
+
+    lat, wall, errors = await run_checks(mints, a.users, a.checks, a.skew, a.seed)
+    n = len(lat)
+    helius_first = (ups["helius"].calls, ups["helius"].bytes)
+    first_hit = check_hit_ratio(*check_cache_counts())
+    first = bot._histograms["check.first_message"]
+    calls = {k: u.calls for k, u in ups.items()}
+    out.append(report(f"/check — {a.users} users × {a.checks} checks over {len(mints)} mints "
+                      f"(latency {a.latency}±{a.jitter} ms, 429 {a.rate429:.0%}, fail {a.fail_rate:.0%}, "
+                      f"Helius {bot._helius_bucket.rate:g} rps)", [
+        ("p50 / p95 / p99", f"{pct(lat,50):.0f} / {pct(lat,95):.0f} / {pct(lat,99):.0f} ms"),
+        ("first message p50 / p95", " / ".join(f"{first.quantile(q):.0f}" for q in (0.5, 0.95)) + " ms"),
+        ("throughput", f"{n / wall:.1f} checks/s ({n} in {wall:.1f} s, {errors} errors)"),
+        ("upstream calls/check", " | ".join(f"{k} {v / n:.2f}" for k, v in calls.items())),
+        ("429 / 5xx served", " | ".join(f"{k} {u.throttled}/{u.failed}" for k, u in ups.items())),
+        ("cache hit ratio", " | ".join(f"{k} {v['hit_ratio']:.0%}" for k, v in bot.cache_stats().items())),
+        ("coalesced", " | ".join(f"{k} {v['coalesced']}" for k, v in bot.flight_stats().items())),
+        ("scheduler", "{ran} slotted | {fast} cached fast-path | {rejected} rejected | ".format(**bot.work_scheduler.stats())
+                      + f"{bot._counters.get(('scheduler_deferred', ()), 0)} Helius-deferred"),
+    ]))
+
+    if a.new_txs >= 0:
+        # the same traffic again once every report piece and history is stale: histories are
+        # re-synced from their signature cursor instead of being downloaded again
+        add_activity(fx, a.new_txs, a.seed)
+        for c in (bot._mint_cache, bot._holders_cache, bot._dex_cache, bot._bmap_cache, bot._wallets_cache): c._data.clear()
+        bot.HELIUS_CACHE_TTL, ttl = 0, bot.HELIUS_CACHE_TTL
+        for u in ups.values(): u.reset()
+        lat2, _, _ = await run_checks(mints, a.users, a.checks, a.skew, a.seed)
+        bot.HELIUS_CACHE_TTL = ttl
+        n2 = len(lat2)
+        out.append(report(f"/check again after staleness ({a.new_txs} new txs per wallet)", [
+            ("p50 / p95", f"{pct(lat2,50):.0f} / {pct(lat2,95):.0f} ms"),
+            ("helius calls/check", f"{ups['helius'].calls / n2:.2f} (first run {helius_first[0] / n:.2f})"),
+            ("helius KB/check", f"{ups['helius'].bytes / n2 / 1024:.1f} (first run {helius_first[1] / n / 1024:.1f})"),
+        ]))
+
+    if a.prewarm:
+        # the pre-warmer's effect: Dexscreener boosts the most popular mints, it warms them while
+        # idle, then the same Zipf traffic arrives
+        fx["boosts"] = mints[:a.prewarm]
+        for c in (bot._mint_cache, bot._holders_cache, bot._dex_cache, bot._bmap_cache, bot._wallets_cache): c._data.clear()
+        bot.prewarmer.recent.clear(); bot.prewarmer.trending_at = 0
+        for u in ups.values(): u.reset()
+        t0 = time.perf_counter()
+        while True:
+            before = bot.prewarmer.refreshed
+            await bot.prewarmer.tick(per_tick=a.prewarm)
+            if bot.prewarmer.refreshed == before: break
+        warm_s, warm_calls = time.perf_counter() - t0, {k: u.calls for k, u in ups.items()}
+        h0, m0 = check_cache_counts()
+        lat3, _, _ = await run_checks(mints, a.users, a.checks, a.skew, a.seed + 1)
+        h1, m1 = check_cache_counts()
+        out.append(report(f"/check after pre-warming the top {a.prewarm} boosted mints", [
+            ("warm-up", f"{warm_s:.1f} s, " + " | ".join(f"{k} {v}" for k, v in warm_calls.items()) + " calls"),
+            ("p50 / p95", f"{pct(lat3,50):.0f} / {pct(lat3,95):.0f} ms (first run {pct(lat,50):.0f} / {pct(lat,95):.0f})"),
+            ("fully cached checks", f"{check_hit_ratio(h1 - h0, m1 - m0):.0%} (first run {first_hit:.0%})"),
+        ]))
+
+    if a.scan:
+        for c in bot.TTLCache.registry.values(): c._data.clear()   # a cold /scan, as for fresh launches
+        for u in ups.values(): u.reset()
+        scan = mints[:a.scan]
+        t0 = time.perf_counter()
+        rows = await bot.run_scan(scan)
+        wall = time.perf_counter() - t0
+        out.append(report(f"/scan — {len(scan)} mints, cold caches", [
+            ("wall time", f"{wall:.1f} s ({len(scan) / wall:.1f} mints/s, {sum(1 for r in rows if r['error'])} failed)"),
+            ("upstream calls/mint", " | ".join(f"{k} {u.calls / len(scan):.2f}" for k, u in ups.items()))]))
+
+    if a.deep:
+        t0 = time.perf_counter()
+        dist = await bot.fetch_holder_distribution(mints[0], 10**15)
+        wall = time.perf_counter() - t0
+        out.append(report(f"deep holders — {a.deep:,} token accounts via getProgramAccounts", [
+            ("wall time", f"{wall:.1f} s (incl. serving the JSON body)"),
+            ("holders", f"{dist['holders']:,} wallets from {dist['accounts']:,} accounts, Gini {dist['gini']:.3f}"),
+            ("kept in memory", f"{dist['funded'] * bot.HolderScan.REC.itemsize / 1e6:.1f} MB packed records "
+                               f"({dist['funded']:,} funded accounts × {bot.HolderScan.REC.itemsize} B)")]))
+
+    for u in ups.values(): u.reset()
+    ms, sent = await run_price_job(mints, a.alerts, a.seed)
+    out.append(report(f"price_alerts_job — {a.alerts} alerts over {len(mints)} mints", [
+        ("tick", f"{ms:.0f} ms"), ("dexscreener calls", ups["dexscreener"].calls), ("alerts fired", sent)]))
+
+    if websockets is not None and a.whale_seconds > 0:
+        replay = WsReplay(fx, a.whale_rate, a.seed)
+        async with websockets.serve(replay.handler, "127.0.0.1", 0) as ws_srv:
+            port = ws_srv.sockets[0].getsockname()[1]
+            bot.configure_upstreams(ws_urls=[f"ws://127.0.0.1:{port}"])
+            st, sent = await run_whale(mints[:a.whale_mints], a.whale_seconds)
+        out.append(report(f"whale watch — {a.whale_mints} mints for {a.whale_seconds:.0f} s", [
+            ("notifications replayed", replay.sent), ("events decoded", st["events"]),
+            ("alerts fired", sent), ("subscriptions", st["subscriptions"])]))
+
+    if a.webhook:
+        # every worker is a separate interpreter: they share the SQLite caches (each run starts cold)
+        # and split the Helius budget, so throughput is bounded by cores and upstream latency
+        rows, base = [], None
+        for w in [int(x) for x in a.webhook.split(",") if x.strip()]:
+            for u in ups.values(): u.reset()
+            lat4, wall, api_calls = await run_webhook(w, {n: url(n) for n in ups}, mints, a.users, a.checks,
+                                                      a.skew, a.seed, a.helius_rps)
+            rate = len(lat4) / wall
+            base = base or rate
+            rows.append((f"{w} worker{'s' if w > 1 else ''}", f"{rate:.1f} checks/s ({rate / base:.2f}x) | "
+                         f"p50 / p95 {pct(lat4,50):.0f} / {pct(lat4,95):.0f} ms | "
+                         f"{api_calls.get('sendMessage', 0)} sent, {api_calls.get('editMessageText', 0)} edits"))
+        out.append(report(f"webhook mode — {a.users} users × {a.checks} checks per worker count "
+                          f"({os.cpu_count()} cores)", rows))
+
+    await bot.close_http_clients()
+    for s in srv.values(): s.shutdown()
+    text = "\n\n".join(out)
+    print(text)
+    if a.out:
+        with open(a.out, "w", encoding="utf-8") as f: f.write(text + "\n")
+
+def main():
+    p = argparse.ArgumentParser(description="Offline /check, price-alert and whale-watch benchmark")
+    p.add_argument("--users", type=int, default=20)
+    p.add_argument("--checks", type=int, default=5, help="checks per user")
+    p.add_argument("--mints", type=int, default=40)
+    p.add_argument("--wallets", type=int, default=1500)
+    p.add_argument("--skew", type=float, default=1.1, help="Zipf exponent of mint popularity")
+    p.add_argument("--latency", type=float, default=60, help="mean upstream latency (ms)")
+    p.add_argument("--jitter", type=float, default=20, help="latency std-dev (ms)")
+    p.add_argument("--rate429", type=float, default=0.0)
+    p.add_argument("--fail-rate", type=float, default=0.0)
+    p.add_argument("--helius-rps", type=float, help="override HELIUS_RPS (plan sizing)")
+    p.add_argument("--scan", type=int, default=40, help="mints in the cold /scan run (0 = skip)")
+    p.add_argument("--deep", type=int, default=100_000, help="token accounts served to the deep-holder run (0 = skip)")
+    p.add_argument("--new-txs", type=int, default=2, help="new txs per wallet before the stale re-run (-1 = skip)")
+    p.add_argument("--prewarm", type=int, default=10, help="boosted mints the pre-warmer warms before a re-run (0 = skip)")
+    p.add_argument("--webhook", default="", help="worker counts for the webhook-mode run, e.g. 1,2,4 (empty = skip)")
+    p.add_argument("--alerts", type=int, default=2000)
+    p.add_argument("--whale-mints", type=int, default=5)
+    p.add_argument("--whale-seconds", type=float, default=3)
+    p.add_argument("--whale-rate", type=float, default=200, help="replayed notifications per second")
+    p.add_argument("--seed", type=int, default=7)
+    p.add_argument("--fixtures", help="replay this fixture JSON instead of the synthetic set")
+    p.add_argument("--save-fixtures", help="write the synthetic fixture set and exit")
+    p.add_argument("--out", help="also write the report to this file (e.g. bench_output.txt)")
+    asyncio.run(main_async(p.parse_args()))
+
+if __name__ == "__main__":
+    main()
@@ -2,19 +2,31 @@
 # Features: Overview, DEX/LP risk, Bubble-Map (Helius), Rug-Flags, Top-Holders, Wallet-Links, Membership Gate
 # Safe JobQueue guard (starts even if job-queue extra is missing)
 
-import os, time, requests, threading, html
-from collections import defaultdict
-from urllib.parse import urlencode
+import os, re, io, csv, time, base64, asyncio, html, json, sqlite3, threading, functools, bisect, itertools
+import hmac, queue, signal, secrets, multiprocessing
+import httpx
+import numpy as np
+try:
+    import websockets                      # whale watch streams; bot still runs without it
+except ImportError:
+    websockets = None
+from collections import OrderedDict, deque
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlparse
 from datetime import datetime, timezone
 from dotenv import load_dotenv
-from telegram import Update, InlineKeyboardMarkup, InlineKeyboardButton
+from telegram import (
+    Bot, Update, InlineKeyboardMarkup, InlineKeyboardButton,
+    InlineQueryResultArticle, InlineQueryResultsButton, InputTextMessageContent
+)
+from telegram.error import BadRequest, RetryAfter, TelegramError
 from telegram.ext import (
     ApplicationBuilder, CommandHandler, ContextTypes,
-    ConversationHandler, MessageHandler, filters
+    ConversationHandler, MessageHandler, ChatMemberHandler, InlineQueryHandler, filters
 )
 
 # ================== ENV ==================
-load_dotenv(override=True)
+load_dotenv(os.getenv("ENV_FILE") or None, override=True)   # ENV_FILE: another file than ./.env
 BOT_TOKEN       = os.getenv("BOT_TOKEN")
 PRIMARY_RPC     = os.getenv("RPC_URL", "https://api.mainnet-beta.solana.com")
 FALLBACK_RPC    = os.getenv("FALLBACK_RPC", "https://solana-rpc.publicnode.com")
@@ -22,11 +34,23 @@ SECOND_RPC      = os.getenv("SECOND_RPC")
 GROUP_USERNAME  = os.getenv("GROUP_USERNAME", "@PHX2025New")
 GROUP_JOIN_LINK = os.getenv("GROUP_JOIN_LINK", "https://t.me/PHX2025New")
 HELIUS_KEY      = os.getenv("HELIUS_KEY")
+HELIUS_CONCURRENCY = int(os.getenv("HELIUS_CONCURRENCY", "6"))   # parallel in-flight Helius requests
+HELIUS_RPS         = float(os.getenv("HELIUS_RPS", "8"))         # sustained req/s allowed by the Helius plan
+HELIUS_BURST       = int(os.getenv("HELIUS_BURST", "10"))
+HELIUS_CACHE_SIZE  = int(os.getenv("HELIUS_CACHE_SIZE", "2000"))   # addresses kept in the history store
+HELIUS_CACHE_TTL   = int(os.getenv("HELIUS_CACHE_TTL", "600"))       # a history younger than this is not re-synced
+HELIUS_HISTORY_TTL = int(os.getenv("HELIUS_HISTORY_TTL", "86400"))   # how long a cursor + window is kept for incremental sync
+BUBBLEMAP_MAX_HOLDERS = int(os.getenv("BUBBLEMAP_MAX_HOLDERS", "100"))   # graph nodes (holder wallets)
+HELIUS_TX_WINDOW   = 100   # newest transactions kept per address (one full page)
+HELIUS_PAGE        = 100   # max `limit` of the enhanced transactions API
 
 if not BOT_TOKEN:
     raise SystemExit("BOT_TOKEN missing in .env")
 
 RPC_LIST = [u for u in [PRIMARY_RPC, FALLBACK_RPC, SECOND_RPC] if u and u.startswith("http")]
+# WebSocket endpoints for whale watch (default: the RPC URLs with ws:// / wss://)
+WS_LIST = [u.strip() for u in os.getenv("WHALE_WS_URLS", "").split(",") if u.strip()] or \
+          ["ws" + u[4:] for u in RPC_LIST]
 print("RPCs:", " | ".join(RPC_LIST))
 print("Gate group:", GROUP_USERNAME)
 print("Helius key:", "set" if HELIUS_KEY else "not set")
@@ -34,50 +58,779 @@ print("Helius key:", "set" if HELIUS_KEY else "not set")
 # ================== GLOBALS / UTILS ==================
 TIMEOUT = 20
 MAX_TRIES = 2
-USER_COOLDOWN_SEC = 1.0
-CACHE_TTL = 300
 USDC = "EPjFWdd5AufqSSqeM2qN1xzybapC8G4wEGGkZwyTDt1v"
 
-_last_call = defaultdict(float)
-_cache = {}
-_cache_lock = threading.Lock()
+# per-source TTLs for the analysis pieces a report is built from
+ANALYSIS_CACHE_SIZE = int(os.getenv("ANALYSIS_CACHE_SIZE", "5000"))   # mints per tier
+MINT_TTL    = int(os.getenv("MINT_TTL", "3600"))     # decimals / supply / authorities
+HOLDERS_TTL = int(os.getenv("HOLDERS_TTL", "600"))   # largest accounts + owners
+DEX_TTL     = int(os.getenv("DEX_TTL", "60"))        # Dexscreener price / liquidity
+LINKS_TTL   = int(os.getenv("LINKS_TTL", "900"))     # Helius Bubble-Map + Wallet Links
+DEEP_TTL    = int(os.getenv("DEEP_TTL", "1800"))     # full holder distribution (getProgramAccounts)
+
+MEMBER_TTL_POS = int(os.getenv("MEMBER_TTL_POS", "900"))   # cached "is a member"
+MEMBER_TTL_NEG = int(os.getenv("MEMBER_TTL_NEG", "60"))    # cached "not a member" (re-checked sooner)
+
+# optional on-disk cache (survives restarts, shareable between processes on one host)
+CACHE_DB        = os.getenv("CACHE_DB")                          # e.g. /data/phoenix-cache.sqlite
+CACHE_DB_MAX_MB = float(os.getenv("CACHE_DB_MAX_MB", "256"))
+CACHE_FLUSH_SEC = float(os.getenv("CACHE_FLUSH_SEC", "2"))
+
+# Webhook mode runs several worker processes; per-user state (conversations, alerts, whale
+# watches) lives only in the worker that owns the user. One process = shard 0 of 1.
+SHARD_INDEX, SHARD_COUNT = 0, 1
+
+def owns_user(uid: int) -> bool:
+    return int(uid) % SHARD_COUNT == SHARD_INDEX
+
+class TTLCache:
+    """Size-bounded LRU with per-entry expiry and hit/miss counters."""
+    registry = {}
+
+    def __init__(self, name: str, maxsize: int, ttl: float, register=True, persistent=True):
+        self.name, self.maxsize, self.ttl = name, max(1, int(maxsize)), float(ttl)
+        self.persistent = persistent   # eligible for CACHE_DB (JSON values, str keys)
+        self._data = OrderedDict()   # key -> (expires_at, value)
+        self.hits = self.misses = self.evictions = 0
+        self.store = None            # PersistentStore when CACHE_DB is set
+        if register: TTLCache.registry[name] = self
+
+    def get(self, key, default=None, count=True):
+        item = self._data.get(key)
+        if item is not None and item[0] < time.time():
+            del self._data[key]
+            item = None
+        if item is None:
+            if count: self.misses += 1
+            return default
+        self._data.move_to_end(key)
+        if count: self.hits += 1
+        return item[1]
+
+    def record(self, hit: bool):
+        if hit: self.hits += 1
+        else:   self.misses += 1
+
+    async def aget(self, key, default=None, count=True):
+        """get() with read-through to the on-disk store (entries written by an earlier run or another process)."""
+        value = self.get(key, count=False)
+        if value is None and self.store is not None:
+            row = await asyncio.to_thread(self.store.get, self.name, key)
+            if row is not None:
+                value, expires = row
+                self.set(key, value, ttl=expires - time.time(), persist=False)
+        if count: self.record(value is not None)
+        return default if value is None else value
+
+    def set(self, key, value, ttl=None, persist=True):
+        expires = time.time() + (self.ttl if ttl is None else ttl)
+        self._data[key] = (expires, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+            self.evictions += 1
+        if persist and self.store is not None:
+            self.store.put(self.name, key, value, expires)
+
+    def pop(self, key, default=None):
+        item = self._data.pop(key, None)
+        return default if item is None else item[1]
+
+    def expires_in(self, key):
+        """Seconds until the in-memory entry expires (None if absent)."""
+        item = self._data.get(key)
+        return None if item is None else item[0] - time.time()
+
+    def __len__(self): return len(self._data)
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {"size": len(self._data), "max": self.maxsize, "hits": self.hits, "misses": self.misses,
+                "evictions": self.evictions, "hit_ratio": round(self.hits/total, 3) if total else 0.0}
+
+def cache_stats() -> dict:
+    return {name: c.stats() for name, c in TTLCache.registry.items()}
+
+# ================== SINGLE-FLIGHT ==================
+class SingleFlight:
+    """Concurrent calls with the same key await one shared in-flight task instead of each doing the work."""
+    registry = {}
+
+    def __init__(self, name: str):
+        self.name = name
+        self._inflight = {}
+        self.calls = self.coalesced = 0
+        SingleFlight.registry[name] = self
+
+    async def do(self, key, fn, *args, **kwargs):
+        task = self._inflight.get(key)
+        if task is not None:
+            self.coalesced += 1
+        else:
+            self.calls += 1
+            task = asyncio.ensure_future(fn(*args, **kwargs))
+            self._inflight[key] = task
+            task.add_done_callback(lambda t, k=key: self._inflight.pop(k, None) if self._inflight.get(k) is t else None)
+        # shield: one impatient caller being cancelled must not cancel the work for the others
+        return await asyncio.shield(task)
+
+    def stats(self) -> dict:
+        return {"calls": self.calls, "coalesced": self.coalesced, "inflight": len(self._inflight)}
+
+def coalesce(name: str, key=lambda *a, **kw: (a[0], bool(kw.get("fresh")))):
+    """Decorator: single-flight an async function, keyed by its first argument by default.
+    A `fresh=True` call never joins a plain one, whose result may come from the cache it must bypass."""
+    sf = SingleFlight(name)
+    def deco(fn):
+        @functools.wraps(fn)
+        async def wrapper(*a, **kw):
+            return await sf.do(key(*a, **kw), fn, *a, **kw)
+        wrapper.flight = sf
+        return wrapper
+    return deco
+
+def flight_stats() -> dict:
+    return {name: sf.stats() for name, sf in SingleFlight.registry.items()}
+
+# ================== PERSISTENT CACHE (SQLite) ==================
+class PersistentStore:
+    """Write-behind SQLite backing for TTLCache tiers.
+
+    Handlers only touch an in-memory pending dict; a background task flushes it in a worker
+    thread every CACHE_FLUSH_SEC and compacts the file when it grows past CACHE_DB_MAX_MB.
+    WAL mode lets several bot processes on one host share the file.
+    """
+    def __init__(self, path: str, max_mb: float = CACHE_DB_MAX_MB):
+        self.path, self.max_bytes = path, int(max_mb * 1024 * 1024)
+        self._pending = {}            # (ns, key) -> (expires_at, value)
+        self._lock = threading.Lock()  # one sqlite connection, used from worker threads
+        self._conn = sqlite3.connect(path, timeout=10, check_same_thread=False)
+        self._conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS kv (ns TEXT, k TEXT, v TEXT, expires REAL, PRIMARY KEY (ns, k))")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS kv_expires ON kv (expires)")
+        self._conn.commit()
+        self.writes = self.flushes = self.compactions = 0
+
+    def put(self, ns: str, key, value, expires: float):
+        self._pending[(ns, str(key))] = (expires, value)
+
+    def delete(self, ns: str, key):
+        self._pending[(ns, str(key))] = (0.0, None)
+
+    def get(self, ns: str, key):
+        with self._lock:
+            row = self._conn.execute("SELECT v, expires FROM kv WHERE ns=? AND k=? AND expires>?",
+                                     (ns, str(key), time.time())).fetchone()
+        return (json.loads(row[0]), row[1]) if row else None
+
+    def load(self, ns: str, limit: int) -> list:
+        """Live rows of one namespace, soonest-expiring first (so the freshest end up most recent in the LRU)."""
+        with self._lock:
+            rows = self._conn.execute("SELECT k, v, expires FROM kv WHERE ns=? AND expires>? ORDER BY expires DESC LIMIT ?",
+                                      (ns, time.time(), limit)).fetchall()
+        return [(k, json.loads(v), exp) for k, v, exp in reversed(rows)]
+
+    def take(self) -> dict:
+        """Swap out the pending writes (call on the event loop, then hand the batch to flush())."""
+        batch, self._pending = self._pending, {}
+        return batch
+
+    def flush(self, batch=None):
+        batch = self.take() if batch is None else batch
+        if not batch: return
+        rows = [(ns, k, json.dumps(v, separators=(",", ":")), exp) for (ns, k), (exp, v) in batch.items() if v is not None]
+        gone = [(ns, k) for (ns, k), (exp, v) in batch.items() if v is None]
+        with self._lock:
+            self._conn.executemany("INSERT OR REPLACE INTO kv (ns, k, v, expires) VALUES (?, ?, ?, ?)", rows)
+            self._conn.executemany("DELETE FROM kv WHERE ns=? AND k=?", gone)
+            self._conn.commit()
+        self.writes += len(rows); self.flushes += 1
+
+    def size(self) -> int:
+        return sum(os.path.getsize(p) for p in (self.path, self.path + "-wal") if os.path.exists(p))
+
+    def compact(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM kv WHERE expires<=?", (time.time(),))
+            if self.size() > self.max_bytes:   # still too big: drop the fifth closest to expiry
+                n = self._conn.execute("SELECT COUNT(*) FROM kv").fetchone()[0]
+                self._conn.execute("DELETE FROM kv WHERE rowid IN (SELECT rowid FROM kv ORDER BY expires LIMIT ?)", (max(1, n // 5),))
+            self._conn.commit()
+            self._conn.execute("PRAGMA incremental_vacuum")
+            self._conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        self.compactions += 1
+
+    async def run(self):
+        n = 0
+        while True:
+            await asyncio.sleep(CACHE_FLUSH_SEC)
+            try:
+                await asyncio.to_thread(self.flush, self.take())
+                n += 1
+                if n % 150 == 0 or self.size() > self.max_bytes:
+                    await asyncio.to_thread(self.compact)
+            except sqlite3.Error as e:
+                print("cache db:", e)
+
+    def close(self):
+        self.flush()
+        with self._lock:
+            self._conn.close()
+
+    def stats(self) -> dict:
+        return {"path": self.path, "size_mb": round(self.size() / 1048576, 1), "pending": len(self._pending),
+                "writes": self.writes, "flushes": self.flushes, "compactions": self.compactions}
+
+_store = None
+
+async def open_persistent_cache():
+    """Attach CACHE_DB to all registered caches and load their live entries (TTL-aware)."""
+    global _store
+    if not CACHE_DB: return
+    _store = await asyncio.to_thread(PersistentStore, CACHE_DB)
+    for name, cache in TTLCache.registry.items():
+        if not cache.persistent: continue
+        rows = await asyncio.to_thread(_store.load, name, cache.maxsize)
+        for k, v, exp in rows:
+            cache.set(k, v, ttl=exp - time.time(), persist=False)
+        cache.store = _store
+        if rows: print(f"cache {name}: {len(rows)} entries restored")
+    spawn(_store.run())
+
+async def close_persistent_cache():
+    if _store is not None:
+        await asyncio.to_thread(_store.close)
 
 ASK_CA_CHECK = 100  # conversation state
 
-def rpc(method: str, params: list):
-    last_err = None
-    for url in RPC_LIST:
+# ================== METRICS ==================
+ADMIN_IDS    = {int(x) for x in os.getenv("ADMIN_IDS", "").replace(" ", "").split(",") if x.lstrip("-").isdigit()}
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))   # Prometheus text endpoint on 127.0.0.1; 0 = off
+
+class RollingHistogram:
+    """Latency histogram with fixed log-spaced buckets.
+
+    Quantiles for /stats come from a sliding window (SLOTS x SLOT_SEC ring of bucket counts);
+    cumulative buckets/sum/count are kept for Prometheus. observe() is one bisect + a few adds.
+    """
+    BOUNDS_MS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000, 60000)
+    SLOT_SEC, SLOTS = 60, 15
+
+    def __init__(self):
+        nb = len(self.BOUNDS_MS) + 1
+        self.ring = [[0]*nb for _ in range(self.SLOTS)]
+        self.ring_ids = [-1]*self.SLOTS
+        self.total = [0]*nb
+        self.count, self.sum = 0, 0.0
+
+    def observe(self, ms: float):
+        b = bisect.bisect_left(self.BOUNDS_MS, ms)
+        sid = int(time.monotonic() // self.SLOT_SEC)
+        k = sid % self.SLOTS
+        if self.ring_ids[k] != sid:
+            self.ring[k] = [0]*len(self.total); self.ring_ids[k] = sid
+        self.ring[k][b] += 1
+        self.total[b] += 1
+        self.count += 1; self.sum += ms
+
+    def window(self) -> list:
+        now = int(time.monotonic() // self.SLOT_SEC)
+        merged = [0]*len(self.total)
+        for sid, counts in zip(self.ring_ids, self.ring):
+            if now - sid < self.SLOTS:
+                merged = [a + b for a, b in zip(merged, counts)]
+        return merged
+
+    def quantile(self, q: float, counts=None):
+        counts = counts or self.window()
+        n = sum(counts)
+        if not n: return None
+        rank, seen = q * n, 0
+        for i, c in enumerate(counts):
+            seen += c
+            if seen >= rank:
+                return self.BOUNDS_MS[i] if i < len(self.BOUNDS_MS) else float("inf")
+
+_histograms = {}   # stage / upstream name -> RollingHistogram
+_counters = {}     # (name, (label pairs)) -> int
+
+def observe(name: str, ms: float):
+    h = _histograms.get(name)
+    if h is None: h = _histograms[name] = RollingHistogram()
+    h.observe(ms)
+
+def count(name: str, n: int = 1, **labels):
+    key = (name, tuple(sorted(labels.items())))
+    _counters[key] = _counters.get(key, 0) + n
+
+class timed:
+    """`with timed("stage.x"):` records the block's wall time (works around awaits too)."""
+    __slots__ = ("name", "t0")
+    def __init__(self, name: str): self.name = name
+    def __enter__(self): self.t0 = time.perf_counter(); return self
+    def __exit__(self, *exc): observe(self.name, (time.perf_counter() - self.t0) * 1000)
+
+async def measure(name: str, aw):
+    with timed(name):
+        return await aw
+
+def prometheus_text() -> str:
+    out = ["# TYPE phoenix_latency_ms histogram"]
+    for name, h in sorted(_histograms.items()):
+        acc = 0
+        for bound, c in zip(h.BOUNDS_MS + ("+Inf",), h.total):
+            acc += c
+            out.append(f'phoenix_latency_ms_bucket{{name="{name}",le="{bound}"}} {acc}')
+        out.append(f'phoenix_latency_ms_sum{{name="{name}"}} {h.sum:.3f}')
+        out.append(f'phoenix_latency_ms_count{{name="{name}"}} {h.count}')
+    seen = set()
+    for (name, labels), v in sorted(_counters.items()):
+        if name not in seen:
+            out.append(f"# TYPE phoenix_{name}_total counter"); seen.add(name)
+        lbl = ",".join(f'{k}="{v_}"' for k, v_ in labels)
+        out.append(f"phoenix_{name}_total{{{lbl}}} {v}")
+    out.append("# TYPE phoenix_cache_requests_total counter")
+    for cname, st in cache_stats().items():
+        out.append(f'phoenix_cache_requests_total{{cache="{cname}",result="hit"}} {st["hits"]}')
+        out.append(f'phoenix_cache_requests_total{{cache="{cname}",result="miss"}} {st["misses"]}')
+    out.append("# TYPE phoenix_cache_entries gauge")
+    for cname, st in cache_stats().items():
+        out.append(f'phoenix_cache_entries{{cache="{cname}"}} {st["size"]}')
+    out.append("# TYPE phoenix_scheduler_jobs gauge")
+    st = work_scheduler.stats()
+    out.append(f'phoenix_scheduler_jobs{{state="active"}} {st["active"]}')
+    out.append(f'phoenix_scheduler_jobs{{state="queued"}} {st["queued"]}')
+    out.append("# TYPE phoenix_coalesced_total counter")
+    for fname, st in flight_stats().items():
+        out.append(f'phoenix_coalesced_total{{flight="{fname}"}} {st["coalesced"]}')
+    return "\n".join(out) + "\n"
+
+async def _metrics_conn(reader, writer):
+    try:
+        line = await asyncio.wait_for(reader.readline(), 5)
+        while (await asyncio.wait_for(reader.readline(), 5)) not in (b"\r\n", b"\n", b""):
+            pass
+        ok = line.split(b" ")[1:2] == [b"/metrics"]
+        body = (prometheus_text() if ok else "not found\n").encode()
+        writer.write(f"HTTP/1.1 {'200 OK' if ok else '404 Not Found'}\r\nContent-Type: text/plain; version=0.0.4\r\n"
+                     f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode() + body)
+        await writer.drain()
+    except (asyncio.TimeoutError, ConnectionError):
+        pass
+    finally:
+        writer.close()
+
+async def start_metrics_server():
+    if not METRICS_PORT: return
+    srv = await asyncio.start_server(_metrics_conn, "127.0.0.1", METRICS_PORT)
+    spawn(srv.serve_forever())
+    print(f"Metrics: http://127.0.0.1:{METRICS_PORT}/metrics")
+
+# ================== ASYNC HTTP (one pooled keep-alive client per upstream) ==================
+HTTP_LIMITS = httpx.Limits(max_connections=40, max_keepalive_connections=20, keepalive_expiry=30.0)
+_http_clients = {}
+
+def http_client(upstream: str) -> httpx.AsyncClient:
+    """Shared client for 'rpc' / 'dexscreener' / 'helius'. Created lazily inside the running loop."""
+    c = _http_clients.get(upstream)
+    if c is None or c.is_closed:
+        c = httpx.AsyncClient(timeout=TIMEOUT, limits=HTTP_LIMITS, headers={"Content-Type":"application/json"})
+        _http_clients[upstream] = c
+    return c
+
+class TokenBucket:
+    """Async token bucket: `rate` tokens/s, up to `burst` banked. acquire() waits until a token is free."""
+    def __init__(self, rate: float, burst: int):
+        self.rate = max(0.01, float(rate))
+        self.burst = max(1, int(burst))
+        self.tokens = float(self.burst)
+        self.updated = time.monotonic()
+        self.waiting = 0
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self, n: float = 1.0):
+        self.waiting += 1
+        try:
+            await self._acquire(n)
+        finally:
+            self.waiting -= 1
+
+    def backlog(self) -> float:
+        """Seconds until the current waiters plus one more request would be served."""
+        self._refill()
+        return max(0.0, (self.waiting + 1 - self.tokens) / self.rate)
+
+    async def _acquire(self, n: float):
+        async with self._lock:  # FIFO: waiters are served in arrival order
+            while True:
+                self._refill()
+                if self.tokens >= n:
+                    self.tokens -= n
+                    return
+                await asyncio.sleep((n - self.tokens) / self.rate)
+
+    def try_acquire(self, n: float = 1.0) -> bool:
+        """Non-blocking: take `n` tokens if they are banked right now."""
+        self._refill()
+        if self.tokens >= n:
+            self.tokens -= n
+            return True
+        return False
+
+    def retry_in(self, n: float = 1.0) -> float:
+        """Seconds until `n` tokens are banked (ignoring other waiters)."""
+        self._refill()
+        return max(0.0, (n - self.tokens) / self.rate)
+
+_background = set()   # loops started from post_init and fire-and-forget warm-ups; cancelled in post_shutdown
+
+def spawn(coro) -> asyncio.Task:
+    t = asyncio.get_running_loop().create_task(coro)
+    _background.add(t)
+    t.add_done_callback(_background.discard)
+    return t
+
+async def cancel_background():
+    tasks = list(_background)
+    for t in tasks: t.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+async def close_http_clients():
+    for c in list(_http_clients.values()):
+        try: await c.aclose()
+        except Exception: pass
+    _http_clients.clear()
+
+# ================== RPC ROUTER ==================
+RPC_EWMA_ALPHA       = 0.2
+RPC_BREAKER_FAILS    = int(os.getenv("RPC_BREAKER_FAILS", "3"))        # consecutive failures -> open circuit
+RPC_BREAKER_COOLDOWN = float(os.getenv("RPC_BREAKER_COOLDOWN", "30"))  # seconds an open circuit stays open
+RPC_HEDGE            = os.getenv("RPC_HEDGE", "1") != "0"
+RPC_PROBE_INTERVAL   = 30.0   # an idle healthy-looking endpoint gets one real call this often, so it can win back traffic
+
+class RpcError(RuntimeError):
+    """`retryable`: worth another try on the same endpoint (transport error or 5xx); anything else moves on."""
+    def __init__(self, msg, retryable=False):
+        super().__init__(msg)
+        self.retryable = retryable
+
+def parse_retry_after(value):
+    if not value: return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        try:
+            return max(0.0, (parsedate_to_datetime(value) - datetime.now(timezone.utc)).total_seconds())
+        except (TypeError, ValueError):
+            return None
+
+class RpcEndpoint:
+    """Health of one RPC URL: EWMA latency, EWMA error rate, recent latencies and a circuit breaker."""
+    def __init__(self, url: str):
+        self.url = url
+        self.host = urlparse(url).hostname or url   # URLs may carry API keys; only the host is shown
+        self.ewma_ms = None
+        self.err_rate = 0.0
+        self.samples = deque(maxlen=200)
+        self.fails = 0
+        self.open_until = 0.0
+        self.last_used = time.monotonic()
+        self.calls = self.errors = self.throttled = self.hedged = 0
+
+    def available(self) -> bool:
+        return time.monotonic() >= self.open_until
+
+    def cost(self) -> float:
+        return (self.ewma_ms if self.ewma_ms is not None else 400.0) * (1.0 + 4.0*self.err_rate)
+
+    def p95(self):
+        if len(self.samples) < 10: return None
+        xs = sorted(self.samples)
+        return xs[int(0.95*(len(xs)-1))]
+
+    def ok(self, ms: float):
+        self.calls += 1
+        self.last_used = time.monotonic()
+        self.samples.append(ms)
+        self.ewma_ms = ms if self.ewma_ms is None else (1-RPC_EWMA_ALPHA)*self.ewma_ms + RPC_EWMA_ALPHA*ms
+        self.err_rate *= (1-RPC_EWMA_ALPHA)
+        self.fails = 0
+
+    def fail(self, throttled=False, retry_after=None, hold=None):
+        self.calls += 1; self.errors += 1
+        self.last_used = time.monotonic()
+        if throttled: self.throttled += 1
+        self.err_rate = (1-RPC_EWMA_ALPHA)*self.err_rate + RPC_EWMA_ALPHA
+        self.fails += 1
+        wait = retry_after if retry_after is not None else hold
+        if wait is None and self.fails >= RPC_BREAKER_FAILS:
+            wait = RPC_BREAKER_COOLDOWN
+        if wait:
+            self.open_until = max(self.open_until, time.monotonic() + wait)
+
+    def stats(self) -> dict:
+        p95 = self.p95()
+        return {
+            "host": self.host,
+            "state": "open" if not self.available() else "closed",
+            "ewma_ms": round(self.ewma_ms, 1) if self.ewma_ms is not None else None,
+            "p95_ms": round(p95, 1) if p95 is not None else None,
+            "err_rate": round(self.err_rate, 3),
+            "calls": self.calls, "errors": self.errors, "throttled": self.throttled, "hedged": self.hedged,
+        }
+
+class RpcRouter:
+    """Sends each call to the healthiest endpoint first; optionally hedges slow calls to a second one."""
+    def __init__(self, urls: list):
+        self.endpoints = [RpcEndpoint(u) for u in urls]
+
+    def ranked(self) -> list:
+        """Endpoints best first (open circuits last) without touching probe state; for display."""
+        up   = sorted((e for e in self.endpoints if e.available()), key=lambda e: e.cost())
+        down = sorted((e for e in self.endpoints if not e.available()), key=lambda e: e.open_until)
+        return up + down
+
+    def ordered(self) -> list:
+        """Try order for one request: ranked(), with an endpoint due for a probe moved to the front."""
+        now = time.monotonic()
+        eps = self.ranked()   # open circuits are only a last resort
+        for e in eps[1:]:
+            if not e.available(): break
+            if now - e.last_used >= RPC_PROBE_INTERVAL:
+                e.last_used = now
+                eps.remove(e); eps.insert(0, e)
+                break
+        return eps
+
+    async def _post(self, ep: RpcEndpoint, payload):
+        """One HTTP round-trip. Returns the decoded body or raises RpcError; updates endpoint health."""
+        t0 = time.monotonic()
+        try:
+            r = await http_client("rpc").post(ep.url, json=payload)
+        except httpx.HTTPError as e:
+            ep.fail()
+            count("upstream_responses", upstream="rpc", code="error")
+            raise RpcError(f"{ep.host} -> {type(e).__name__}", retryable=True) from e
+        ms = (time.monotonic() - t0) * 1000
+        observe("upstream.rpc", ms)
+        count("upstream_responses", upstream="rpc", code=str(r.status_code))
+        if r.status_code == 429:
+            ep.fail(throttled=True, retry_after=parse_retry_after(r.headers.get("Retry-After")))
+            raise RpcError(f"{ep.host} -> HTTP 429")
+        if r.status_code in (401, 403):
+            ep.fail(hold=RPC_BREAKER_COOLDOWN*10)   # key/plan problem, not transient
+            raise RpcError(f"{ep.host} -> HTTP {r.status_code}")
+        if r.status_code >= 500:
+            ep.fail(retry_after=parse_retry_after(r.headers.get("Retry-After")))
+            raise RpcError(f"{ep.host} -> HTTP {r.status_code}", retryable=True)
+        try:
+            r.raise_for_status()
+            data = r.json()
+        except (httpx.HTTPError, ValueError) as e:
+            ep.fail()
+            raise RpcError(f"{ep.host} -> {e}") from e
+        ep.ok(ms)
+        return data
+
+    async def _call_one(self, ep: RpcEndpoint, method: str, params: list):
+        last_err = None
         for attempt in range(1, MAX_TRIES + 1):
             try:
-                r = requests.post(
-                    url, json={"jsonrpc":"2.0","id":1,"method":method,"params":params},
-                    timeout=TIMEOUT, headers={"Content-Type":"application/json"}
-                )
-                if r.status_code in (401,403,429):
-                    last_err = RuntimeError(f"{url} -> HTTP {r.status_code}")
-                    break
-                r.raise_for_status()
-                data = r.json()
-                if data.get("error"):
-                    last_err = RuntimeError(f"{url} -> {data['error']}")
-                else:
-                    if "result" not in data:
-                        last_err = RuntimeError(f"{url} -> no 'result'")
-                    else:
-                        return data["result"]
+                data = await self._post(ep, {"jsonrpc":"2.0","id":1,"method":method,"params":params})
+            except RpcError as e:
+                last_err = e
+                if not e.retryable or not ep.available(): break   # throttled / breaker open -> next endpoint
+                count("upstream_retries", upstream="rpc")
+                await asyncio.sleep(0.25*attempt)
+                continue
+            if data.get("error"):
+                raise RpcError(f"{ep.host} -> {data['error']}")
+            if "result" not in data:
+                raise RpcError(f"{ep.host} -> no 'result'")
+            return data["result"]
+        raise last_err or RpcError(f"{ep.host} -> failed")
+
+    async def _batch_one(self, ep: RpcEndpoint, calls: list):
+        payload = [{"jsonrpc":"2.0","id":i,"method":m,"params":p} for i, (m, p) in enumerate(calls)]
+        last_err = None
+        for attempt in range(1, MAX_TRIES + 1):
+            try:
+                data = await self._post(ep, payload)
+            except RpcError as e:
+                last_err = e
+                if not e.retryable or not ep.available(): break
+                count("upstream_retries", upstream="rpc")
+                await asyncio.sleep(0.25*attempt)
+                continue
+            if not isinstance(data, list):   # some providers reject batches with a single error object
+                raise RpcError(f"{ep.host} -> batch not supported: {data.get('error') if isinstance(data, dict) else data}")
+            by_id = {d.get("id"): d for d in data if isinstance(d, dict)}
+            out = []
+            for i in range(len(calls)):
+                d = by_id.get(i) or {}
+                if d.get("error"):       out.append(RpcError(f"{ep.host} -> {d['error']}"))
+                elif "result" not in d:  out.append(RpcError(f"{ep.host} -> no 'result'"))
+                else:                    out.append(d["result"])
+            return out
+        raise last_err or RpcError(f"{ep.host} -> failed")
+
+    async def call_batch(self, calls: list, hedge=False) -> list:
+        """Several JSON-RPC calls in one POST. Returns results in order; failed items are RpcError instances."""
+        if not calls: return []
+        out, eps = None, self.ordered()
+        if hedge and self._can_hedge(eps):
+            try:
+                out = await self._hedged(eps[0], eps[1], lambda ep: self._batch_one(ep, calls))
+            except RpcError:
+                eps = eps[2:]
+        for ep in eps if out is None else ():
+            try:
+                out = await self._batch_one(ep, calls)
                 break
-            except requests.RequestException as e:
+            except RpcError:
+                continue
+        if out is None:
+            out = [RpcError("batch failed")] * len(calls)
+        # items the batch endpoint could not answer are retried one by one across endpoints
+        retry = [i for i, r in enumerate(out) if isinstance(r, RpcError)]
+        if retry:
+            again = await asyncio.gather(*(self.call(*calls[i]) for i in retry), return_exceptions=True)
+            for i, r in zip(retry, again): out[i] = r
+        return out
+
+    def _can_hedge(self, eps: list) -> bool:
+        return RPC_HEDGE and len(eps) > 1 and eps[0].available() and eps[0].p95() is not None
+
+    async def _hedged(self, first: RpcEndpoint, second: RpcEndpoint, attempt):
+        """Start attempt(first); if it runs past first's p95, race attempt(second) and keep the winner."""
+        t1 = asyncio.create_task(attempt(first))
+        done, _ = await asyncio.wait({t1}, timeout=first.p95() / 1000)
+        if done:
+            if t1.exception() is None:
+                return t1.result()
+            return await attempt(second)
+        second.hedged += 1
+        t2 = asyncio.create_task(attempt(second))
+        pending, last_err = {t1, t2}, None
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for t in done:
+                if t.exception() is None:
+                    for p in pending: p.cancel()
+                    return t.result()
+                last_err = t.exception()
+        raise last_err
+
+    async def call(self, method: str, params: list, hedge=False):
+        with timed(f"rpc.{method}"):
+            return await self._call(method, params, hedge)
+
+    async def _call(self, method: str, params: list, hedge=False):
+        eps = self.ordered()
+        last_err = None
+        if hedge and self._can_hedge(eps):
+            try:
+                return await self._hedged(eps[0], eps[1], lambda ep: self._call_one(ep, method, params))
+            except RpcError as e:
+                last_err = e
+                eps = eps[2:]
+        for ep in eps:
+            try:
+                return await self._call_one(ep, method, params)
+            except RpcError as e:
+                last_err = e
+        raise RpcError(f"RPC failed across endpoints: {last_err}")
+
+    async def stream(self, method: str, params: list, make_sink, timeout: float = TIMEOUT):
+        """Large responses: the body is fed chunk by chunk into a fresh `make_sink()` per endpoint
+        (sink.feed(bytes), sink.close()) instead of being buffered and decoded in one piece."""
+        last_err = None
+        payload = {"jsonrpc":"2.0","id":1,"method":method,"params":params}
+        for ep in self.ordered():
+            sink, t0 = make_sink(), time.monotonic()
+            try:
+                async with http_client("rpc").stream("POST", ep.url, json=payload, timeout=timeout) as r:
+                    count("upstream_responses", upstream="rpc", code=str(r.status_code))
+                    if r.status_code == 429:
+                        ep.fail(throttled=True, retry_after=parse_retry_after(r.headers.get("Retry-After")))
+                        raise RpcError(f"{ep.host} -> HTTP 429")
+                    if r.status_code >= 400:
+                        ep.fail()
+                        raise RpcError(f"{ep.host} -> HTTP {r.status_code}")
+                    async for chunk in r.aiter_bytes():
+                        sink.feed(chunk)
+                sink.close()
+            except httpx.HTTPError as e:
+                ep.fail()
+                last_err = RpcError(f"{ep.host} -> {type(e).__name__}")
+                continue
+            except RpcError as e:
                 last_err = e
-                time.sleep(0.25*attempt)
-    raise RuntimeError(f"RPC failed across endpoints: {last_err}")
+                continue
+            ep.ok((time.monotonic() - t0) * 1000)
+            return sink
+        raise RpcError(f"RPC failed across endpoints: {last_err}")
 
-def pct_from_largest(accounts: list, n: int) -> float:
+    def stats(self) -> list:
+        return [e.stats() for e in self.ranked()]
+
+rpc_router = RpcRouter(RPC_LIST)
+
+async def rpc(method: str, params: list, hedge=False):
+    return await rpc_router.call(method, params, hedge=hedge)
+
+async def rpc_batch(calls: list, hedge=False) -> list:
+    """[(method, params), ...] -> [result | exception, ...] using a single JSON-RPC batch POST.
+    `hedge`: latency-critical callers race a duplicate POST once the first endpoint passes its p95."""
+    with timed("rpc.batch"):
+        return await rpc_router.call_batch(calls, hedge=hedge)
+
+def pct_from_largest(accounts: list, n: int, supply_ui: float = None) -> float:
+    """Share of the n largest accounts, of total supply when known (else of the listed accounts)."""
     if not accounts: return 0.0
-    total = sum(float(a.get("uiAmount", 0) or 0) for a in accounts)
+    total = supply_ui if supply_ui else sum(float(a.get("uiAmount", 0) or 0) for a in accounts)
     if total <= 0: return 0.0
     part = sum(float(a.get("uiAmount", 0) or 0) for a in accounts[:min(n,len(accounts))])
     return 100.0 * part / total
 
+def holder_wallet(h: dict):
+    """Owner wallet of a getTokenLargestAccounts entry (falls back to the token account itself)."""
+    return h.get("owner") or h.get("address") or h.get("addressStr")
+
+def owner_lookup_call(largest: list):
+    """getMultipleAccounts call that resolves the owners of token-account entries (None if nothing to resolve)."""
+    keys = [a for a in (h.get("address") or h.get("addressStr") for h in largest or []) if a][:100]
+    return ("getMultipleAccounts", [keys, {"encoding":"jsonParsed"}]) if keys else None
+
+def apply_owners(largest: list, res) -> list:
+    """Adds 'owner' to each token-account entry from a getMultipleAccounts (jsonParsed) result."""
+    addrs = [h.get("address") or h.get("addressStr") for h in largest or []]
+    keys = [a for a in addrs if a][:100]
+    values = (res.get("value") or []) if isinstance(res, dict) else []
+    owners = {}
+    for a, v in zip(keys, values):
+        data = (v or {}).get("data")
+        info = (data.get("parsed") or {}).get("info") or {} if isinstance(data, dict) else {}
+        if info.get("owner"): owners[a] = info["owner"]
+    return [dict(h, owner=owners[a]) if a in owners else h for h, a in zip(largest, addrs)]
+
+async def resolve_holder_owners(largest: list) -> list:
+    """Adds 'owner' to each token-account entry with one getMultipleAccounts (jsonParsed) call."""
+    call = owner_lookup_call(largest)
+    if call is None: return largest or []
+    try:
+        res = await rpc(*call)
+    except Exception:
+        return largest
+    return apply_owners(largest, res)
+
 def fmt_usd(x):
     try:
         v = float(x)
@@ -93,10 +846,129 @@ def progress_bar(score: int, width=20):
     return "█"*filled + "░"*(width-filled)
 def safe(s: str) -> str: return html.escape(s or "")
 
+# ================== SCORING RULES ==================
+# Scores are data, not code: base + one delta per group, where the first rule of a group whose
+# conditions all hold wins (np.select semantics), clipped to 0..100. The same rules score a live
+# report (one row) and a back-test over thousands of snapshots (one call, vectorised).
+# A condition is (feature, op, value); a rule is (conditions, delta, reason template).
+RULE_OPS = {">": np.greater, ">=": np.greater_equal, "<": np.less, "<=": np.less_equal,
+            "==": np.equal, "!=": np.not_equal, "nan": lambda x, _: np.isnan(x)}
+
+class RuleSet:
+    def __init__(self, name: str, base: int, groups: list, labels: list):
+        self.name, self.base, self.groups = name, base, groups
+        self.labels = labels            # [(min score, label), ...] best first; the last one is the floor
+
+    def _when(self, conds, cols, n):
+        ok = np.ones(n, dtype=bool)
+        for feat, op, value in conds:
+            ok &= RULE_OPS[op](np.asarray(cols[feat], dtype=np.float64), value)
+        return ok
+
+    def evaluate(self, cols: dict) -> dict:
+        """cols: feature -> array. Returns score (int array) and, per group, the index of the rule hit (-1: none)."""
+        n = len(next(iter(cols.values())))
+        score = np.full(n, self.base, dtype=np.int64)
+        hits = []
+        for group in self.groups:
+            conds = [self._when(when, cols, n) for when, _, _ in group]
+            score += np.select(conds, [delta for _, delta, _ in group], 0)
+            hits.append(np.select(conds, list(range(len(group))), -1))
+        return {"score": np.clip(score, 0, 100), "hits": hits}
+
+    def label(self, score):
+        return np.select([np.asarray(score) >= t for t, _ in self.labels[:-1]],
+                         [l for _, l in self.labels[:-1]], self.labels[-1][1])
+
+    def score_one(self, features: dict, **fmt) -> dict:
+        """Live path: one row through evaluate(); reasons are rendered from the hit rules."""
+        r = self.evaluate({k: [v] for k, v in features.items()})
+        reasons = []
+        for group, hit in zip(self.groups, r["hits"]):
+            if hit[0] >= 0 and group[hit[0]][2]:
+                reasons.append(group[hit[0]][2].format(**features, **fmt))
+        score = int(r["score"][0])
+        return {"score": score, "label": str(self.label(score)), "reasons": reasons}
+
+    def vary(self, group: int, rule: int, value: float) -> "RuleSet":
+        """Copy with the threshold of one rule's first condition replaced (threshold tuning)."""
+        groups = [list(g) for g in self.groups]
+        when, delta, reason = groups[group][rule]
+        groups[group][rule] = ([(when[0][0], when[0][1], value)] + list(when[1:]), delta, reason)
+        return RuleSet(self.name, self.base, groups, self.labels)
+
+SAFETY_RULES = RuleSet("safety", 50, [
+    [([("mint_auth", "==", 0)], +25, None), ([], -20, None)],
+    [([("freeze_auth", "==", 0)], +10, None)],
+    [([("top1", ">", 30)], -25, None), ([("top1", ">", 15)], -10, None), ([("top1", ">", 0)], +5, None)],
+    [([("top10", ">", 0), ("top10", "<", 30)], +15, None), ([("top10", ">", 60)], -15, None)],
+], [(75, "low risk"), (50, "medium risk"), (0, "high risk")])
+
+LP_RULES = RuleSet("lp", 50, [
+    [([("liq", ">=", 50_000)], +25, "✅ Liquidity healthy (~{liq_usd})."),
+     ([("liq", ">=", 15_000)], +10, "ℹ️ Liquidity moderate (~{liq_usd})."),
+     ([], -20, "⚠️ Very low liquidity (~{liq_usd}).")],
+    [([("age_h", "nan", 0)], 0, "ℹ️ Pool age unknown."),
+     ([("age_h", ">=", 72)], +15, "✅ Pool age {age_h:.1f}h (3d+)."),
+     ([("age_h", ">=", 24)], +5, "ℹ️ Pool age {age_h:.1f}h (1d+)."),
+     ([], -15, "⚠️ Very new pool ({age_h:.1f}h).")],
+    [([("liq", ">", 0), ("vol_liq", ">", 5)], -10, "⚠️ 24h volume >> liquidity (possible PnD)."),
+     ([("liq", ">", 0), ("vol_liq", "<", 0.1), ("age_h", ">", 48)], -5, "⚠️ Very low activity vs liquidity."),
+     ([("liq", ">", 0)], 0, "✅ Volume/liquidity looks reasonable.")],
+], [(75, "low risk (LP)"), (50, "medium risk (LP)"), (0, "high risk (LP)")])
+
+CLUSTER_RULES = RuleSet("cluster", 80, [
+    [([("density", ">=", 0.5)], -25, "Dense cluster among top holders (high linkage)."),
+     ([("density", ">=", 0.25)], -12, "Moderate linkage among top holders."),
+     ([], +8, "Sparse linkage (healthy).")],
+    [([("hub_ratio", ">=", 0.6)], -20, "Single hub wallet connects many holders."),
+     ([("hub_ratio", ">=", 0.4)], -10, "Some centralization (one wallet links several)."),
+     ([], +5, "No dominant hub detected.")],
+    [([("top_share", ">=", 25)], -15, "Linked cluster holds {top_share:.1f}% of supply."),
+     ([("top_share", ">=", 10)], -7, "Linked cluster holds {top_share:.1f}% of supply.")],
+], [(80, "low risk (clusters)"), (60, "medium risk (clusters)"), (0, "high risk (clusters)")])
+
+RULE_SETS = {r.name: r for r in (SAFETY_RULES, LP_RULES, CLUSTER_RULES)}
+
+def lp_features(ds_summary: dict, now: float = None) -> dict:
+    liq = float(ds_summary.get("dex_liq") or 0)
+    vol24 = float(ds_summary.get("dex_vol24") or 0)
+    created_ms = ds_summary.get("pair_created_at")
+    age_h = float("nan")
+    if created_ms:
+        age_h = max(0, ((now or time.time()) - created_ms / 1000) / 3600)
+    return {"liq": liq, "vol24": vol24, "age_h": age_h, "vol_liq": vol24 / liq if liq else 0.0}
+
 # ================== PUBLIC DATA ==================
-def fetch_dexscreener_by_mint(mint: str) -> dict:
-    r = requests.get(f"https://api.dexscreener.com/latest/dex/tokens/{mint}", timeout=15)
-    return r.json() if r.status_code == 200 else {}
+DEXSCREENER_BASE  = os.getenv("DEXSCREENER_BASE", "https://api.dexscreener.com")
+DEXSCREENER_BATCH = 30   # max token addresses per /latest/dex/tokens request
+
+async def fetch_dexscreener_by_mint(mint: str) -> dict:
+    try:
+        with timed("upstream.dexscreener"):
+            r = await http_client("dexscreener").get(f"{DEXSCREENER_BASE}/latest/dex/tokens/{mint}", timeout=15)
+        count("upstream_responses", upstream="dexscreener", code=str(r.status_code))
+        return r.json() if r.status_code == 200 else {}
+    except (httpx.HTTPError, ValueError):
+        count("upstream_responses", upstream="dexscreener", code="error")
+        return {}
+
+async def fetch_dexscreener_many(mints: list, concurrency=4) -> dict:
+    """mint -> pair summary for many mints, DEXSCREENER_BATCH addresses per request."""
+    sem = asyncio.Semaphore(concurrency)
+    async def one(chunk):
+        async with sem:
+            ds = await fetch_dexscreener_by_mint(",".join(chunk))
+        by_mint = {m: [] for m in chunk}
+        for p in (ds.get("pairs") or []) if isinstance(ds, dict) else []:
+            m = (p.get("baseToken") or {}).get("address")
+            if m in by_mint: by_mint[m].append(p)
+        return {m: summarize_pairs(ps) if ps else {} for m, ps in by_mint.items()}
+    chunks = [mints[i:i+DEXSCREENER_BATCH] for i in range(0, len(mints), DEXSCREENER_BATCH)]
+    out = {}
+    for part in await asyncio.gather(*(one(c) for c in chunks)):
+        out.update(part)
+    return out
 
 def summarize_pairs(pairs: list) -> dict:
     best = None
@@ -131,45 +1003,18 @@ def summarize_pairs(pairs: list) -> dict:
 def assess_lp_risk(ds_summary: dict) -> dict:
     if not ds_summary:
         return {"label": "unknown", "reasons": ["No active DEX pair on Solana found."], "score": 50}
-    liq = float(ds_summary.get("dex_liq") or 0)
-    vol24 = float(ds_summary.get("dex_vol24") or 0)
-    created_ms = ds_summary.get("pair_created_at")
-    age_hours = None
-    if created_ms:
-        age_hours = max(0, (datetime.now(timezone.utc) - datetime.fromtimestamp(created_ms/1000, tz=timezone.utc)).total_seconds()/3600)
-
-    score = 50
-    reasons = []
-    if liq >= 50_000: score += 25; reasons.append(f"✅ Liquidity healthy (~{fmt_usd(liq)}).")
-    elif liq >= 15_000: score += 10; reasons.append(f"ℹ️ Liquidity moderate (~{fmt_usd(liq)}).")
-    else: score -= 20; reasons.append(f"⚠️ Very low liquidity (~{fmt_usd(liq)}).")
-
-    if age_hours is None: reasons.append("ℹ️ Pool age unknown.")
-    elif age_hours >= 72: score += 15; reasons.append(f"✅ Pool age {age_hours:.1f}h (3d+).")
-    elif age_hours >= 24: score += 5;  reasons.append(f"ℹ️ Pool age {age_hours:.1f}h (1d+).")
-    else: score -= 15; reasons.append(f"⚠️ Very new pool ({age_hours:.1f}h).")
-
-    if liq > 0:
-        vol_liq = vol24 / liq if liq else 0
-        if vol_liq > 5: score -= 10; reasons.append("⚠️ 24h volume >> liquidity (possible PnD).")
-        elif vol_liq < 0.1 and (age_hours and age_hours > 48): score -= 5; reasons.append("⚠️ Very low activity vs liquidity.")
-        else: reasons.append("✅ Volume/liquidity looks reasonable.")
-
-    score = max(0, min(100, score))
-    label = "low risk (LP)" if score>=75 else "medium risk (LP)" if score>=50 else "high risk (LP)"
-    return {"label": label, "reasons": reasons, "score": score}
+    f = lp_features(ds_summary)
+    return LP_RULES.score_one(f, liq_usd=fmt_usd(f["liq"]))
 
 # ================== HELIUS (Wallet-Links & Bubble-Map) ==================
-HELIUS_BASE = "https://api.helius.xyz"
-
-def helius_get_tx_for_address(addr: str, limit=100):
-    if not HELIUS_KEY: return []
-    base = f"{HELIUS_BASE}/v0/addresses/{addr}/transactions"
-    params = {"api-key": HELIUS_KEY, "limit": limit}
-    r = requests.get(base + "?" + urlencode(params), timeout=15)
-    if r.status_code != 200:
-        return []
-    return r.json() or []
+HELIUS_BASE = os.getenv("HELIUS_BASE", "https://api.helius.xyz")
+_helius_sem = asyncio.Semaphore(HELIUS_CONCURRENCY)
+_helius_bucket = TokenBucket(HELIUS_RPS, HELIUS_BURST)
+# addr -> {"txs": [[signature, counterparties, mints], ...] newest first (≤ HELIUS_TX_WINDOW),
+#          "cps": {address: n}, "mints": {mint: n}, "synced": unix ts}
+# Only per-tx digests are stored; the counters are kept in step with the window, so a refresh
+# costs the transactions newer than txs[0] and nothing is recounted.
+_helius_hist = TTLCache("helius_history", HELIUS_CACHE_SIZE, HELIUS_HISTORY_TTL)
 
 def extract_counterparties(txs: list) -> set:
     cps = set()
@@ -184,78 +1029,207 @@ def extract_counterparties(txs: list) -> set:
             if r and isinstance(r, str): cps.add(r)
     return cps
 
-def bubblemap_score_for_holders(top_holders: list) -> dict:
+def tx_digest(tx: dict) -> list:
+    """[signature, counterparties, token mints] of one enriched transaction."""
+    mints = {tt.get("mint") for tt in tx.get("tokenTransfers", []) or [] if tt.get("mint")}
+    return [tx.get("signature"), sorted(extract_counterparties([tx])), sorted(mints)]
+
+def _tally(counter: dict, keys, step: int):
+    for k in keys:
+        n = counter.get(k, 0) + step
+        if n > 0: counter[k] = n
+        else: counter.pop(k, None)
+
+def merge_history(hist: dict, txs: list) -> dict:
+    """Prepends newly seen transactions (newest first) and trims the window, updating the counters."""
+    hist = hist or {"txs": [], "cps": {}, "mints": {}}
+    known = {d[0] for d in hist["txs"][:len(txs)]}
+    fresh = [tx_digest(tx) for tx in txs if tx.get("signature") not in known]
+    window = fresh + hist["txs"]
+    cps, mints = dict(hist["cps"]), dict(hist["mints"])
+    for _, c, m in fresh:
+        _tally(cps, c, 1); _tally(mints, m, 1)
+    for _, c, m in window[HELIUS_TX_WINDOW:]:
+        _tally(cps, c, -1); _tally(mints, m, -1)
+    return {"txs": window[:HELIUS_TX_WINDOW], "cps": cps, "mints": mints, "synced": time.time()}
+
+async def address_history(addr: str) -> dict:
+    """Counterparty and mint counters over the newest HELIUS_TX_WINDOW transactions of `addr`."""
+    if not HELIUS_KEY: return {"txs": [], "cps": {}, "mints": {}}
+    hist = await _helius_hist.aget(addr, count=False)
+    if hist is not None and time.time() - hist.get("synced", 0) < HELIUS_CACHE_TTL:
+        _helius_hist.record(True)
+        return hist
+    _helius_hist.record(False)
+    return await _helius_sync(addr)
+
+@coalesce("helius")
+async def _helius_sync(addr: str) -> dict:
+    hist = await _helius_hist.aget(addr, count=False)
+    cursor = hist["txs"][0][0] if hist and hist["txs"] else None
+    new, before = [], None
+    while len(new) < HELIUS_TX_WINDOW:
+        page = await _helius_page(addr, until=cursor, before=before)
+        if page is None:                       # upstream trouble: keep what we have, retry next time
+            return hist or {"txs": [], "cps": {}, "mints": {}}
+        new += page
+        if len(page) < HELIUS_PAGE or not page[-1].get("signature"):
+            break
+        before = page[-1]["signature"]
+    count("helius_sync", kind="incremental" if cursor else "full")
+    count("helius_sync_txs", len(new))
+    hist = merge_history(hist if cursor else None, new)
+    _helius_hist.set(addr, hist)
+    return hist
+
+async def _helius_page(addr: str, until: str = None, before: str = None):
+    """One page of enhanced transactions, newest first: newer than `until`, older than `before`."""
+    params = {"api-key": HELIUS_KEY, "limit": HELIUS_PAGE}
+    if until:  params["until"] = until
+    if before: params["before"] = before
+    async with _helius_sem:
+        await _helius_bucket.acquire()
+        try:
+            with timed("upstream.helius"):
+                r = await http_client("helius").get(f"{HELIUS_BASE}/v0/addresses/{addr}/transactions", params=params, timeout=15)
+            count("upstream_responses", upstream="helius", code=str(r.status_code))
+            if r.status_code != 200:
+                return None
+            return r.json() or []
+        except (httpx.HTTPError, ValueError):
+            count("upstream_responses", upstream="helius", code="error")
+            return None
+
+# ---- holder graph engine ----
+# Counterparties touching more than this share of the holders are infrastructure (DEX pools,
+# programs, CEX hot wallets); they would link everyone, so they are not counted as shared funders.
+HUB_MAX_SHARE = 0.5
+
+def _components(n: int, ei, ej):
+    """Union-find over edge arrays -> component label per node."""
+    parent = list(range(n))
+    def find(x):
+        while parent[x] != x:
+            parent[x] = parent[parent[x]]
+            x = parent[x]
+        return x
+    for a, b in zip(ei.tolist(), ej.tolist()):
+        ra, rb = find(a), find(b)
+        if ra != rb: parent[max(ra, rb)] = min(ra, rb)
+    return np.array([find(x) for x in range(n)], dtype=np.int32)
+
+def holder_graph(nodes: list, cp_map: dict) -> dict:
+    """Adjacency among holder wallets from their counterparty sets.
+
+    direct: i transacted with holder j (1 hop).
+    shared: i and j both transacted with the same outside wallet (2 hops, e.g. a common funder).
+    Everything after collecting the edge arrays is vectorised, so 100+ holders stay in the millisecond range.
+    """
+    n = len(nodes)
+    idx = {a: i for i, a in enumerate(nodes)}
+    direct = np.zeros((n, n), dtype=bool)
+    cp_ids, rows, cols = {}, [], []
+    for i, a in enumerate(nodes):
+        for c in cp_map.get(a, ()):
+            j = idx.get(c)
+            if j is not None:
+                direct[i, j] = True
+            else:
+                rows.append(i); cols.append(cp_ids.setdefault(c, len(cp_ids)))
+    direct |= direct.T
+    np.fill_diagonal(direct, False)
+
+    rows = np.asarray(rows, dtype=np.int32); cols = np.asarray(cols, dtype=np.int32)
+    deg = np.bincount(cols, minlength=len(cp_ids)) if len(cols) else np.zeros(0, dtype=np.int64)
+    is_shared = (deg >= 2) & (deg <= max(2, HUB_MAX_SHARE * n))
+    keep = is_shared[cols] if len(cols) else np.zeros(0, dtype=bool)
+    funder_ids, inv = np.unique(cols[keep], return_inverse=True)
+    incidence = np.zeros((n, len(funder_ids)), dtype=np.float32)
+    incidence[rows[keep], inv] = 1.0
+    shared = (incidence @ incidence.T) > 0   # common-counterparty count > 0
+    np.fill_diagonal(shared, False)
+
+    cp_names = np.array(list(cp_ids), dtype=object) if cp_ids else np.zeros(0, dtype=object)
+    order = np.argsort(-deg[funder_ids], kind="stable") if len(funder_ids) else np.zeros(0, dtype=np.int64)
+    funders = [(cp_names[funder_ids[k]], int(deg[funder_ids[k]])) for k in order[:5]]
+
+    ei, ej = np.nonzero(np.triu(direct | shared, 1))
+    return {"direct": direct, "shared": shared, "labels": _components(n, ei, ej), "funders": funders}
+
+def short(a: str) -> str:
+    return f"{a[:6]}…{a[-6:]}"
+
+async def bubblemap_score_for_holders(top_holders: list, supply_ui: float = None) -> dict:
     if not HELIUS_KEY:
         return {"score": 60, "label": "unknown", "reasons": ["No Helius key set"], "edges": []}
-    nodes = []
-    for h in (top_holders or [])[:15]:
-        a = h.get("address") or h.get("addressStr")
-        if a: nodes.append(a)
-    nodes = list(dict.fromkeys(nodes))
+    amounts = {}
+    for h in (top_holders or [])[:BUBBLEMAP_MAX_HOLDERS]:
+        a = holder_wallet(h)
+        if a: amounts[a] = amounts.get(a, 0.0) + float(h.get("uiAmount", 0) or 0)
+    nodes = list(amounts)
     if not nodes:
         return {"score": 50, "label": "unknown", "reasons": ["No holder data available."], "edges": []}
 
+    # parallel fan-out; pacing is done by the Helius semaphore + token bucket
+    histories = await asyncio.gather(*(address_history(a) for a in nodes))
     cp_map = {}
-    for a in nodes:
-        txs = helius_get_tx_for_address(a, limit=120)
-        cps = extract_counterparties(txs)
+    for a, hist in zip(nodes, histories):
+        cps = set(hist["cps"])
         cps.discard(a)
         cp_map[a] = cps
-        time.sleep(0.12)
-
-    edges = set()
-    deg = {a: 0 for a in nodes}
-    for i in range(len(nodes)):
-        for j in range(i+1, len(nodes)):
-            a, b = nodes[i], nodes[j]
-            linked = (b in cp_map.get(a, set())) or (a in cp_map.get(b, set()))
-            if linked:
-                edges.add((a, b)); deg[a] += 1; deg[b] += 1
 
+    g = holder_graph(nodes, cp_map)
+    direct, labels = g["direct"], g["labels"]
     n = len(nodes)
+    n_edges = int(np.triu(direct, 1).sum())
     max_possible = n*(n-1)//2 if n > 1 else 1
-    density = len(edges) / max_possible if max_possible > 0 else 0.0
-    max_deg = max(deg.values()) if deg else 0
+    density = n_edges / max_possible if max_possible > 0 else 0.0
+    max_deg = int(direct.sum(axis=1).max()) if n else 0
     hub_ratio = (max_deg / (n-1)) if n > 1 else 0.0
 
-    score = 80
-    reasons = []
-    if density >= 0.5:   score -= 25; reasons.append("Dense cluster among top holders (high linkage).")
-    elif density >= 0.25: score -= 12; reasons.append("Moderate linkage among top holders.")
-    else:                score += 8;  reasons.append("Sparse linkage (healthy).")
-
-    if hub_ratio >= 0.6: score -= 20; reasons.append("Single hub wallet connects many holders.")
-    elif hub_ratio >= 0.4: score -= 10; reasons.append("Some centralization (one wallet links several).")
-    else:                 score += 5;  reasons.append("No dominant hub detected.")
-
-    score = max(0, min(100, score))
-    label = "low risk (clusters)" if score>=80 else "medium risk (clusters)" if score>=60 else "high risk (clusters)"
-    pretty_edges = [f"{a[:6]}…{a[-6:]} ↔ {b[:6]}…{b[-6:]}" for a,b in sorted(edges)]
+    # clusters (direct + shared-funder links) and their combined supply share
+    amt = np.array([amounts[a] for a in nodes], dtype=np.float64)
+    total = supply_ui if supply_ui else amt.sum()
+    uniq, inverse, sizes = np.unique(labels, return_inverse=True, return_counts=True)
+    shares = np.bincount(inverse, weights=amt) / total * 100 if total else np.zeros(len(uniq))
+    clusters = []
+    for k in np.argsort(-shares):
+        if sizes[k] < 2: continue
+        members = [nodes[i] for i in np.flatnonzero(inverse == k)]
+        clusters.append({"size": int(sizes[k]), "share": round(float(shares[k]), 2), "members": [short(a) for a in members[:4]]})
+    top_share = clusters[0]["share"] if clusters else 0.0
+
+    features = {"density": density, "hub_ratio": hub_ratio, "top_share": top_share}
+    sc = CLUSTER_RULES.score_one(features)
+    ei, ej = np.nonzero(np.triu(direct, 1))
+    pretty_edges = sorted(f"{short(nodes[i])} ↔ {short(nodes[j])}" for i, j in zip(ei.tolist(), ej.tolist()))
     return {
-        "score": score,
-        "label": label,
-        "reasons": reasons[:3],
+        "score": sc["score"],
+        "label": sc["label"],
+        "reasons": sc["reasons"][:3],
         "edges": pretty_edges[:8],
         "density": round(density, 3),
         "max_deg_ratio": round(hub_ratio, 3),
+        "nodes": n,
+        "two_hop": int(np.triu(g["shared"] & ~direct, 1).sum()),
+        "clusters": clusters[:5],
+        "top_cluster_share": top_share,
+        "funders": [{"address": short(a), "holders": k} for a, k in g["funders"]],
+        "features": features,
     }
 
-def analyze_wallet_links(target_mint: str, top_holders: list, max_wallets=8):
+async def analyze_wallet_links(target_mint: str, top_holders: list, max_wallets=8):
+    wallets = []
+    for h in (top_holders or [])[:max_wallets]:
+        addr = holder_wallet(h)
+        if addr: wallets.append((addr, float(h.get("uiAmount", 0) or 0)))
+    histories = await asyncio.gather(*(address_history(addr) for addr, _ in wallets))
+
     results = []
-    wallets = (top_holders or [])[:max_wallets]
-    for h in wallets:
-        addr = h.get("address") or h.get("addressStr")
-        ui   = float(h.get("uiAmount", 0) or 0)
-        if not addr: continue
-        other_mints = set()
-        txs = helius_get_tx_for_address(addr, limit=100)
-        for tx in txs:
-            for tt in tx.get("tokenTransfers", []) or []:
-                m = tt.get("mint")
-                if m and m != target_mint:
-                    other_mints.add(m)
+    for (addr, ui), hist in zip(wallets, histories):
+        other_mints = [m for m in hist["mints"] if m != target_mint]
         # Fallback ohne Helius (limitiert) ist bewusst weggelassen, um Rate-Limits zu schonen
-        sample = list(other_mints)[:6]
+        sample = other_mints[:6]
         results.append({
             "address": addr,
             "uiAmount": ui,
@@ -263,18 +1237,692 @@ def analyze_wallet_links(target_mint: str, top_holders: list, max_wallets=8):
             "other_sample": sample,
             "solscan": solscan(addr)
         })
-        time.sleep(0.12)
     return results
 
+# ================== DEEP HOLDERS (getProgramAccounts) ==================
+DEEP_HOLDERS       = os.getenv("DEEP_HOLDERS", "0").lower() in ("1", "true", "yes", "on")
+DEEP_MAX_ACCOUNTS  = int(os.getenv("DEEP_MAX_ACCOUNTS", "2000000"))   # non-empty accounts kept (40 B each)
+DEEP_TIMEOUT       = float(os.getenv("DEEP_TIMEOUT", "60"))
+TOKEN_PROGRAM      = "TokenkegQfeZyiNwAJbNbGKPFXCWuBvf9Ss623VQ5DA"
+
+class HolderScan:
+    """Stream sink for getProgramAccounts with a 40-byte dataSlice (owner + amount). Payloads are
+    decoded as they arrive and kept as packed (owner, amount) records; empty accounts are dropped,
+    so memory is 40 B per funded account and never the JSON body."""
+    REC = np.dtype([("owner", "<u8", (4,)), ("amount", "<u8")])
+    PAYLOAD = re.compile(rb'"data"\s*:\s*\[\s*"([A-Za-z0-9+/=]+)"\s*,\s*"base64"')
+
+    def __init__(self, max_accounts: int = DEEP_MAX_ACCOUNTS):
+        self.max_accounts = max_accounts
+        self.buf, self.head = b"", b""
+        self.parts, self.kept = [], 0
+        self.accounts = 0            # all token accounts seen, including empty ones
+        self.truncated = False
+
+    def feed(self, chunk: bytes):
+        if len(self.head) < 512: self.head += chunk[:512]
+        self.buf += chunk
+        raw, end = [], 0
+        for m in self.PAYLOAD.finditer(self.buf):
+            raw.append(base64.b64decode(m.group(1))); end = m.end()
+        # keep only an unfinished record at the tail
+        self.buf = self.buf[end:] if end else self.buf[-512:]
+        if not raw: return
+        rec = np.frombuffer(b"".join(raw), dtype=self.REC)
+        self.accounts += len(rec)
+        rec = rec[rec["amount"] > 0]
+        room = self.max_accounts - self.kept
+        if len(rec) > room:
+            rec, self.truncated = rec[:room], True
+        if len(rec):
+            self.parts.append(rec.copy()); self.kept += len(rec)
+
+    def close(self):
+        if not self.accounts and b'"error"' in self.head:
+            msg = re.search(rb'"message"\s*:\s*"([^"]*)"', self.head)
+            raise RpcError(msg.group(1).decode(errors="replace") if msg else "getProgramAccounts error")
+
+    def records(self) -> np.ndarray:
+        return np.concatenate(self.parts) if self.parts else np.empty(0, dtype=self.REC)
+
+def holder_distribution(rec: np.ndarray, supply_raw: int) -> dict:
+    """Holder count, concentration against real supply, Gini and percentile buckets from packed
+    (owner, amount) records; several token accounts of one wallet are merged first."""
+    if not len(rec):
+        return {"holders": 0}
+    _, inverse = np.unique(rec["owner"], axis=0, return_inverse=True)
+    bal = np.sort(np.bincount(inverse.ravel(), weights=rec["amount"].astype(np.float64)))[::-1]
+    n = len(bal)
+    supply = float(supply_raw) or float(bal.sum())
+    share = bal / supply * 100
+    cum = np.cumsum(share)
+    top = lambda k: float(cum[min(k, n) - 1])
+    pct_of_holders = lambda p: float(cum[max(1, int(np.ceil(n * p))) - 1])
+    asc = bal[::-1]
+    gini = float((2 * np.arange(1, n + 1) @ asc) / (n * asc.sum()) - (n + 1) / n) if asc.sum() > 0 else 0.0
+    edges = [0, 0.01, 0.1, 1, float("inf")]                    # % of supply per wallet
+    buckets = np.histogram(share, bins=edges)[0]
+    return {
+        "holders": n,
+        "top1": top(1), "top10": top(10), "top20": top(20), "top100": top(100),
+        "top1pct": pct_of_holders(0.01), "top10pct": pct_of_holders(0.10), "top50pct": pct_of_holders(0.50),
+        "gini": round(gini, 4),
+        "buckets": {"<0.01%": int(buckets[0]), "0.01–0.1%": int(buckets[1]), "0.1–1%": int(buckets[2]), ">1%": int(buckets[3])},
+    }
+
+async def fetch_holder_distribution(mint: str, supply_raw: int) -> dict:
+    params = [TOKEN_PROGRAM, {"encoding": "base64", "commitment": "confirmed",
+                              "dataSlice": {"offset": 32, "length": 40},
+                              "filters": [{"dataSize": 165}, {"memcmp": {"offset": 0, "bytes": mint}}]}]
+    with timed("rpc.getProgramAccounts"):
+        scan = await rpc_router.stream("getProgramAccounts", params, HolderScan, timeout=DEEP_TIMEOUT)
+    dist = holder_distribution(scan.records(), supply_raw)
+    dist.update(accounts=scan.accounts, funded=scan.kept, truncated=scan.truncated)
+    return dist
+
+# ================== ANALYSIS PIECES (tiered cache) ==================
+# Each data source is cached on its own with its own TTL, so a report can be rebuilt from
+# partly fresh pieces (e.g. only Dexscreener refetched when the price is stale).
+_mint_cache    = TTLCache("mint",    ANALYSIS_CACHE_SIZE, MINT_TTL)
+_holders_cache = TTLCache("holders", ANALYSIS_CACHE_SIZE, HOLDERS_TTL)
+_dex_cache     = TTLCache("dex",     ANALYSIS_CACHE_SIZE, DEX_TTL)
+_bmap_cache    = TTLCache("bubblemap",    ANALYSIS_CACHE_SIZE, LINKS_TTL)
+_wallets_cache = TTLCache("wallet_links", ANALYSIS_CACHE_SIZE, LINKS_TTL)
+_deep_cache    = TTLCache("deep_holders", ANALYSIS_CACHE_SIZE, DEEP_TTL)
+# the pieces that cost upstream budget; a check with all of them cached skips the scheduler
+HEAVY_CACHES   = (_mint_cache, _holders_cache, _bmap_cache, _wallets_cache) + ((_deep_cache,) if DEEP_HOLDERS else ())
+
+class AnalysisError(Exception):
+    """A mint that cannot be analysed; the message is shown to the user as-is."""
+
+def parse_mint_account(res: dict) -> dict:
+    val = (res or {}).get("value")
+    if not val:
+        raise AnalysisError("Mint not found. Check the CA.")
+    data = val.get("data", {})
+    if not isinstance(data, dict) or data.get("program") != "spl-token":
+        raise AnalysisError("Not an SPL token (program != spl-token).")
+    pinfo = data.get("parsed", {}).get("info", {})
+    decimals   = int(pinfo.get("decimals", 0))
+    supply_raw = int(pinfo.get("supply", "0"))
+    return {
+        "mint_auth":   pinfo.get("mintAuthority"),
+        "freeze_auth": pinfo.get("freezeAuthority"),
+        "decimals":    decimals,
+        "supply_raw":  supply_raw,
+        "supply_ui":   supply_raw / (10**decimals if decimals else 1),
+    }
+
+@coalesce("onchain")
+async def load_onchain(mint: str, fresh: bool = False):
+    """(mint info, top holders with owners). Whatever is not cached (or everything, if `fresh`)
+    is fetched in one batched POST."""
+    info, holders = (None, None) if fresh else (await _mint_cache.aget(mint), await _holders_cache.aget(mint))
+    calls = []
+    if info is None:    calls.append(("getAccountInfo", [mint, {"encoding":"jsonParsed"}]))
+    if holders is None: calls.append(("getTokenLargestAccounts", [mint, {"commitment":"confirmed"}]))
+    if not calls:
+        return info, holders
+    results = dict(zip([m for m, _ in calls], await rpc_batch(calls, hedge=True)))
+    if info is None:
+        res = results["getAccountInfo"]
+        if isinstance(res, Exception): raise res
+        info = parse_mint_account(res)
+        _mint_cache.set(mint, info)
+    if holders is None:
+        lr = results["getTokenLargestAccounts"]
+        largest = lr.get("value", []) if isinstance(lr, dict) else []
+        # token accounts -> owner wallets (Bubble-Map / Wallet Links must look at wallets, not ATAs)
+        holders = await resolve_holder_owners(largest)
+        if holders: _holders_cache.set(mint, holders)
+    return info, holders
+
+async def prefetch_onchain(mints: list, batch: int = 40) -> dict:
+    """Warms the mint/holder caches for many mints with a few JSON-RPC batches instead of
+    2-3 requests per mint. Returns mint -> AnalysisError for mints that cannot be analysed."""
+    calls, errors = [], {}
+    for m in mints:
+        if _mint_cache.get(m, count=False) is None:
+            calls.append((m, "getAccountInfo", [m, {"encoding":"jsonParsed"}]))
+        if _holders_cache.get(m, count=False) is None:
+            calls.append((m, "getTokenLargestAccounts", [m, {"commitment":"confirmed"}]))
+    async def run(items):
+        chunks = [items[i:i+batch] for i in range(0, len(items), batch)]
+        parts = await asyncio.gather(*(rpc_batch([(meth, params) for _, meth, params in c]) for c in chunks))
+        return [r for part in parts for r in part]
+    largest = {}
+    for (m, meth, _), res in zip(calls, await run(calls)):
+        if isinstance(res, Exception): continue          # left to the per-mint loader
+        if meth == "getAccountInfo":
+            try:
+                _mint_cache.set(m, parse_mint_account(res))
+            except AnalysisError as e:
+                errors[m] = e
+        elif isinstance(res, dict) and res.get("value"):
+            largest[m] = res["value"]
+    owner_calls = [(m, *owner_lookup_call(l)) for m, l in largest.items() if m not in errors]
+    for (m, _, _), res in zip(owner_calls, await run(owner_calls)):
+        if not isinstance(res, Exception):
+            _holders_cache.set(m, apply_owners(largest[m], res))
+    return errors
+
+@coalesce("dex")
+async def load_dex(mint: str) -> dict:
+    summary = await _dex_cache.aget(mint)
+    if summary is None:
+        ds = await fetch_dexscreener_by_mint(mint)
+        pairs = ds.get("pairs", []) if isinstance(ds, dict) else []
+        summary = summarize_pairs(pairs) if pairs else {}
+        _dex_cache.set(mint, summary)
+    return summary
+
+@coalesce("bubblemap")
+async def load_bubblemap(mint: str, holders: list, supply_ui: float = None, fresh: bool = False) -> dict:
+    bmap = None if fresh else await _bmap_cache.aget(mint)
+    if bmap is not None:
+        return bmap
+    if not holders:
+        return {"score":50,"label":"unknown","reasons":["No holder data"],"edges":[]}
+    with timed("stage.bubblemap"):
+        bmap = await bubblemap_score_for_holders(holders, supply_ui)
+    _bmap_cache.set(mint, bmap)
+    return bmap
+
+@coalesce("wallet_links")
+async def load_wallet_links(mint: str, holders: list, fresh: bool = False) -> list:
+    wallet_links = None if fresh else await _wallets_cache.aget(mint)
+    if wallet_links is not None:
+        return wallet_links
+    if not holders:
+        return []
+    # runs alongside the Bubble-Map: the top-8 wallets are a subset of its nodes and the
+    # Helius fetches for shared addresses are coalesced, so nothing is requested twice
+    with timed("stage.wallet_links"):
+        wallet_links = await analyze_wallet_links(mint, holders, max_wallets=8)
+    _wallets_cache.set(mint, wallet_links)
+    return wallet_links
+
+@coalesce("deep")
+async def load_deep_holders(mint: str, supply_raw: int, fresh: bool = False) -> dict:
+    dist = None if fresh else await _deep_cache.aget(mint)
+    if dist is None:
+        with timed("stage.deep_holders"):
+            dist = await fetch_holder_distribution(mint, supply_raw)
+        _deep_cache.set(mint, dist)
+    return dist
+
+async def load_basics(mint: str) -> dict:
+    """The fast pieces (RPC + Dexscreener); enough to render everything but the Helius sections."""
+    (info, holders), dex = await asyncio.gather(measure("stage.onchain", load_onchain(mint)),
+                                                measure("stage.dex", load_dex(mint)))
+    return {"mint": mint, "info": info, "holders": holders, "dex": dex}
+
+@coalesce("analysis")
+async def analyze_mint(mint: str) -> dict:
+    pieces = await load_basics(mint)
+    holders, supply_ui = pieces["holders"], pieces["info"]["supply_ui"]
+    pieces["bmap"], pieces["wallet_links"] = await measure("stage.links", asyncio.gather(
+        load_bubblemap(mint, holders, supply_ui), load_wallet_links(mint, holders)))
+    snapshots.record(pieces)
+    return pieces
+
+# ================== REPORT ==================
+LOADING = "• ⏳ <i>Loading holder linkage…</i>"
+LOADING_DEEP = "• ⏳ <i>Loading all holder accounts…</i>"
+
+def compute_safety(info: dict, holders: list) -> dict:
+    supply = info.get("supply_ui")
+    top1  = pct_from_largest(holders, 1, supply)
+    top5  = pct_from_largest(holders, 5, supply)
+    top10 = pct_from_largest(holders, 10, supply)
+    top20 = pct_from_largest(holders, 20, supply)
+
+    score = SAFETY_RULES.score_one(safety_features(info, top1, top10))["score"]
+    dev_in = info["mint_auth"] is not None or top1 > 15
+    return {"score": score, "dev_in": dev_in, "top1": top1, "top5": top5, "top10": top10, "top20": top20}
+
+def safety_features(info: dict, top1: float, top10: float) -> dict:
+    return {"mint_auth": float(info["mint_auth"] is not None), "freeze_auth": float(info["freeze_auth"] is not None),
+            "top1": top1, "top10": top10}
+
+def rug_check(info: dict, summary: dict, top1: float) -> list:
+    liq = summary.get("dex_liq")
+    rug_flags = []
+    if info["mint_auth"] is not None:   rug_flags.append("🚩 Mint authority still active")
+    if info["freeze_auth"] is not None: rug_flags.append("🚩 Freeze authority still active")
+    if top1 >= 50:              rug_flags.append(f"🚩 Extreme concentration: Top1 {top1:.1f}%")
+    elif top1 >= 30:            rug_flags.append(f"🚩 High concentration: Top1 {top1:.1f}%")
+    try:
+        if liq is not None and float(liq) < 5000:
+            rug_flags.append(f"🚩 Very low liquidity ({fmt_usd(liq)})")
+    except Exception:
+        pass
+    if not summary.get("website") and not summary.get("socials"):
+        rug_flags.append("🚩 No website or socials found")
+    return rug_flags
+
+def render_report(pieces: dict, pending: str = LOADING):
+    """(html text, keyboard) for a report built from the cached analysis pieces.
+    A missing "bmap" / "wallet_links" piece renders as the `pending` placeholder."""
+    mint, info, largest, summary = pieces["mint"], pieces["info"], pieces["holders"], pieces["dex"]
+    bmap, wallet_links = pieces.get("bmap"), pieces.get("wallet_links")
+    mint_auth, freeze_auth = info["mint_auth"], info["freeze_auth"]
+    decimals, supply_ui = info["decimals"], info["supply_ui"]
+
+    sf = compute_safety(info, largest)
+    score, dev_in = sf["score"], sf["dev_in"]
+    top1, top5, top10, top20 = sf["top1"], sf["top5"], sf["top10"], sf["top20"]
+
+    price = summary.get("dex_price")
+    ath   = summary.get("dex_ath")
+    name  = summary.get("name") or "—"
+    sym   = summary.get("symbol") or "—"
+    liq   = summary.get("dex_liq")
+    fdv   = summary.get("dex_fdv")
+    vol24 = summary.get("dex_vol24")
+    pair  = summary.get("dex_pair")
+    website = summary.get("website")
+    socials = summary.get("socials") or []
+
+    # ---- LP risk
+    lp = assess_lp_risk(summary) if summary else {"label":"unknown","reasons":["No active DEX pair found."],"score":50}
+
+    # ---- rug flags
+    rug_flags = rug_check(info, summary, top1)
+    rug_status = "✅ No obvious rug flags found" if not rug_flags else "⚠️ Potential Rug Risk Detected"
+
+    # ---- pretty output
+    score_badge = "🟢" if score >= 75 else "🟡" if score >= 50 else "🔴"
+    dev_badge   = "✅ Likely safe" if not dev_in else "⚠️ Dev likely in control"
+
+    holder_lines = []
+    for a in (largest or [])[:5]:
+        addr = holder_wallet(a) or ""
+        ui   = float(a.get("uiAmount", 0) or 0)
+        if addr:
+            holder_lines.append(f"• {ui:.4f} — <a href='{solscan(addr)}'>Solscan</a>")
+
+    lines = []
+    lines.append(f"<b>PHOENIX ANALYZER — FULL REPORT</b>")
+    lines.append(f"<b>Mint:</b> <code>{safe(mint)}</code>\n")
+
+    lines.append("🔥 <b>Overview</b>")
+    lines.append(f"• <b>Name/Symbol:</b> {safe(name)} / {safe(sym)}")
+    lines.append(f"• <b>Price:</b> {fmt_usd(price) if price else '—'}  |  <b>ATH:</b> {fmt_usd(ath) if ath else '—'}")
+    lines.append(f"• <b>Liquidity:</b> {fmt_usd(liq) if liq else '—'}  |  <b>FDV:</b> {fmt_usd(fdv) if fdv else '—'}  |  <b>24h Vol:</b> {fmt_usd(vol24) if vol24 else '—'}")
+    if website: lines.append(f"• <b>Website:</b> <a href='{safe(website)}'>{safe(website)}</a>")
+    if socials:
+        lines.append("• <b>Socials:</b>")
+        for s in socials[:5]:
+            u = safe(s); lines.append(f"   └ <a href='{u}'>{u}</a>")
+    lines.append("")
+
+    lines.append("📊 <b>DEX / LP</b>")
+    if pair: lines.append(f"• <a href='{pair}'>Dexscreener Pair</a>")
+    lines.append(f"• <b>LP Risk:</b> {lp['label']} (score {lp['score']}/100)")
+    for r in lp.get("reasons", [])[:5]:
+        lines.append(f"  └ {r}")
+    lines.append("")
+
+    lines.append("🫧 <b>Bubble-Map (Holder Linkage)</b>")
+    if bmap is None:
+        lines.append(pending)
+        bmap = {}
+    else:
+        lines.append(f"• <b>Cluster Risk:</b> {bmap.get('label','unknown')} (score {bmap.get('score',0)}/100)")
+    for r in bmap.get("reasons", [])[:3]:
+        lines.append(f"  └ {r}")
+    if bmap.get("edges"):
+        lines.append("• Links among top holders:")
+        for e in bmap["edges"]:
+            lines.append(f"  └ {e}")
+    if bmap.get("clusters"):
+        lines.append(f"• Clusters ({bmap.get('nodes', 0)} wallets, {bmap.get('two_hop', 0)} shared-funder links):")
+        for c in bmap["clusters"][:3]:
+            lines.append(f"  └ {c['size']} wallets hold {c['share']:.1f}% — {safe(', '.join(c['members']))}")
+        for f in bmap.get("funders", [])[:2]:
+            lines.append(f"  └ Shared counterparty {safe(f['address'])} touches {f['holders']} holders")
+    lines.append("")
+
+    lines.append("🛡 <b>Safety</b>")
+    lines.append(f"• <b>Score:</b> {score_badge} {score}/100")
+    lines.append(f"  <code>{progress_bar(score)}</code>")
+    lines.append(f"• <b>Dev in?</b> {dev_badge}")
+    lines.append(f"• <b>Supply:</b> {supply_ui:.2f}  (dec {decimals})")
+    lines.append(f"• <b>Mint authority:</b> {'removed ✅' if mint_auth is None else 'present ⚠️'}")
+    lines.append(f"• <b>Freeze authority:</b> {'removed ✅' if freeze_auth is None else 'present ⚠️'}")
+    lines.append(f"• <b>Holders:</b> Top1 {top1:.1f}% | Top5 {top5:.1f}% | Top10 {top10:.1f}% | Top20 {top20:.1f}%")
+    if holder_lines:
+        lines.append("• <b>Top holders:</b>")
+        lines += holder_lines
+    lines.append("")
+
+    if DEEP_HOLDERS:
+        deep = pieces.get("deep")
+        lines.append("📈 <b>Holder Distribution</b>")
+        if deep is None:
+            lines.append(LOADING_DEEP)
+        elif deep.get("error"):
+            lines.append(f"• Unavailable ({safe(deep['error'])})")
+        elif not deep.get("holders"):
+            lines.append("• No funded holder accounts found.")
+        else:
+            lines.append(f"• <b>Holders:</b> {deep['holders']:,} wallets ({deep['accounts']:,} token accounts)"
+                         + (" — truncated" if deep.get("truncated") else ""))
+            lines.append(f"• <b>Of supply:</b> Top1 {deep['top1']:.1f}% | Top10 {deep['top10']:.1f}% | Top100 {deep['top100']:.1f}%")
+            lines.append(f"• <b>Top 1% / 10% / 50% of wallets:</b> {deep['top1pct']:.1f}% / {deep['top10pct']:.1f}% / {deep['top50pct']:.1f}%")
+            lines.append(f"• <b>Gini:</b> {deep['gini']:.3f}")
+            lines.append("• <b>Wallets by share:</b> " + " | ".join(f"{k} {v:,}" for k, v in deep["buckets"].items()))
+        lines.append("")
+
+    lines.append("💀 <b>RUG CHECK</b>")
+    lines.append(rug_status)
+    for f in rug_flags: lines.append(f"• {f}")
+    lines.append("")
+
+    lines.append("🔗 <b>Wallet Links</b>")
+    if wallet_links is None:
+        lines.append(pending)
+    elif wallet_links:
+        for w in wallet_links:
+            addr = w['address']; cnt = w['other_count']
+            sample = ", ".join([f"<code>{m[:6]}...{m[-6:]}</code>" for m in w['other_sample']]) if w['other_sample'] else "—"
+            lines.append(f"• <a href='{w['solscan']}'>{addr[:6]}...{addr[-6:]}</a> — holds {cnt} other mints | sample: {sample}")
+    else:
+        lines.append("• Could not fetch wallet links (rate limit or missing key).")
+
+    lines.append("\nℹ️ <i>Heuristics only. DYOR.</i>")
+
+    text = "\n".join(lines)
+    if len(text) > 3900: text = text[:3800] + "\n… (trimmed)"
+
+    # Buttons
+    buttons = [[InlineKeyboardButton("🔍 Solscan Mint", url=solscan(mint))]]
+    row = []
+    if pair:    row.append(InlineKeyboardButton("📈 View DEX Pair", url=pair))
+    if website: row.append(InlineKeyboardButton("🌐 Website", url=website))
+    if row: buttons.append(row)
+    kb = InlineKeyboardMarkup(buttons)
+    return text, kb
+
+# ================== SNAPSHOTS (back-testing) ==================
+# Every finished analysis is appended as one row of rule features + scores; rows are buffered and
+# written as compressed column chunks (snap-<ns>-<pid>.npz, never rewritten), so a year of history
+# loads as a handful of arrays that the rule engine re-scores in one call (see backtest.py).
+SNAPSHOT_DIR       = os.getenv("SNAPSHOT_DIR", "snapshots")           # "" = don't record
+SNAPSHOT_CHUNK     = int(os.getenv("SNAPSHOT_CHUNK", "500"))         # rows per chunk file
+SNAPSHOT_FLUSH_SEC = int(os.getenv("SNAPSHOT_FLUSH_SEC", "900"))     # write a partial chunk after this long
+SNAPSHOT_GAP_SEC   = int(os.getenv("SNAPSHOT_GAP_SEC", "300"))       # at most one row per mint per gap
+SNAPSHOT_FIELDS = ("ts", "mint_auth", "freeze_auth", "top1", "top10", "has_pair", "price", "liq", "vol24", "age_h",
+                   "vol_liq", "density", "hub_ratio", "top_share", "safety", "lp", "cluster", "rug_flags")
+NAN = float("nan")
+
+def snapshot_row(pieces: dict) -> dict:
+    info, dex, bmap = pieces["info"], pieces.get("dex") or {}, pieces.get("bmap") or {}
+    sf = compute_safety(info, pieces["holders"])
+    row = dict.fromkeys(SNAPSHOT_FIELDS, NAN)
+    row.update(safety_features(info, sf["top1"], sf["top10"]), ts=time.time(), safety=sf["score"],
+               has_pair=float(bool(dex)), rug_flags=len(rug_check(info, dex, sf["top1"])))
+    if dex:
+        row.update(lp_features(dex), lp=assess_lp_risk(dex)["score"])
+        try: row["price"] = float(dex.get("dex_price") or NAN)
+        except (TypeError, ValueError): pass
+    if bmap.get("features"):   # absent for failed lookups and pre-rules cache entries
+        row.update(bmap["features"], cluster=bmap["score"])
+    return row
+
+def rescore(cols: dict, rules: dict = None) -> dict:
+    """Scores for snapshot columns under `rules` (name -> RuleSet, default RULE_SETS); same masks as the live path."""
+    rules = {**RULE_SETS, **(rules or {})}
+    out = {"safety": rules["safety"].evaluate(cols)["score"].astype(np.float64)}
+    out["lp"] = np.where(cols["has_pair"] > 0, rules["lp"].evaluate(cols)["score"], NAN)
+    out["cluster"] = np.where(np.isnan(cols["density"]), NAN, rules["cluster"].evaluate(cols)["score"])
+    return out
+
+class SnapshotLog:
+    def __init__(self, path: str, chunk: int = SNAPSHOT_CHUNK):
+        self.path, self.chunk = path, max(1, chunk)
+        self.rows, self.first = [], 0.0
+        self.recent = TTLCache("snapshot_recent", 50_000, SNAPSHOT_GAP_SEC, register=False, persistent=False)
+        self.written = self.files = 0
+
+    def record(self, pieces: dict):
+        if not self.path or not pieces or self.recent.get(pieces["mint"], count=False):
+            return
+        try:
+            row = snapshot_row(pieces)
+        except Exception as e:
+            print(f"snapshot {pieces['mint'][:6]}…: {e}"); return
+        self.recent.set(pieces["mint"], True)
+        row["mint"] = pieces["mint"]
+        if not self.rows: self.first = time.monotonic()
+        self.rows.append(row)
+        if len(self.rows) >= self.chunk or time.monotonic() - self.first >= SNAPSHOT_FLUSH_SEC:
+            spawn(self.flush())
+
+    async def flush(self):
+        rows, self.rows = self.rows, []
+        if rows:
+            await asyncio.to_thread(self._write, rows)
+
+    def _write(self, rows: list):
+        cols = {k: np.array([r[k] for r in rows], dtype=np.float64) for k in SNAPSHOT_FIELDS}
+        cols["mint"] = np.array([r["mint"] for r in rows], dtype="U44")
+        try:
+            write_snapshot_chunk(self.path, cols)
+            self.written += len(rows); self.files += 1
+        except OSError as e:
+            print(f"snapshot chunk not written: {e}")
+
+def write_snapshot_chunk(path: str, cols: dict) -> str:
+    os.makedirs(path, exist_ok=True)
+    name = os.path.join(path, f"snap-{time.time_ns()}-{os.getpid()}.npz")
+    with open(name + ".tmp", "wb") as f:
+        np.savez_compressed(f, **cols)
+    os.replace(name + ".tmp", name)   # readers never see a half-written chunk
+    return name
+
+def load_snapshots(path: str = SNAPSHOT_DIR) -> dict:
+    """All chunks under `path` concatenated in time order; columns missing from old chunks read as NaN."""
+    names = sorted(n for n in os.listdir(path) if n.startswith("snap-") and n.endswith(".npz")) if os.path.isdir(path) else []
+    parts = []
+    for n in names:
+        with np.load(os.path.join(path, n)) as z:
+            parts.append({k: z[k] for k in z.files})
+    cols = {k: np.concatenate([p[k] if k in p else np.full(len(p["mint"]), NAN) for p in parts]) if parts
+            else np.empty(0) for k in SNAPSHOT_FIELDS}
+    cols["mint"] = np.concatenate([p["mint"] for p in parts]) if parts else np.empty(0, dtype="U44")
+    order = np.argsort(cols["ts"], kind="stable")
+    return {k: v[order] for k, v in cols.items()}
+
+snapshots = SnapshotLog(SNAPSHOT_DIR)
+
+# ================== PROGRESSIVE DELIVERY ==================
+EDIT_MIN_INTERVAL = float(os.getenv("EDIT_MIN_INTERVAL", "1.0"))   # sec between edits of one message
+
+class MessageEditor:
+    """Edits one sent message in place. Updates are coalesced: while an edit is in flight or
+    inside the min interval only the newest text is kept, so a burst of section completions
+    costs one edit, and Telegram's per-chat edit limit is respected."""
+    def __init__(self, bot, message, interval: float = EDIT_MIN_INTERVAL):
+        self.bot, self.chat_id, self.message_id = bot, message.chat_id, message.message_id
+        self.interval = interval
+        self._pending = None          # (text, kb) not yet sent
+        self._shown = None            # text currently on screen
+        self._last = time.monotonic() # the initial send counts as an edit
+        self._task = None
+
+    def update(self, text: str, kb=None):
+        self._pending = (text, kb)
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._drain())
+
+    async def _drain(self):
+        while self._pending is not None:
+            wait = self._last + self.interval - time.monotonic()
+            if wait > 0:
+                await asyncio.sleep(wait)
+            text, kb = self._pending
+            self._pending = None
+            if text == self._shown:
+                continue
+            try:
+                with timed("stage.telegram_edit"):
+                    await self.bot.edit_message_text(text, chat_id=self.chat_id, message_id=self.message_id,
+                                                     parse_mode="HTML", disable_web_page_preview=True, reply_markup=kb)
+                self._shown = text
+            except RetryAfter as e:
+                count("telegram_edit_errors", reason="retry_after")
+                if self._pending is None:
+                    self._pending = (text, kb)
+                self._last = time.monotonic() + float(e.retry_after)
+                continue
+            except BadRequest as e:
+                if "not modified" not in str(e).lower():
+                    count("telegram_edit_errors", reason="bad_request")
+            except TelegramError:   # NetworkError / TimedOut: skip this edit, a later update may land
+                count("telegram_edit_errors", reason="network")
+            self._last = time.monotonic()
+
+    async def flush(self):
+        """Wait until the newest update is on screen."""
+        while self._task is not None and not self._task.done():
+            await self._task
+
+# ================== WORK SCHEDULER ==================
+MAX_ACTIVE_CHECKS   = int(os.getenv("MAX_ACTIVE_CHECKS", "4"))     # full analyses running at once
+MAX_QUEUED_CHECKS   = int(os.getenv("MAX_QUEUED_CHECKS", "50"))
+USER_CHECK_RATE     = float(os.getenv("USER_CHECK_RATE", "0.2"))   # sustained checks/s per user
+USER_CHECK_BURST    = int(os.getenv("USER_CHECK_BURST", "3"))
+HELIUS_MAX_BACKLOG  = float(os.getenv("HELIUS_MAX_BACKLOG", "20")) # sec of queued Helius work before deferring
+DEFERRED = "• ⏸ <i>Skipped: Helius budget exhausted. /check again in a minute.</i>"
+
+class Overloaded(Exception):
+    """Work the scheduler refused; the message is shown to the user as-is."""
+
+_user_buckets = TTLCache("user_buckets", 100_000, 3600, register=False, persistent=False)
+
+def user_bucket(uid: int) -> TokenBucket:
+    b = _user_buckets.get(uid, count=False)
+    if b is None:
+        b = TokenBucket(USER_CHECK_RATE, USER_CHECK_BURST)
+    _user_buckets.set(uid, b)   # sliding expiry: idle users are forgotten after an hour
+    return b
+
+def analysis_cached(mint: str) -> bool:
+    """All upstream-heavy pieces are in memory (a Dexscreener refresh at most)."""
+    return all(c.get(mint, count=False) is not None for c in HEAVY_CACHES)
+
+def rpc_available() -> bool:
+    return any(e.available() for e in rpc_router.endpoints)
+
+def helius_exhausted() -> bool:
+    return _helius_bucket.backlog() > HELIUS_MAX_BACKLOG
+
+class WorkScheduler:
+    """Bounded pool for full analyses. At most `max_active` run at once; the rest wait in per-user
+    FIFO queues that are served round-robin, so one user's burst cannot starve everyone else.
+    Cached hits cost no upstream budget and bypass the queue."""
+    def __init__(self, max_active: int, max_queued: int):
+        self.max_active, self.max_queued = max_active, max_queued
+        self.active = 0
+        self.queues = OrderedDict()   # uid -> deque of waiting futures, in service order
+        self.queued = 0
+        self.ran = self.fast = self.rejected = 0
+
+    def position(self, fut) -> int:
+        """1-based place of `fut` in round-robin service order."""
+        pos = 0
+        for rnd in itertools.count():
+            live = False
+            for q in self.queues.values():
+                if rnd < len(q):
+                    live, pos = True, pos + 1
+                    if q[rnd] is fut: return pos
+            if not live: return pos
+
+    def _release(self):
+        while self.queues:
+            uid, q = next(iter(self.queues.items()))
+            fut = q.popleft(); self.queued -= 1
+            if q: self.queues.move_to_end(uid)
+            else: del self.queues[uid]
+            if not fut.done():
+                fut.set_result(None)   # the slot is handed over; `active` stays the same
+                return
+        self.active -= 1
+
+    async def run(self, uid: int, fn, *args, cheap: bool = False, bounded: bool = True, on_queued=None):
+        """Run fn(*args) in a slot. `bounded=False` waits even when the queue is full (batch work);
+        `on_queued(position)` is awaited once if the job has to wait."""
+        if cheap:
+            self.fast += 1
+            return await fn(*args)
+        if self.active < self.max_active and not self.queued:
+            self.active += 1
+        else:
+            if bounded and self.queued >= self.max_queued:
+                self.rejected += 1
+                count("scheduler_rejected")
+                raise Overloaded("⚠️ The bot is at capacity right now. Please try again in a minute.")
+            fut = asyncio.get_running_loop().create_future()
+            self.queues.setdefault(uid, deque()).append(fut)
+            self.queued += 1
+            t0 = time.perf_counter()
+            try:
+                if on_queued: await on_queued(self.position(fut))
+                await fut
+            except BaseException:   # cancelled, or on_queued failed: the queued future must not hold a slot
+                if fut.done() and not fut.cancelled():
+                    self._release()              # got a slot but will not use it
+                else:
+                    fut.cancel()                 # left in its queue; _release skips it
+                raise
+            observe("scheduler.wait", (time.perf_counter() - t0) * 1000)
+        self.ran += 1
+        try:
+            return await fn(*args)
+        finally:
+            self._release()
+
+    def stats(self) -> dict:
+        return {"active": self.active, "queued": self.queued, "users_waiting": len(self.queues),
+                "ran": self.ran, "fast": self.fast, "rejected": self.rejected}
+
+work_scheduler = WorkScheduler(MAX_ACTIVE_CHECKS, MAX_QUEUED_CHECKS)
+
 # ================== MEMBERSHIP GATE ==================
+# uid -> is member; kept fresh by chat_member updates from GROUP_USERNAME (bot must be admin there)
+_member_cache = TTLCache("membership", 100_000, MEMBER_TTL_POS, persistent=False)
+
+def remember_membership(uid: int, status: str):
+    is_member = status not in ("left", "kicked")
+    _member_cache.set(uid, is_member, ttl=MEMBER_TTL_POS if is_member else MEMBER_TTL_NEG)
+    return is_member
+
+def is_gate_chat(chat) -> bool:
+    gate = GROUP_USERNAME.lstrip("@").lower()
+    return bool(chat) and (str(chat.id) == gate or (chat.username or "").lower() == gate)
+
+async def on_chat_member(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    cmu = update.chat_member
+    if cmu and is_gate_chat(cmu.chat):
+        remember_membership(cmu.new_chat_member.user.id, cmu.new_chat_member.status)
+
+async def check_member(bot, uid: int) -> bool:
+    is_member = _member_cache.get(uid)
+    if is_member is None:
+        member = await bot.get_chat_member(chat_id=GROUP_USERNAME, user_id=uid)
+        is_member = remember_membership(uid, member.status)
+    return is_member
+
 async def require_membership(update: Update, context: ContextTypes.DEFAULT_TYPE) -> bool:
     try:
         user = update.effective_user
         if not user:
             await update.effective_message.reply_text("Cannot identify user. Please try again.")
             return False
-        member = await context.bot.get_chat_member(chat_id=GROUP_USERNAME, user_id=user.id)
-        if member.status in ("left", "kicked"):
+        if not await check_member(context.bot, user.id):
             await update.effective_message.reply_text(
                 "🚫 Access denied.\nJoin our Phoenix community first:",
                 reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton(f"Join {GROUP_USERNAME}", url=GROUP_JOIN_LINK)]])
@@ -294,7 +1942,11 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await update.message.reply_text(
         "<b>Phoenix Analyzer</b> is online.\n\n"
         "• <b>/check</b> – Ask for CA → Full report\n"
+        "• <b>/scan</b> – Screen many CAs (list or .txt/.csv) → ranked table + CSV\n"
         "• <b>/slot</b> – Current Solana slot\n"
+        "• <b>/alert</b> – Price / liquidity alert (<b>/alerts</b>, <b>/unalert</b>)\n"
+        "• <b>/whale</b> – Live whale-move alerts (<b>/unwhale</b>)\n"
+        "• <b>@bot &lt;CA&gt;</b> – Quick inline verdict in any chat\n"
         "• <b>/ping</b> – Heartbeat\n\n"
         "Join our community to unlock full access.",
         parse_mode="HTML", reply_markup=join_kb
@@ -305,218 +1957,151 @@ async def ping(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 async def slot(update: Update, context: ContextTypes.DEFAULT_TYPE):
     try:
-        s = rpc("getSlot", [])
+        s = await rpc("getSlot", [])
         await update.message.reply_text(f"Slot: {s}")
     except Exception as e:
         await update.message.reply_text(f"RPC error: {e}")
 
+async def health(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if not is_admin(update):   # RPC hosts and error rates are operator information, like /stats
+        return
+    lines = ["<b>RPC endpoints</b> (best first)"]
+    for e in rpc_router.ranked():
+        st = e.stats()
+        icon = "🔴" if st["state"] == "open" else "🟢" if st["err_rate"] < 0.2 else "🟡"
+        lines.append(f"{icon} <code>{safe(st['host'])}</code> — ewma {st['ewma_ms'] or '—'} ms | p95 {st['p95_ms'] or '—'} ms | "
+                     f"err {st['err_rate']:.0%} | {st['calls']} calls, {st['throttled']}×429, {st['hedged']} hedged")
+    lines.append("\n<b>Caches</b>")
+    for name, st in cache_stats().items():
+        lines.append(f"• {name}: {st['size']}/{st['max']} | hit ratio {st['hit_ratio']:.0%} ({st['hits']}/{st['hits']+st['misses']})")
+    lines.append("\n<b>Coalesced requests</b>")
+    lines.append(" | ".join(f"{name} {st['coalesced']}/{st['calls']+st['coalesced']}" for name, st in flight_stats().items()))
+    if _store is not None:
+        st = _store.stats()
+        lines.append(f"• disk: {st['size_mb']} MB | {st['writes']} writes in {st['flushes']} flushes | {st['compactions']} compactions")
+    await update.message.reply_text("\n".join(lines), parse_mode="HTML")
+
+def is_admin(update: Update) -> bool:
+    return bool(update.effective_user) and update.effective_user.id in ADMIN_IDS
+
+async def stats_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if not is_admin(update):
+        return
+    fmt = lambda v: "—" if v is None else "∞" if v == float("inf") else f"≤{v:g}"
+    lines = [f"<b>Latency (ms, last {RollingHistogram.SLOTS*RollingHistogram.SLOT_SEC//60} min)</b>  p50 | p95 | p99 | n"]
+    if SHARD_COUNT > 1:   # webhook mode: these numbers are this worker's only
+        lines.insert(0, f"<i>worker {SHARD_INDEX + 1}/{SHARD_COUNT}</i>")
+    for name, h in sorted(_histograms.items()):
+        w = h.window()
+        if not sum(w): continue
+        lines.append(f"• <code>{safe(name)}</code> {fmt(h.quantile(.5, w))} | {fmt(h.quantile(.95, w))} | {fmt(h.quantile(.99, w))} | {sum(w)}")
+    lines.append("\n<b>Upstream responses</b>")
+    by_up = {}
+    for (name, labels), v in sorted(_counters.items()):
+        lb = dict(labels)
+        if name == "upstream_responses": by_up.setdefault(lb["upstream"], []).append(f"{lb['code']}×{v}")
+        if name == "upstream_retries":   by_up.setdefault(lb["upstream"], []).append(f"retries×{v}")
+    for up, parts in by_up.items():
+        lines.append(f"• {up}: {' '.join(parts)}")
+    lines.append("\n<b>Caches</b>")
+    lines.append(" | ".join(f"{n} {st['hit_ratio']:.0%}" for n, st in cache_stats().items()))
+    lines.append("\n<b>Coalesced</b>")
+    lines.append(" | ".join(f"{n} {st['coalesced']}/{st['calls']+st['coalesced']}" for n, st in flight_stats().items()))
+    st = work_scheduler.stats()
+    lines.append("\n<b>Scheduler</b>")
+    lines.append(f"{st['active']}/{MAX_ACTIVE_CHECKS} active | {st['queued']} queued ({st['users_waiting']} users) | "
+                 f"{st['ran']} ran, {st['fast']} cached, {st['rejected']} rejected | Helius backlog {_helius_bucket.backlog():.1f}s")
+    pw = prewarmer.stats()
+    lines.append("\n<b>Pre-warmer</b>")
+    lines.append(f"{pw['candidates']} candidates ({pw['trending']} trending, {pw['recent']} recent) | {pw['refreshed']} refreshed, "
+                 f"{pw['skipped']} runs out of budget | checks fully cached {pw['check_hit_ratio']:.0%}, "
+                 f"{pw['warm_share_of_hits']:.0%} of those pre-warmed")
+    if snapshots.path:
+        lines.append(f"\n<b>Snapshots</b>\n{snapshots.written} rows in {snapshots.files} chunks written, {len(snapshots.rows)} buffered")
+    await update.message.reply_text("\n".join(lines), parse_mode="HTML")
+
 # ---- Conversation: /check -> ask CA ----
 async def check_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not await require_membership(update, context):
         return ConversationHandler.END
-    uid = update.effective_user.id if update.effective_user else 0
-    now = time.time()
-    if now - _last_call[uid] < USER_COOLDOWN_SEC:
-        await update.message.reply_text("Please wait a moment (rate-limit protection)…")
-        return ConversationHandler.END
-    _last_call[uid] = now
     await update.message.reply_text("Send the contract address (CA) to check:")
     return ASK_CA_CHECK
 
+async def deliver_report(update: Update, context: ContextTypes.DEFAULT_TYPE, mint: str):
+    """Send the fast sections, then edit the Helius sections in as they finish."""
+    t0 = time.perf_counter()
+    pieces = await load_basics(mint)
+    holders, supply_ui = pieces["holders"], pieces["info"]["supply_ui"]
+    for key, cache in (("bmap", _bmap_cache), ("wallet_links", _wallets_cache)):
+        pieces[key] = await cache.aget(mint, count=False)
+        if pieces[key] is not None: cache.record(True)   # misses are counted by the loader
+    if DEEP_HOLDERS:
+        pieces["deep"] = await _deep_cache.aget(mint)
+    linked = pieces["bmap"] is not None and pieces["wallet_links"] is not None
+    deferred = not linked and helius_exhausted()
+    if deferred: count("scheduler_deferred")
+    with timed("stage.render"):
+        text, kb = render_report(pieces, DEFERRED if deferred else LOADING)
+    with timed("stage.telegram_send"):
+        msg = await update.message.reply_text(text, parse_mode="HTML", disable_web_page_preview=True, reply_markup=kb)
+    observe("check.first_message", (time.perf_counter() - t0) * 1000)
+
+    # slow sections arrive later; each one is edited into the sent report
+    editor = MessageEditor(context.bot, msg)
+    failed = {"bmap": {"score": 50, "label": "unknown", "reasons": ["Linkage lookup failed"]}, "wallet_links": []}
+    async def fill(key, aw):
+        try:
+            pieces[key] = await aw
+        except Exception as e:
+            count("check_section_errors", section=key)
+            pieces[key] = failed[key] if key in failed else {"error": str(e)[:120]}
+        editor.update(*render_report(pieces, DEFERRED if deferred else LOADING))
+    jobs = []
+    if not linked and not deferred:
+        jobs.append(measure("stage.links", asyncio.gather(
+            fill("bmap", load_bubblemap(mint, holders, supply_ui)),
+            fill("wallet_links", load_wallet_links(mint, holders)))))
+    if DEEP_HOLDERS and pieces["deep"] is None:
+        jobs.append(fill("deep", load_deep_holders(mint, pieces["info"]["supply_raw"])))
+    if jobs:
+        await asyncio.gather(*jobs)
+        await editor.flush()
+    if not deferred:
+        snapshots.record(pieces)
+
 async def check_receive_ca(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not await require_membership(update, context):
         return ConversationHandler.END
     uid = update.effective_user.id if update.effective_user else 0
-    now = time.time()
-    if now - _last_call[uid] < USER_COOLDOWN_SEC:
-        await update.message.reply_text("Please wait a moment (rate-limit protection)…")
-        return ConversationHandler.END
-    _last_call[uid] = now
 
     mint = (update.message.text or "").strip()
     if not mint:
         await update.message.reply_text("Empty message. Send a mint address or /cancel.")
         return ConversationHandler.END
+    if not is_mint(mint):   # before the bucket and the pre-warm ranking: junk costs nothing
+        await update.message.reply_text("That is not a valid Solana mint address. Send /check to try again.")
+        return ConversationHandler.END
+    bucket = user_bucket(uid)
+    if not bucket.try_acquire():
+        await update.message.reply_text(f"Slow down a little — next check in {bucket.retry_in():.0f}s.")
+        return ConversationHandler.END
+    cheap = analysis_cached(mint)
+    prewarmer.touch(mint, cheap)
+    if not cheap and not rpc_available():
+        count("scheduler_rejected")
+        await update.message.reply_text("⚠️ Solana RPC is unavailable right now. Please try again shortly.")
+        return ConversationHandler.END
 
-    cache_key = ("check", mint)
-    with _cache_lock:
-        hit = _cache.get(cache_key)
-        if hit and (now - hit[0] <= CACHE_TTL):
-            await update.message.reply_text(hit[1], parse_mode="HTML", disable_web_page_preview=True, reply_markup=hit[2])
-            return ConversationHandler.END
-
-    try:
-        # ---- on-chain basics
-        res = rpc("getAccountInfo", [mint, {"encoding":"jsonParsed"}])
-        val = res.get("value")
-        if not val:
-            await update.message.reply_text("Mint not found. Check the CA.")
-            return ConversationHandler.END
-        data = val.get("data", {})
-        if data.get("program") != "spl-token":
-            await update.message.reply_text("Not an SPL token (program != spl-token).")
-            return ConversationHandler.END
-
-        pinfo = data.get("parsed", {}).get("info", {})
-        mint_auth   = pinfo.get("mintAuthority")
-        freeze_auth = pinfo.get("freezeAuthority")
-        decimals    = int(pinfo.get("decimals", 0))
-        supply_raw  = int(pinfo.get("supply","0"))
-        supply_ui   = supply_raw / (10**decimals if decimals else 1)
-
-        largest = []
-        try:
-            lr = rpc("getTokenLargestAccounts", [mint, {"commitment":"confirmed"}])
-            largest = lr.get("value", []) if isinstance(lr, dict) else []
-        except Exception:
-            largest = []
-
-        top1  = pct_from_largest(largest, 1)
-        top5  = pct_from_largest(largest, 5)
-        top10 = pct_from_largest(largest, 10)
-        top20 = pct_from_largest(largest, 20)
-
-        # ---- safety score (simple heuristic)
-        score, dev_in = 50, False
-        if mint_auth is None: score+=25
-        else: score-=20; dev_in=True
-        if freeze_auth is None: score+=10
-        if top1 > 0:
-            if top1 > 30: score-=25; dev_in=True
-            elif top1 > 15: score-=10; dev_in=True
-            else: score+=5
-        if top10 > 0:
-            if top10 < 30: score+=15
-            elif top10 > 60: score-=15
-        score = max(0, min(100, score))
-
-        # ---- off-chain (Dexscreener)
-        ds = fetch_dexscreener_by_mint(mint)
-        pairs = ds.get("pairs", []) if isinstance(ds, dict) else []
-        summary = summarize_pairs(pairs) if pairs else {}
-        price = summary.get("dex_price")
-        ath   = summary.get("dex_ath")
-        name  = summary.get("name") or "—"
-        sym   = summary.get("symbol") or "—"
-        liq   = summary.get("dex_liq")
-        fdv   = summary.get("dex_fdv")
-        vol24 = summary.get("dex_vol24")
-        pair  = summary.get("dex_pair")
-        website = summary.get("website")
-        socials = summary.get("socials") or []
-
-        # ---- LP risk
-        lp = assess_lp_risk(summary) if summary else {"label":"unknown","reasons":["No active DEX pair found."],"score":50}
-
-        # ---- Bubble-map (Helius)
-        bmap = bubblemap_score_for_holders(largest) if largest else {"score":50,"label":"unknown","reasons":["No holder data"],"edges":[]}
-
-        # ---- rug flags
-        rug_flags = []
-        if mint_auth is not None:   rug_flags.append("🚩 Mint authority still active")
-        if freeze_auth is not None: rug_flags.append("🚩 Freeze authority still active")
-        if top1 >= 50:              rug_flags.append(f"🚩 Extreme concentration: Top1 {top1:.1f}%")
-        elif top1 >= 30:            rug_flags.append(f"🚩 High concentration: Top1 {top1:.1f}%")
-        try:
-            if liq is not None and float(liq) < 5000:
-                rug_flags.append(f"🚩 Very low liquidity ({fmt_usd(liq)})")
-        except Exception:
+    async def queued(pos):
+        try:   # a notice only; the check keeps its place either way
+            await update.message.reply_text(f"⏳ Busy right now — you are #{pos} in the queue.")
+        except TelegramError:
             pass
-        if not website and not socials:
-            rug_flags.append("🚩 No website or socials found")
-        rug_status = "✅ No obvious rug flags found" if not rug_flags else "⚠️ Potential Rug Risk Detected"
-
-        # ---- Wallet links (Helius)
-        wallet_links = analyze_wallet_links(mint, largest, max_wallets=8) if largest else []
-
-        # ---- pretty output
-        score_badge = "🟢" if score >= 75 else "🟡" if score >= 50 else "🔴"
-        dev_badge   = "✅ Likely safe" if not dev_in else "⚠️ Dev likely in control"
-
-        holder_lines = []
-        for a in (largest or [])[:5]:
-            addr = a.get("address") or a.get("addressStr") or ""
-            ui   = float(a.get("uiAmount", 0) or 0)
-            if addr:
-                holder_lines.append(f"• {ui:.4f} — <a href='{solscan(addr)}'>Solscan</a>")
-
-        lines = []
-        lines.append(f"<b>PHOENIX ANALYZER — FULL REPORT</b>")
-        lines.append(f"<b>Mint:</b> <code>{safe(mint)}</code>\n")
-
-        lines.append("🔥 <b>Overview</b>")
-        lines.append(f"• <b>Name/Symbol:</b> {safe(name)} / {safe(sym)}")
-        lines.append(f"• <b>Price:</b> {fmt_usd(price) if price else '—'}  |  <b>ATH:</b> {fmt_usd(ath) if ath else '—'}")
-        lines.append(f"• <b>Liquidity:</b> {fmt_usd(liq) if liq else '—'}  |  <b>FDV:</b> {fmt_usd(fdv) if fdv else '—'}  |  <b>24h Vol:</b> {fmt_usd(vol24) if vol24 else '—'}")
-        if website: lines.append(f"• <b>Website:</b> <a href='{safe(website)}'>{safe(website)}</a>")
-        if socials:
-            lines.append("• <b>Socials:</b>")
-            for s in socials[:5]:
-                u = safe(s); lines.append(f"   └ <a href='{u}'>{u}</a>")
-        lines.append("")
-
-        lines.append("📊 <b>DEX / LP</b>")
-        if pair: lines.append(f"• <a href='{pair}'>Dexscreener Pair</a>")
-        lines.append(f"• <b>LP Risk:</b> {lp['label']} (score {lp['score']}/100)")
-        for r in lp.get("reasons", [])[:5]:
-            lines.append(f"  └ {r}")
-        lines.append("")
-
-        lines.append("🫧 <b>Bubble-Map (Holder Linkage)</b>")
-        lines.append(f"• <b>Cluster Risk:</b> {bmap.get('label','unknown')} (score {bmap.get('score',0)}/100)")
-        for r in bmap.get("reasons", [])[:3]:
-            lines.append(f"  └ {r}")
-        if bmap.get("edges"):
-            lines.append("• Links among top holders:")
-            for e in bmap["edges"]:
-                lines.append(f"  └ {e}")
-        lines.append("")
-
-        lines.append("🛡 <b>Safety</b>")
-        lines.append(f"• <b>Score:</b> {score_badge} {score}/100")
-        lines.append(f"  <code>{progress_bar(score)}</code>")
-        lines.append(f"• <b>Dev in?</b> {dev_badge}")
-        lines.append(f"• <b>Supply:</b> {supply_ui:.2f}  (dec {decimals})")
-        lines.append(f"• <b>Mint authority:</b> {'removed ✅' if mint_auth is None else 'present ⚠️'}")
-        lines.append(f"• <b>Freeze authority:</b> {'removed ✅' if freeze_auth is None else 'present ⚠️'}")
-        lines.append(f"• <b>Holders:</b> Top1 {top1:.1f}% | Top5 {top5:.1f}% | Top10 {top10:.1f}% | Top20 {top20:.1f}%")
-        if holder_lines:
-            lines.append("• <b>Top holders:</b>")
-            lines += holder_lines
-        lines.append("")
-
-        lines.append("💀 <b>RUG CHECK</b>")
-        lines.append(rug_status)
-        for f in rug_flags: lines.append(f"• {f}")
-        lines.append("")
-
-        lines.append("🔗 <b>Wallet Links</b>")
-        if wallet_links:
-            for w in wallet_links:
-                addr = w['address']; cnt = w['other_count']
-                sample = ", ".join([f"<code>{m[:6]}...{m[-6:]}</code>" for m in w['other_sample']]) if w['other_sample'] else "—"
-                lines.append(f"• <a href='{w['solscan']}'>{addr[:6]}...{addr[-6:]}</a> — holds {cnt} other mints | sample: {sample}")
-        else:
-            lines.append("• Could not fetch wallet links (rate limit or missing key).")
-
-        lines.append("\nℹ️ <i>Heuristics only. DYOR.</i>")
-
-        text = "\n".join(lines)
-        if len(text) > 3900: text = text[:3800] + "\n… (trimmed)"
-
-        # Buttons
-        buttons = [[InlineKeyboardButton("🔍 Solscan Mint", url=solscan(mint))]]
-        row = []
-        if pair:    row.append(InlineKeyboardButton("📈 View DEX Pair", url=pair))
-        if website: row.append(InlineKeyboardButton("🌐 Website", url=website))
-        if row: buttons.append(row)
-        kb = InlineKeyboardMarkup(buttons)
-
-        with _cache_lock:
-            _cache[cache_key] = (time.time(), text, kb)
-
-        await update.message.reply_text(text, parse_mode="HTML", disable_web_page_preview=True, reply_markup=kb)
-
+    try:
+        with timed("check.total"):
+            await work_scheduler.run(uid, deliver_report, update, context, mint, cheap=cheap, on_queued=queued)
+    except (AnalysisError, Overloaded) as e:
+        await update.message.reply_text(str(e))
     except Exception as e:
         await update.message.reply_text(f"Error: {e}")
     return ConversationHandler.END
@@ -525,34 +2110,963 @@ async def check_cancel(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await update.message.reply_text("Canceled.")
     return ConversationHandler.END
 
-# ================== DUMMY JOBS (Guarded) ==================
+# ================== BATCH SCAN ==================
+SCAN_MAX_MINTS    = int(os.getenv("SCAN_MAX_MINTS", "500"))
+SCAN_MAX_FILE     = 512 * 1024                                        # bytes of an uploaded list
+SCAN_CHUNK        = 30                                                # mints per RPC/Dexscreener prefetch round
+SCAN_WORKERS      = int(os.getenv("SCAN_WORKERS", str(HELIUS_CONCURRENCY)))   # mints in the Helius stage at once
+SCAN_TABLE_ROWS   = 25
+MINT_RE = re.compile(r"(?<![1-9A-HJ-NP-Za-km-z])[1-9A-HJ-NP-Za-km-z]{32,44}(?![1-9A-HJ-NP-Za-km-z])")
+_B58 = {c: i for i, c in enumerate("123456789ABCDEFGHJKLMNPQRSTUVWXYZabcdefghijkmnopqrstuvwxyz")}
+_active_scans = set()                                                 # user ids with a scan running
+
+def is_pubkey(s: str) -> bool:
+    """True if the base58 string decodes to exactly 32 bytes."""
+    n = 0
+    for ch in s: n = n * 58 + _B58[ch]
+    return len(s) - len(s.lstrip("1")) + (n.bit_length() + 7) // 8 == 32
+
+def is_mint(s: str) -> bool:
+    return bool(MINT_RE.fullmatch(s)) and is_pubkey(s)
+
+def extract_mints(text: str) -> list:
+    """Distinct public keys in order of appearance (works for plain lists, CSVs and pasted links)."""
+    return [m for m in dict.fromkeys(MINT_RE.findall(text or "")) if is_pubkey(m)]
+
+def scan_row(mint: str, pieces: dict = None, error: str = None) -> dict:
+    if pieces is None:
+        return {"mint": mint, "symbol": "", "score": -1, "safety": "", "lp": "", "cluster": "",
+                "price": "", "liq": "", "fdv": "", "rug_flags": "", "error": error or ""}
+    info, dex, bmap = pieces["info"], pieces["dex"], pieces["bmap"]
+    sf = compute_safety(info, pieces["holders"])
+    lp = assess_lp_risk(dex)
+    cluster = bmap.get("score", 50)
+    return {"mint": mint, "symbol": dex.get("symbol") or "", "score": round((sf["score"] + lp["score"] + cluster) / 3),
+            "safety": sf["score"], "lp": lp["score"], "cluster": cluster,
+            "price": dex.get("dex_price") or "", "liq": dex.get("dex_liq") or "", "fdv": dex.get("dex_fdv") or "",
+            "rug_flags": len(rug_check(info, dex, sf["top1"])), "error": ""}
+
+async def run_scan(mints: list, progress=None, uid: int = 0) -> list:
+    """Pipelined scan: a feeder warms the RPC and Dexscreener caches chunk by chunk with batched
+    lookups while SCAN_WORKERS workers run the Helius stage, so throughput follows the upstream
+    budgets rather than the latency of a single /check."""
+    queue, rows = asyncio.Queue(maxsize=2 * SCAN_CHUNK), []
+    async def feeder():
+        try:
+            for i in range(0, len(mints), SCAN_CHUNK):
+                chunk = mints[i:i+SCAN_CHUNK]
+                dex_missing = [m for m in chunk if _dex_cache.get(m, count=False) is None]
+                errors, dex = await asyncio.gather(prefetch_onchain(chunk), fetch_dexscreener_many(dex_missing),
+                                                   return_exceptions=True)
+                if isinstance(errors, Exception): errors = {}   # workers fall back to the per-mint loaders
+                for m, summary in (dex.items() if isinstance(dex, dict) else ()):
+                    _dex_cache.set(m, summary)
+                for m in chunk:
+                    await queue.put((m, errors.get(m)))
+        finally:
+            for _ in range(SCAN_WORKERS):
+                await queue.put(None)
+    async def worker():
+        while (item := await queue.get()) is not None:
+            mint, err = item
+            if err is not None:
+                rows.append(scan_row(mint, error=str(err)))
+            else:
+                try:
+                    pieces = await work_scheduler.run(uid, analyze_mint, mint, cheap=analysis_cached(mint), bounded=False)
+                    rows.append(scan_row(mint, pieces))
+                except AnalysisError as e:
+                    rows.append(scan_row(mint, error=str(e)))
+                except Exception as e:
+                    rows.append(scan_row(mint, error=f"Error: {e}"))
+            if progress: progress(len(rows), len(mints))
+    with timed("scan.total"):
+        await asyncio.gather(feeder(), *(worker() for _ in range(SCAN_WORKERS)))
+    count("scan_mints", len(mints))
+    rows.sort(key=lambda r: (r["score"], r["safety"] or 0, r["lp"] or 0, r["cluster"] or 0), reverse=True)
+    return rows
+
+def render_scan(rows: list) -> str:
+    ok = [r for r in rows if not r["error"]]
+    lines = [f"<b>PHOENIX SCAN</b> — {len(rows)} mints, {len(rows) - len(ok)} failed",
+             "<i>score = mean of Safety / LP / Cluster (higher is safer)</i>", "<pre>",
+             " #  Symbol    Scr Saf LP  Clu Liq      Mint"]
+    for i, r in enumerate(ok[:SCAN_TABLE_ROWS], 1):
+        liq = fmt_usd(r["liq"]) if r["liq"] else "—"
+        lines.append(f"{i:>2}  {safe(r['symbol'][:8]):<8}  {r['score']:>3} {r['safety']:>3} {r['lp']:>3} {r['cluster']:>3} "
+                     f"{liq:<8} {r['mint'][:4]}…{r['mint'][-4:]}")
+    lines.append("</pre>")
+    if len(ok) > SCAN_TABLE_ROWS:
+        lines.append(f"… {len(ok) - SCAN_TABLE_ROWS} more in the CSV.")
+    return "\n".join(lines)
+
+def scan_csv(rows: list) -> bytes:
+    buf = io.StringIO()
+    w = csv.DictWriter(buf, fieldnames=list(scan_row("").keys()))
+    w.writeheader(); w.writerows(rows)
+    return buf.getvalue().encode("utf-8")
+
+async def scan_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """/scan <CAs…>, or /scan as caption of / reply to a .txt/.csv upload."""
+    if not await require_membership(update, context):
+        return
+    msg = update.message
+    text = msg.text or msg.caption or ""
+    doc = msg.document or (msg.reply_to_message.document if msg.reply_to_message else None)
+    if doc is not None:
+        if (doc.file_size or 0) > SCAN_MAX_FILE:
+            await msg.reply_text(f"File too large (max {SCAN_MAX_FILE // 1024} KB)."); return
+        f = await context.bot.get_file(doc.file_id)
+        text += "\n" + bytes(await f.download_as_bytearray()).decode("utf-8", errors="ignore")
+    mints = extract_mints(text)
+    if not mints:
+        await msg.reply_text("Usage: <code>/scan &lt;CA&gt; &lt;CA&gt; …</code> or send a .txt/.csv file with the caption /scan.",
+                             parse_mode="HTML"); return
+    uid = update.effective_user.id
+    if uid in _active_scans:
+        await msg.reply_text("A scan of yours is already running."); return
+    skipped = max(0, len(mints) - SCAN_MAX_MINTS)
+    mints = mints[:SCAN_MAX_MINTS]
+
+    _active_scans.add(uid)
+    try:
+        status = await msg.reply_text(f"🔎 Scanning {len(mints)} mints…" + (f" ({skipped} over the limit skipped)" if skipped else ""))
+        editor = MessageEditor(context.bot, status, interval=max(EDIT_MIN_INTERVAL, 3.0))
+        rows = await run_scan(mints, uid=uid, progress=lambda done, total: editor.update(f"🔎 Scanning… {done}/{total}\n<code>{progress_bar(100 * done // total)}</code>"))
+        editor.update(render_scan(rows))
+        await editor.flush()
+        await msg.reply_document(scan_csv(rows), filename=f"phoenix_scan_{int(time.time())}.csv",
+                                 caption=f"{len(rows)} mints, ranked by combined score")
+    except Exception as e:
+        await msg.reply_text(f"Scan failed: {e}")
+    finally:
+        _active_scans.discard(uid)
+
+# ================== INLINE MODE ==================
+INLINE_TIMEOUT   = float(os.getenv("INLINE_TIMEOUT", "0.8"))   # sec budget for the on-chain fallback
+INLINE_CACHE_SEC = 30                                          # Telegram-side cache for complete verdicts
+
+async def load_onchain_quick(mint: str):
+    """(mint info, top token accounts) in one batched POST. Owners are not resolved, which is
+    enough for authorities and concentration; the raw accounts are handed to the warm-up."""
+    info, holders = await _mint_cache.aget(mint), await _holders_cache.aget(mint)
+    if info is not None and holders is not None:
+        return info, holders, False
+    res, lr = await rpc_batch([("getAccountInfo", [mint, {"encoding":"jsonParsed"}]),
+                               ("getTokenLargestAccounts", [mint, {"commitment":"confirmed"}])], hedge=True)
+    if info is None:
+        if isinstance(res, Exception): raise res
+        info = parse_mint_account(res)
+        _mint_cache.set(mint, info)
+    if holders is None:
+        return info, lr.get("value", []) if isinstance(lr, dict) else [], True
+    return info, holders, False
+
+async def warm_analysis(mint: str, largest: list = None, uid: int = 0):
+    """Runs the full analysis in the background so a later /check is a cache hit."""
+    try:
+        if work_scheduler.queued or helius_exhausted():   # spare capacity only
+            count("inline_warmups", result="skipped"); return
+        if largest and await _holders_cache.aget(mint, count=False) is None:
+            holders = await resolve_holder_owners(largest)
+            if holders: _holders_cache.set(mint, holders)
+        await work_scheduler.run(uid, analyze_mint, mint)
+        count("inline_warmups", result="ok")
+    except Exception:
+        count("inline_warmups", result="error")
+
+def render_verdict(pieces: dict, bot_username: str = None):
+    """(title, description, html text) of the compact inline verdict; dex/bmap are optional."""
+    mint, info, dex, bmap = pieces["mint"], pieces["info"], pieces.get("dex"), pieces.get("bmap")
+    sf = compute_safety(info, pieces["holders"])
+    score = sf["score"]
+    badge = "🟢" if score >= 75 else "🟡" if score >= 50 else "🔴"
+    sym = (dex or {}).get("symbol") or f"{mint[:4]}…{mint[-4:]}"
+    mint_ok, freeze_ok = info["mint_auth"] is None, info["freeze_auth"] is None
+    desc = [f"Mint {'✅' if mint_ok else '⚠️'}", f"Freeze {'✅' if freeze_ok else '⚠️'}", f"Top10 {sf['top10']:.0f}%"]
+    lines = [f"{badge} <b>{safe(sym)}</b> — Safety {score}/100",
+             f"• Mint authority {'removed ✅' if mint_ok else 'present ⚠️'} | Freeze {'removed ✅' if freeze_ok else 'present ⚠️'}",
+             f"• Top1 {sf['top1']:.1f}% | Top10 {sf['top10']:.1f}%"]
+    if dex:
+        lp = assess_lp_risk(dex)
+        desc.append(f"Liq {fmt_usd(dex.get('dex_liq')) if dex.get('dex_liq') else '—'}")
+        lines.append(f"• Liquidity {fmt_usd(dex.get('dex_liq')) if dex.get('dex_liq') else '—'} | {lp['label']}")
+    if bmap:
+        desc.append(f"Clusters {bmap.get('score', 0)}")
+        lines.append(f"• Bubble-Map: {bmap.get('label', 'unknown')} ({bmap.get('score', 0)}/100)")
+    lines.append(f"<code>{safe(mint)}</code>")
+    if bot_username: lines.append(f"Full report: /check in @{safe(bot_username)}")
+    return f"{badge} {sym} — Safety {score}/100", " · ".join(desc), "\n".join(lines)
+
+def verdict_article(mint: str, title: str, description: str, text: str) -> InlineQueryResultArticle:
+    return InlineQueryResultArticle(
+        id=mint, title=title, description=description,
+        input_message_content=InputTextMessageContent(text, parse_mode="HTML", disable_web_page_preview=True),
+        reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("🔍 Solscan Mint", url=solscan(mint))]]))
+
+async def inline_query(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """@bot <CA>: verdict from cached pieces, else from one batched RPC call; never the full pipeline."""
+    iq = update.inline_query
+    mints = extract_mints(iq.query)
+    if not mints:
+        await iq.answer([], cache_time=INLINE_CACHE_SEC); return
+    mint = mints[0]
+    try:
+        member = await check_member(context.bot, iq.from_user.id)
+    except Exception:
+        member = False
+    if not member:
+        await iq.answer([], cache_time=5, is_personal=True,
+                        button=InlineQueryResultsButton(f"Join {GROUP_USERNAME} to unlock", start_parameter="join"))
+        return
+
+    with timed("inline.total"):
+        pieces = {"mint": mint, "dex": await _dex_cache.aget(mint), "bmap": await _bmap_cache.aget(mint)}
+        try:
+            pieces["info"], pieces["holders"], raw = await asyncio.wait_for(load_onchain_quick(mint), INLINE_TIMEOUT)
+        except AnalysisError as e:
+            count("inline_queries", source="invalid")
+            await iq.answer([verdict_article(mint, "❌ Not analysable", str(e), f"<code>{safe(mint)}</code>: {safe(str(e))}")],
+                            cache_time=INLINE_CACHE_SEC, is_personal=True)
+            return
+        except Exception:
+            count("inline_queries", source="timeout")
+            spawn(warm_analysis(mint, uid=iq.from_user.id))
+            await iq.answer([verdict_article(mint, "⏳ Analysing…", "Type the CA again in a few seconds",
+                                             f"<code>{safe(mint)}</code>")], cache_time=0, is_personal=True)
+            return
+        complete = pieces["dex"] is not None and pieces["bmap"] is not None and not raw
+        count("inline_queries", source="cached" if complete else "onchain" if raw else "partial")
+        if not complete:
+            spawn(warm_analysis(mint, pieces["holders"] if raw else None, iq.from_user.id))
+        title, desc, text = render_verdict(pieces, context.bot.username)
+        # is_personal: Telegram caches answers per query string, and these are for members only
+        await iq.answer([verdict_article(mint, title, desc, text)], cache_time=INLINE_CACHE_SEC if complete else 5,
+                        is_personal=True)
+
+# ================== PRE-WARMER ==================
+PREWARM_MAX       = int(os.getenv("PREWARM_MAX", "40"))            # candidates kept warm (0 = off)
+PREWARM_INTERVAL  = int(os.getenv("PREWARM_INTERVAL", "60"))       # sec between job runs
+PREWARM_PER_TICK  = int(os.getenv("PREWARM_PER_TICK", "4"))        # full refreshes per run at most
+PREWARM_LEAD      = 2 * PREWARM_INTERVAL                           # refresh pieces expiring this soon
+PREWARM_RECENT    = 3600                                           # recently checked mints count for an hour
+PREWARM_HALFLIFE  = 900                                            # decay of a mint's check count
+TRENDING_SEC      = 300                                            # Dexscreener boosts refresh
+BOOST_PATHS       = ("/token-boosts/top/v1", "/token-boosts/latest/v1")
+
+class PreWarmer:
+    """Keeps the analyses most likely to be asked for warm: Dexscreener-boosted Solana tokens and
+    mints checked in the last hour, ranked by a decayed check count plus trending rank. Pieces are
+    recomputed shortly before their TTL runs out, only while the scheduler and upstreams are idle."""
+    def __init__(self):
+        self.recent = {}        # mint -> (decayed checks, last check ts)
+        self.trending = []      # boosted mints, best first
+        self.trending_at = 0.0
+        self.warmed = {}        # mint -> ts of the last warm refresh not yet superseded by a user miss
+        self.shared = []        # webhook mode: (mint, decayed checks, last check ts) from the other workers
+        self.failed = {}        # mint -> ts of its last failed refresh; not a candidate for PREWARM_RECENT
+        self.refreshed = self.skipped = 0
+
+    def touch(self, mint: str, cached: bool):
+        """Called for every user check; feeds the ranking and the hit-rate report."""
+        now = time.time()
+        n, t = self.recent.get(mint, (0.0, now))
+        self.recent[mint] = (n * 0.5 ** ((now - t) / PREWARM_HALFLIFE) + 1, now)
+        sharded = SHARD_COUNT > 1 and _store is not None
+        if sharded:   # only worker 0 warms; it ranks by every worker's checks
+            _store.put("prewarm_recent", f"{mint}#{SHARD_INDEX}", list(self.recent[mint]), now + PREWARM_RECENT)
+        count("check_cache", result="hit" if cached else "miss")
+        if cached and mint in self.warmed:
+            count("prewarm_hits")
+        if not cached and self.warmed.pop(mint, None) and sharded:
+            _store.delete("prewarm_warmed", mint)
+
+    async def sync(self):
+        """Webhook mode: worker 0 collects the other workers' check counts, the others its warm marks."""
+        if SHARD_COUNT <= 1 or _store is None: return
+        if SHARD_INDEX == 0:
+            rows = await asyncio.to_thread(_store.load, "prewarm_recent", 100_000)
+            self.shared = [(k.rsplit("#", 1)[0], n, t) for k, (n, t), _ in rows if not k.endswith("#0")]
+        else:
+            rows = await asyncio.to_thread(_store.load, "prewarm_warmed", 100_000)
+            self.warmed = {k: ts for k, ts, _ in rows}
+
+    async def refresh_trending(self):
+        mints = []
+        for path in BOOST_PATHS:
+            try:
+                r = await http_client("dexscreener").get(f"{DEXSCREENER_BASE}{path}", timeout=15)
+                count("upstream_responses", upstream="dexscreener", code=str(r.status_code))
+                rows = r.json() if r.status_code == 200 else []
+            except (httpx.HTTPError, ValueError):
+                count("upstream_responses", upstream="dexscreener", code="error")
+                continue
+            mints += [b.get("tokenAddress") for b in rows or [] if isinstance(b, dict) and b.get("chainId") == "solana"]
+        self.trending = [m for m in dict.fromkeys(mints) if m and is_mint(m)]
+        self.trending_at = time.time()
+
+    def candidates(self) -> list:
+        now = time.time()
+        for m, (_, t) in list(self.recent.items()):
+            if now - t > PREWARM_RECENT: del self.recent[m]
+        for m, t in list(self.failed.items()):
+            if now - t > PREWARM_RECENT: del self.failed[m]
+        score = {}
+        for i, m in enumerate(self.trending):
+            score[m] = 1.0 - i / max(1, len(self.trending))
+        for m, n, t in itertools.chain(((m, n, t) for m, (n, t) in self.recent.items()), self.shared):
+            score[m] = score.get(m, 0.0) + 2.0 * n * 0.5 ** ((now - t) / PREWARM_HALFLIFE)
+        return sorted((m for m in score if m not in self.failed), key=score.get, reverse=True)[:PREWARM_MAX]
+
+    def has_budget(self) -> bool:
+        return (not work_scheduler.queued and work_scheduler.active < max(1, MAX_ACTIVE_CHECKS - 1)
+                and rpc_available() and not helius_exhausted())
+
+    async def refresh(self, mint: str):
+        due = lambda c: (c.expires_in(mint) or 0) < PREWARM_LEAD
+        info, holders = await load_onchain(mint, fresh=due(_mint_cache) or due(_holders_cache))
+        bmap, _, dex = await asyncio.gather(load_bubblemap(mint, holders, info["supply_ui"], fresh=due(_bmap_cache)),
+                                            load_wallet_links(mint, holders, fresh=due(_wallets_cache)), load_dex(mint))
+        if DEEP_HOLDERS and due(_deep_cache):
+            await load_deep_holders(mint, info["supply_raw"], fresh=True)
+        # revisits of hot mints are what later label earlier snapshots as rugged or not
+        snapshots.record({"mint": mint, "info": info, "holders": holders, "dex": dex, "bmap": bmap})
+        self.warmed[mint] = time.time()
+        if SHARD_COUNT > 1 and _store is not None:
+            _store.put("prewarm_warmed", mint, self.warmed[mint], self.warmed[mint] + PREWARM_RECENT)
+        self.refreshed += 1
+
+    async def tick(self, per_tick: int = None):
+        if PREWARM_MAX <= 0: return
+        await self.sync()
+        if time.time() - self.trending_at > TRENDING_SEC:
+            await self.refresh_trending()
+        cands = self.candidates()
+        due = lambda c, m: (c.expires_in(m) or 0) < PREWARM_LEAD
+        dex_due = [m for m in cands if due(_dex_cache, m)]
+        if dex_due:   # prices for every candidate cost one or two batched calls
+            for m, summary in (await fetch_dexscreener_many(dex_due)).items():
+                _dex_cache.set(m, summary)
+        done = 0
+        for m in cands:
+            if done >= (per_tick or PREWARM_PER_TICK): break
+            if not any(due(c, m) for c in HEAVY_CACHES):
+                continue
+            if not self.has_budget():
+                self.skipped += 1
+                count("prewarm_skipped")
+                break
+            try:
+                await work_scheduler.run(0, self.refresh, m)
+            except Overloaded:
+                break
+            except Exception as e:   # not analysable or upstream trouble: back off instead of retrying every tick
+                if not isinstance(e, AnalysisError): print(f"prewarm {m[:8]}… failed: {e}")
+                self.failed[m] = time.time()
+                self.recent.pop(m, None)
+                if m in self.trending: self.trending.remove(m)
+            done += 1
+
+    def stats(self) -> dict:
+        hits = _counters.get(("check_cache", (("result", "hit"),)), 0)
+        misses = _counters.get(("check_cache", (("result", "miss"),)), 0)
+        warm = _counters.get(("prewarm_hits", ()), 0)
+        return {"candidates": len(self.candidates()), "trending": len(self.trending),
+                "recent": len(self.recent.keys() | {m for m, _, _ in self.shared}),
+                "refreshed": self.refreshed, "skipped": self.skipped,
+                "check_hit_ratio": round(hits / (hits + misses), 3) if hits + misses else 0.0,
+                "warm_share_of_hits": round(warm / hits, 3) if hits else 0.0}
+
+prewarmer = PreWarmer()
+
+async def prewarm_job(context: ContextTypes.DEFAULT_TYPE):
+    with timed("job.prewarm"):
+        await prewarmer.tick()
+
+async def prewarm_sync_job(context: ContextTypes.DEFAULT_TYPE):
+    await prewarmer.sync()
+
+# ================== PRICE ALERTS ==================
+MAX_ALERTS_PER_USER = int(os.getenv("MAX_ALERTS_PER_USER", "20"))
+ALERT_METRICS = {"price": "dex_price", "liq": "dex_liq"}
+FOREVER = 4102444800.0   # expiry used for rows that must never age out of CACHE_DB (2100-01-01)
+
+class AlertBook:
+    """One-shot price/liquidity alerts.
+
+    Per (mint, metric, direction) the thresholds are kept sorted, so a new value finds every
+    crossed alert with one bisect (O(log n + hits)) instead of scanning all subscriptions.
+    """
+    def __init__(self):
+        self.alerts = {}        # id -> alert dict
+        self.index = {}         # (mint, metric, op) -> sorted [(threshold, id)]
+        self._ids = itertools.count(1)
+
+    def _index_add(self, a):
+        bisect.insort(self.index.setdefault((a["mint"], a["metric"], a["op"]), []), (a["value"], a["id"]))
+
+    def add(self, chat_id: int, user_id: int, mint: str, metric: str, op: str, value: float) -> dict:
+        a = {"id": next(self._ids), "chat_id": chat_id, "user_id": user_id, "mint": mint,
+             "metric": metric, "op": op, "value": float(value), "created": time.time()}
+        self.alerts[a["id"]] = a
+        self._index_add(a)
+        if _store is not None: _store.put("alerts", a["id"], a, FOREVER)
+        return a
+
+    def remove(self, alert_id: int):
+        a = self.alerts.pop(alert_id, None)
+        if a is None: return None
+        key = (a["mint"], a["metric"], a["op"])
+        lst = self.index.get(key, [])
+        i = bisect.bisect_left(lst, (a["value"], a["id"]))
+        if i < len(lst) and lst[i] == (a["value"], a["id"]): del lst[i]
+        if not lst: self.index.pop(key, None)
+        if _store is not None: _store.delete("alerts", a["id"])
+        return a
+
+    def for_user(self, user_id: int) -> list:
+        return [a for a in self.alerts.values() if a["user_id"] == user_id]
+
+    def mints(self) -> list:
+        return list(dict.fromkeys(k[0] for k in self.index))
+
+    def crossed(self, mint: str, metric: str, value: float) -> list:
+        """Pop and return every alert of `mint` whose threshold `value` has crossed."""
+        hits = []
+        above = self.index.get((mint, metric, "above"), [])
+        hits += [i for _, i in above[:bisect.bisect_right(above, (value, float("inf")))]]
+        below = self.index.get((mint, metric, "below"), [])
+        hits += [i for _, i in below[bisect.bisect_left(below, (value, -1)):]]
+        return [self.remove(i) for i in hits]
+
+    def restore(self):
+        rows = _store.load("alerts", 1_000_000) if _store is not None else []
+        last = max((a["id"] for _, a, _ in rows), default=0)
+        for _, a, _ in rows:
+            if not owns_user(a["user_id"]): continue   # another worker's shard
+            if not is_mint(a["mint"]):   # stored before /alert validated the CA; it would spoil its Dexscreener batch
+                _store.delete("alerts", a["id"]); continue
+            self.alerts[a["id"]] = a
+            self._index_add(a)
+        # new ids are unique across workers: above every stored id and ≡ shard (mod workers)
+        self._ids = itertools.count(last + 1 + (SHARD_INDEX - last) % SHARD_COUNT, SHARD_COUNT)
+        if self.alerts: print(f"alerts: {len(self.alerts)} restored")
+
+alert_book = AlertBook()
+
+async def alert_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if not await require_membership(update, context):
+        return
+    usage = ("Usage: <code>/alert &lt;CA&gt; &lt;price|liq&gt; &lt;above|below&gt; &lt;usd&gt;</code>\n"
+             "e.g. <code>/alert So11…112 price above 0.5</code>")
+    args = context.args or []
+    try:
+        mint, metric, op, value = args[0], args[1].lower(), args[2].lower(), float(args[3])
+    except (IndexError, ValueError):
+        await update.message.reply_text(usage, parse_mode="HTML"); return
+    if not is_mint(mint) or metric not in ALERT_METRICS or op not in ("above", "below") or value <= 0:
+        await update.message.reply_text(usage, parse_mode="HTML"); return
+    uid = update.effective_user.id
+    if len(alert_book.for_user(uid)) >= MAX_ALERTS_PER_USER:
+        await update.message.reply_text(f"Alert limit reached ({MAX_ALERTS_PER_USER}). Remove one with /unalert."); return
+    a = alert_book.add(update.effective_chat.id, uid, mint, metric, op, value)
+    await update.message.reply_text(
+        f"🔔 Alert #{a['id']}: {metric} of <code>{safe(mint)}</code> {op} {fmt_usd(value)}", parse_mode="HTML")
+
+async def alerts_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    mine = alert_book.for_user(update.effective_user.id)
+    if not mine:
+        await update.message.reply_text("No active alerts. Add one with /alert."); return
+    lines = ["<b>Your alerts</b>"]
+    for a in sorted(mine, key=lambda a: a["id"]):
+        lines.append(f"• #{a['id']} <code>{safe(a['mint'][:6])}…{safe(a['mint'][-6:])}</code> {a['metric']} {a['op']} {fmt_usd(a['value'])}")
+    await update.message.reply_text("\n".join(lines), parse_mode="HTML")
+
+async def unalert_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    try:
+        alert_id = int((context.args or [""])[0].lstrip("#"))
+    except ValueError:
+        await update.message.reply_text("Usage: /unalert <id>"); return
+    a = alert_book.alerts.get(alert_id)
+    if not a or a["user_id"] != update.effective_user.id:
+        await update.message.reply_text("No such alert."); return
+    alert_book.remove(alert_id)
+    await update.message.reply_text(f"Alert #{alert_id} removed.")
+
 async def price_alerts_job(context: ContextTypes.DEFAULT_TYPE):
-    # kept minimal; real alerts can be (re)added later
-    pass
+    mints = alert_book.mints()
+    if not mints: return
+    summaries = await measure("job.price_alerts.fetch", fetch_dexscreener_many(mints))
+    for mint, summary in summaries.items():
+        if not summary: continue
+        _dex_cache.set(mint, summary)   # fresh price for /check too
+        for metric, field in ALERT_METRICS.items():
+            try:
+                value = float(summary.get(field) or 0)
+            except (TypeError, ValueError):
+                continue
+            if value <= 0: continue
+            for a in alert_book.crossed(mint, metric, value):
+                sym = summary.get("symbol") or f"{mint[:6]}…"
+                try:
+                    await context.bot.send_message(
+                        a["chat_id"],
+                        f"🔔 <b>{safe(sym)}</b> {metric} is {fmt_usd(value)} ({a['op']} {fmt_usd(a['value'])})\n"
+                        f"<code>{safe(mint)}</code>",
+                        parse_mode="HTML", disable_web_page_preview=True)
+                except Exception as e:
+                    print(f"alert #{a['id']} not delivered: {e}")
+
+# ================== WHALE WATCH (WebSocket) ==================
+WHALE_TOP_ACCOUNTS   = int(os.getenv("WHALE_TOP_ACCOUNTS", "20"))   # largest token accounts streamed per mint
+WHALE_REFRESH_SEC    = 60.0   # min gap between holder refreshes triggered by logs of one mint
+MAX_WHALES_PER_USER  = int(os.getenv("MAX_WHALES_PER_USER", "10"))
+
+class WhaleWatcher:
+    """Streams balance changes of the largest token accounts of watched mints.
+
+    accountSubscribe (jsonParsed) on each tracked account yields the new balance; the delta to
+    the last known balance is the transfer size. logsSubscribe on the mint only triggers a
+    (debounced) refresh of the largest-account set, so new whales get picked up. One persistent
+    connection; on drop it reconnects with backoff to the next URL and resubscribes everything.
+    """
+    def __init__(self, urls: list):
+        self.urls = urls
+        self.subs = {}          # mint -> {"chat:user": (chat_id, user_id, min_ui)}
+        self.accounts = {}      # token account -> {"mint", "owner", "amount", "decimals"}
+        self.bot = None
+        self.ws = None
+        self._req = itertools.count(1)
+        self._pending = {}      # request id -> ("account"|"logs", key)
+        self._sub_of = {}       # (kind, key) -> subscription id
+        self._by_sub = {}       # subscription id -> (kind, key)
+        self._refreshed = {}    # mint -> last refresh (monotonic)
+        self._wake = asyncio.Event()
+        self.events = self.alerts = self.reconnects = 0
+
+    # ---- subscriptions (bot commands) ----
+    def watch(self, mint: str, chat_id: int, user_id: int, min_ui: float):
+        new = mint not in self.subs
+        self.subs.setdefault(mint, {})[f"{chat_id}:{user_id}"] = (chat_id, user_id, float(min_ui))
+        self._save(mint)
+        self._wake.set()
+        if new and self.ws is not None:   # connected: subscribe now instead of at the next whale_job
+            self._refreshed[mint] = time.monotonic()
+            spawn(self._track(mint))
+
+    def unwatch(self, mint: str, chat_id: int, user_id: int) -> bool:
+        found = self.subs.get(mint, {}).pop(f"{chat_id}:{user_id}", None) is not None
+        if mint in self.subs and not self.subs[mint]: del self.subs[mint]
+        self._save(mint)
+        return found
+
+    def for_user(self, user_id: int) -> list:
+        return [(m, v[2]) for m, d in self.subs.items() for v in d.values() if v[1] == user_id]
+
+    def _save(self, mint):
+        if _store is None: return
+        key = mint if SHARD_COUNT == 1 else f"{mint}#{SHARD_INDEX}"   # workers never overwrite each other's rows
+        if self.subs.get(mint): _store.put("whales", key, list(self.subs[mint].values()), FOREVER)
+        else:                   _store.delete("whales", key)
+
+    def restore(self):
+        if _store is None: return
+        if SHARD_COUNT == 1: WhaleWatcher.rekey(_store, 1)   # webhook mode: the ingress did this before forking
+        for key, rows, _ in _store.load("whales", 100_000):
+            mine = {f"{c}:{u}": (c, u, m) for c, u, m in rows if owns_user(u)}
+            if mine: self.subs.setdefault(key.split("#")[0], {}).update(mine)
+
+    @staticmethod
+    def rekey(store, shards: int):
+        """Rewrite whale rows saved under another worker count (plain mint, or mint#shard of each
+        owner's shard), so rows of the old layout cannot resurrect removed watches on a restart."""
+        rows = store.load("whales", 100_000)
+        want = {}
+        for key, subs, _ in rows:
+            mint = key.split("#")[0]
+            for c, u, m in subs:
+                k = mint if shards == 1 else f"{mint}#{int(u) % shards}"
+                want.setdefault(k, {})[f"{c}:{u}"] = [c, u, m]
+        if {k: sorted(map(tuple, v)) for k, v, _ in rows} == {k: sorted(map(tuple, v.values())) for k, v in want.items()}:
+            return
+        for key, _, _ in rows:
+            if key not in want: store.delete("whales", key)
+        for key, subs in want.items():
+            store.put("whales", key, list(subs.values()), FOREVER)
+        store.flush()
+        print(f"whale watches: {len(rows)} rows re-keyed for {shards} worker(s)")
+
+    # ---- wire protocol ----
+    async def _send(self, method: str, params: list, key=None):
+        if self.ws is None: return
+        rid = next(self._req)
+        if key is not None: self._pending[rid] = key
+        await self.ws.send(json.dumps({"jsonrpc": "2.0", "id": rid, "method": method, "params": params}))
+
+    async def _subscribe(self, kind: str, key: str):
+        if (kind, key) in self._sub_of: return
+        self._sub_of[(kind, key)] = None   # requested, id not known yet
+        if kind == "account":
+            await self._send("accountSubscribe", [key, {"encoding": "jsonParsed", "commitment": "confirmed"}], (kind, key))
+        else:
+            await self._send("logsSubscribe", [{"mentions": [key]}, {"commitment": "confirmed"}], (kind, key))
+
+    async def _unsubscribe(self, kind: str, key: str):
+        sid = self._sub_of.pop((kind, key), None)
+        if sid is None: return
+        self._by_sub.pop(sid, None)
+        await self._send("accountUnsubscribe" if kind == "account" else "logsUnsubscribe", [sid])
+
+    async def _apply(self):
+        """Bring live subscriptions in line with the watched mints / tracked accounts."""
+        want = {("logs", m) for m in self.subs} | {("account", a) for a, v in self.accounts.items() if v["mint"] in self.subs}
+        for kind, key in list(self._sub_of):
+            if (kind, key) not in want: await self._unsubscribe(kind, key)
+        for kind, key in want:
+            await self._subscribe(kind, key)
+
+    # ---- holder set ----
+    async def refresh(self, mint: str):
+        self._refreshed[mint] = time.monotonic()
+        try:
+            lr = await rpc("getTokenLargestAccounts", [mint, {"commitment": "confirmed"}])
+        except Exception as e:
+            print(f"whale refresh {mint[:6]}…: {e}"); return
+        holders = await resolve_holder_owners((lr or {}).get("value", [])[:WHALE_TOP_ACCOUNTS])
+        keep = set()
+        for h in holders:
+            acct = h.get("address")
+            if not acct: continue
+            keep.add(acct)
+            prev = self.accounts.get(acct)
+            self.accounts[acct] = {"mint": mint, "owner": holder_wallet(h), "decimals": int(h.get("decimals", 0) or 0),
+                                   "amount": prev["amount"] if prev else int(h.get("amount", 0) or 0)}
+        for acct in [a for a, v in self.accounts.items() if v["mint"] == mint and a not in keep]:
+            del self.accounts[acct]
+
+    async def _track(self, mint: str):
+        """Refresh one mint's holder set and resubscribe; spawned so the read loop never waits on RPC."""
+        try:
+            await self.refresh(mint)
+            await self._apply()
+        except Exception as e:   # socket gone meanwhile: the reconnect resubscribes everything
+            print(f"whale track {mint[:6]}…: {type(e).__name__} {e}")
+
+    async def sync(self):
+        """Periodic reconcile (whale_job): refresh holder sets of watched mints, drop unwatched ones."""
+        for acct in [a for a, v in self.accounts.items() if v["mint"] not in self.subs]:
+            del self.accounts[acct]
+        for mint in list(self.subs):
+            await self.refresh(mint)
+        await self._apply()
+
+    # ---- notifications ----
+    async def _on_message(self, msg: dict):
+        if "id" in msg and msg["id"] in self._pending:
+            key = self._pending.pop(msg["id"])
+            if "result" in msg and key in self._sub_of:
+                self._sub_of[key] = msg["result"]
+                self._by_sub[msg["result"]] = key
+            return
+        params = msg.get("params") or {}
+        key = self._by_sub.get(params.get("subscription"))
+        if key is None: return
+        kind, k = key
+        if msg.get("method") == "logsNotification":
+            if time.monotonic() - self._refreshed.get(k, 0) >= WHALE_REFRESH_SEC:
+                self._refreshed[k] = time.monotonic()   # debounce until the spawned refresh starts
+                spawn(self._track(k))
+        elif msg.get("method") == "accountNotification":
+            self.events += 1
+            value = (params.get("result") or {}).get("value") or {}
+            info = (((value.get("data") or {}).get("parsed") or {}).get("info") or {}) if isinstance(value.get("data"), dict) else {}
+            acct = self.accounts.get(k)
+            amount = (info.get("tokenAmount") or {}).get("amount")
+            if acct is None or amount is None: return
+            amount, old = int(amount), acct["amount"]
+            acct["amount"] = amount
+            delta_ui = (amount - old) / (10 ** acct["decimals"] if acct["decimals"] else 1)
+            if delta_ui: await self._alert(acct, k, delta_ui)
+
+    async def _alert(self, acct: dict, token_account: str, delta_ui: float):
+        mint = acct["mint"]
+        for chat_id, user_id, min_ui in list(self.subs.get(mint, {}).values()):
+            if abs(delta_ui) < min_ui or self.bot is None: continue
+            self.alerts += 1
+            verb = "received" if delta_ui > 0 else "sent"
+            owner = acct["owner"] or token_account
+            try:
+                await self.bot.send_message(
+                    chat_id,
+                    f"🐋 <b>Whale move</b> on <code>{safe(mint)}</code>\n"
+                    f"<a href='{solscan(owner)}'>{owner[:6]}…{owner[-6:]}</a> {verb} {abs(delta_ui):,.2f} tokens",
+                    parse_mode="HTML", disable_web_page_preview=True)
+            except Exception as e:
+                print(f"whale alert not delivered: {e}")
+
+    # ---- connection loop ----
+    async def run(self):
+        backoff, i = 1.0, 0
+        while True:
+            if not self.subs:
+                self._wake.clear()
+                await self._wake.wait()
+            url = self.urls[i % len(self.urls)]
+            try:
+                async with websockets.connect(url, ping_interval=20, ping_timeout=20, max_size=2**22) as ws:
+                    self.ws, backoff = ws, 1.0
+                    self._sub_of.clear(); self._by_sub.clear(); self._pending.clear()
+                    if not self.accounts: await self.sync()
+                    else: await self._apply()
+                    async for raw in ws:
+                        try:
+                            await self._on_message(json.loads(raw))
+                        except (ValueError, KeyError, TypeError) as e:
+                            print(f"whale ws: bad message ({e})")
+                        if not self.subs: break
+                if not self.subs: continue   # nothing left to watch: idle until the next /whale
+                print(f"whale ws {urlparse(url).hostname}: closed by server")
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"whale ws {urlparse(url).hostname}: {type(e).__name__} {e}")
+            finally:
+                self.ws = None
+            # dropped or closed cleanly alike: next URL, growing pause
+            i += 1
+            self.reconnects += 1
+            await asyncio.sleep(backoff)
+            backoff = min(30.0, backoff * 2)
+
+    def stats(self) -> dict:
+        return {"mints": len(self.subs), "accounts": len(self.accounts), "subscriptions": len(self._by_sub),
+                "events": self.events, "alerts": self.alerts, "reconnects": self.reconnects}
+
+whale_watcher = WhaleWatcher(WS_LIST)
+
+async def whale_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if not await require_membership(update, context):
+        return
+    if websockets is None:
+        await update.message.reply_text("Whale watch unavailable (websockets not installed)."); return
+    try:
+        mint, min_ui = context.args[0], float(context.args[1])
+    except (IndexError, ValueError, TypeError):
+        await update.message.reply_text("Usage: /whale <CA> <min tokens moved>"); return
+    if not is_mint(mint):
+        await update.message.reply_text("That is not a valid Solana mint address."); return
+    uid = update.effective_user.id
+    if len(whale_watcher.for_user(uid)) >= MAX_WHALES_PER_USER:
+        await update.message.reply_text(f"Whale watch limit reached ({MAX_WHALES_PER_USER}). Remove one with /unwhale."); return
+    whale_watcher.watch(mint, update.effective_chat.id, uid, min_ui)
+    await update.message.reply_text(f"🐋 Watching <code>{safe(mint)}</code> for moves ≥ {min_ui:,.2f} tokens.", parse_mode="HTML")
+
+async def unwhale_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    mint = (context.args or [""])[0]
+    ok = whale_watcher.unwatch(mint, update.effective_chat.id, update.effective_user.id)
+    await update.message.reply_text("Whale watch removed." if ok else "No such whale watch.")
 
 async def whale_job(context: ContextTypes.DEFAULT_TYPE):
-    # kept minimal; real whale watch can be (re)added later
-    pass
+    # streaming does the work; this only reconciles holder sets / subscriptions
+    if whale_watcher.ws is not None:
+        await whale_watcher.sync()
+
+# ================== UPSTREAM OVERRIDES ==================
+def configure_upstreams(rpc_urls=None, dexscreener=None, helius=None, helius_key=None, ws_urls=None):
+    """Point the bot at other upstreams (e.g. the local stand-ins of bench.py) after import."""
+    global rpc_router, DEXSCREENER_BASE, HELIUS_BASE, HELIUS_KEY
+    if rpc_urls:    rpc_router = RpcRouter(list(rpc_urls))
+    if dexscreener: DEXSCREENER_BASE = dexscreener.rstrip("/")
+    if helius:      HELIUS_BASE = helius.rstrip("/")
+    if helius_key:  HELIUS_KEY = helius_key
+    if ws_urls:     whale_watcher.urls = list(ws_urls)
 
 # ================== HOOKS ==================
 async def post_init(app):
+    if not WEBHOOK_URL:   # polling; in webhook mode the ingress owns the registration
+        try:
+            await app.bot.delete_webhook(drop_pending_updates=True)
+        except Exception:
+            pass
+    await open_persistent_cache()
+    await start_metrics_server()
+    alert_book.restore()
+    if websockets is not None:
+        whale_watcher.bot = app.bot
+        whale_watcher.restore()
+        spawn(whale_watcher.run())
+    else:
+        print('⚠️ websockets not installed – whale watch disabled. Install with: pip install websockets')
+
+async def post_shutdown(app):
+    await cancel_background()
+    await snapshots.flush()
+    await close_http_clients()
+    await close_persistent_cache()
+
+# ================== WEBHOOK INGRESS (sharded workers) ==================
+# One ingress process receives Telegram's webhook POSTs and hands each raw update to the worker
+# that owns its user (user id mod WEBHOOK_WORKERS); every worker is a full bot without an updater.
+# Sharding by user keeps a user's /check conversation, alerts and whale watches in one process;
+# the analysis caches are shared through CACHE_DB (SQLite WAL, read-through on a local miss).
+WEBHOOK_URL       = os.getenv("WEBHOOK_URL")                        # public URL Telegram posts to; unset = long polling
+WEBHOOK_LISTEN    = os.getenv("WEBHOOK_LISTEN", "127.0.0.1")        # plain HTTP: Telegram needs a TLS proxy in front anyway
+WEBHOOK_MAX_BODY  = int(os.getenv("WEBHOOK_MAX_BODY", "1048576"))   # bigger POSTs are refused unread
+WEBHOOK_PORT      = int(os.getenv("WEBHOOK_PORT", "8443"))
+WEBHOOK_SECRET    = os.getenv("WEBHOOK_SECRET") or secrets.token_urlsafe(24)
+WEBHOOK_WORKERS   = int(os.getenv("WEBHOOK_WORKERS", "0")) or os.cpu_count() or 1
+WEBHOOK_QUEUE     = int(os.getenv("WEBHOOK_QUEUE", "1000"))         # updates buffered per worker before 503
+WEBHOOK_MAX_CONN  = int(os.getenv("WEBHOOK_MAX_CONN", "40"))        # parallel connections Telegram may open
+TELEGRAM_API_BASE = os.getenv("TELEGRAM_API_BASE", "https://api.telegram.org").rstrip("/")   # e.g. a local fake Bot API
+
+def update_owner(update: dict) -> int:
+    """The user an update belongs to (chat, then update id, when it has none): the sharding key."""
+    for kind, obj in update.items():
+        if not isinstance(obj, dict): continue
+        if kind in ("chat_member", "my_chat_member"):   # the member whose status changed, not the admin
+            obj = obj.get("new_chat_member") or {}
+        user = obj.get("from") or obj.get("user") or {}
+        chat = obj.get("chat") or (obj.get("message") or {}).get("chat") or {}
+        if user.get("id") or chat.get("id"):
+            return int(user.get("id") or chat["id"])
+    return int(update.get("update_id", 0))
+
+def check_request(request_line: bytes, headers: dict):
+    """Refusal status for a request judged on its head alone, or None; the body is only read after this."""
+    method, path = (request_line.split(b" ") + [b"", b""])[:2]
+    if method != b"POST" or path.decode("latin-1") != (urlparse(WEBHOOK_URL).path or "/"):
+        return "404 Not Found"
+    if not hmac.compare_digest(headers.get("x-telegram-bot-api-secret-token", "").encode("latin-1"), WEBHOOK_SECRET.encode()):
+        return "401 Unauthorized"
+    length = headers.get("content-length", "0")
+    if not length.isdigit() or int(length) > WEBHOOK_MAX_BODY:
+        return "413 Content Too Large"
+    return None
+
+def route_update(body: bytes, inboxes: list) -> str:
     try:
-        await app.bot.delete_webhook(drop_pending_updates=True)
-    except Exception:
+        shard = update_owner(json.loads(body)) % len(inboxes)
+    except (ValueError, TypeError, AttributeError):
+        return "400 Bad Request"
+    try:
+        inboxes[shard].put_nowait(body)   # the worker parses it again; the ingress only routes
+    except queue.Full:
+        count("webhook_rejected")
+        return "503 Service Unavailable"   # Telegram redelivers later
+    count("webhook_updates", shard=str(shard))
+    return "200 OK"
+
+async def _ingress_conn(reader, writer, inboxes):
+    try:
+        while True:   # Telegram keeps connections alive
+            line = await asyncio.wait_for(reader.readline(), 120)
+            if not line: break
+            headers = {}
+            while (h := await asyncio.wait_for(reader.readline(), 10)) not in (b"\r\n", b"\n", b""):
+                if len(headers) >= 64: raise ValueError("too many headers")
+                k, _, v = h.decode("latin-1").partition(":")
+                headers[k.strip().lower()] = v.strip()
+            refused = check_request(line.rstrip(), headers)
+            if refused:   # unread body: answer and drop the connection
+                count("webhook_refused", status=refused[:3])
+                writer.write(f"HTTP/1.1 {refused}\r\nContent-Length: 0\r\nConnection: close\r\n\r\n".encode())
+                await writer.drain()
+                break
+            body = await asyncio.wait_for(reader.readexactly(int(headers.get("content-length") or 0)), 10)
+            status = route_update(body, inboxes)
+            writer.write(f"HTTP/1.1 {status}\r\nContent-Length: 0\r\n\r\n".encode())
+            await writer.drain()
+            if headers.get("connection", "").lower() == "close": break
+    except (asyncio.TimeoutError, asyncio.IncompleteReadError, ConnectionError, ValueError):
         pass
-
-def main():
-    app = ApplicationBuilder().token(BOT_TOKEN).post_init(post_init).build()
+    finally:
+        writer.close()
+
+async def webhook_ingress(inboxes: list):
+    srv = await asyncio.start_server(lambda r, w: _ingress_conn(r, w, inboxes), WEBHOOK_LISTEN, WEBHOOK_PORT)
+    await start_metrics_server()
+    async with Bot(BOT_TOKEN, base_url=f"{TELEGRAM_API_BASE}/bot", base_file_url=f"{TELEGRAM_API_BASE}/file/bot") as b:
+        await b.set_webhook(WEBHOOK_URL, secret_token=WEBHOOK_SECRET, allowed_updates=Update.ALL_TYPES,
+                            max_connections=WEBHOOK_MAX_CONN, drop_pending_updates=True)
+    print(f"🚀 Webhook ingress on {WEBHOOK_LISTEN}:{WEBHOOK_PORT} → {len(inboxes)} workers")
+    stop = asyncio.Event()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        asyncio.get_running_loop().add_signal_handler(sig, stop.set)
+    await stop.wait()
+    srv.close()
+    await srv.wait_closed()
+
+async def serve_shard(app, inbox):
+    """Worker loop: the Application minus the updater, fed from the ingress queue."""
+    loop = asyncio.get_running_loop()
+    async with app:
+        await post_init(app)
+        await app.start()
+        try:
+            while (raw := await loop.run_in_executor(None, inbox.get)) is not None:
+                try:
+                    await app.update_queue.put(Update.de_json(json.loads(raw), app.bot))
+                except (ValueError, TypeError, KeyError) as e:
+                    print(f"shard {SHARD_INDEX}: bad update ({e})")
+        finally:
+            await app.stop()
+            await post_shutdown(app)
+
+def run_worker(index: int, workers: int, inbox):
+    global SHARD_INDEX, SHARD_COUNT, METRICS_PORT, _helius_bucket
+    signal.signal(signal.SIGINT, signal.SIG_IGN)   # the ingress stops workers through their queue
+    SHARD_INDEX, SHARD_COUNT = index, workers
+    _helius_bucket = TokenBucket(HELIUS_RPS / workers, max(1, HELIUS_BURST // workers))   # the plan's rps is shared
+    if METRICS_PORT: METRICS_PORT += 1 + index   # the ingress serves METRICS_PORT itself
+    asyncio.run(serve_shard(build_app(updater=False, global_jobs=index == 0), inbox))
+
+def run_webhook():
+    if not CACHE_DB:   # workers only share caches through the SQLite store
+        os.environ["CACHE_DB"] = os.path.abspath("phoenix-cache.sqlite")
+        print("CACHE_DB not set – workers share", os.environ["CACHE_DB"])
+    store = PersistentStore(os.environ["CACHE_DB"])
+    WhaleWatcher.rekey(store, WEBHOOK_WORKERS)   # before any worker restores its share
+    store.close()
+    ctx = multiprocessing.get_context("spawn")   # fresh interpreters: no event loop or sockets inherited
+    inboxes = [ctx.Queue(WEBHOOK_QUEUE) for _ in range(WEBHOOK_WORKERS)]
+    procs = [ctx.Process(target=run_worker, args=(i, WEBHOOK_WORKERS, q), name=f"phoenix-shard-{i}")
+             for i, q in enumerate(inboxes)]
+    for p in procs: p.start()
+    try:
+        asyncio.run(webhook_ingress(inboxes))
+    finally:
+        for q in inboxes: q.put(None)
+        for p in procs:
+            p.join(30)
+            if p.is_alive(): p.terminate()
+
+def build_app(updater: bool = True, global_jobs: bool = True):
+    """The Application with all handlers and jobs; workers of webhook mode build it without an updater."""
+    builder = (ApplicationBuilder().token(BOT_TOKEN).base_url(f"{TELEGRAM_API_BASE}/bot")
+               .base_file_url(f"{TELEGRAM_API_BASE}/file/bot").post_init(post_init).post_shutdown(post_shutdown))
+    if not updater: builder = builder.updater(None)
+    app = builder.build()
 
     # Commands
     app.add_handler(CommandHandler("start", start))
     app.add_handler(CommandHandler("ping", ping))
-    app.add_handler(CommandHandler("slot", slot))
-
-    # /check conversation
+    app.add_handler(CommandHandler("slot", slot, block=False))
+    app.add_handler(CommandHandler("health", health))
+    app.add_handler(CommandHandler("stats", stats_cmd))
+    app.add_handler(CommandHandler("alert", alert_cmd))
+    app.add_handler(CommandHandler("alerts", alerts_cmd))
+    app.add_handler(CommandHandler("unalert", unalert_cmd))
+    app.add_handler(CommandHandler("whale", whale_cmd))
+    app.add_handler(CommandHandler("scan", scan_cmd, block=False))
+    app.add_handler(MessageHandler(filters.Document.ALL & filters.CaptionRegex(r"^/scan\b"), scan_cmd, block=False))
+    app.add_handler(CommandHandler("unwhale", unwhale_cmd))
+    app.add_handler(ChatMemberHandler(on_chat_member, ChatMemberHandler.CHAT_MEMBER))
+    app.add_handler(InlineQueryHandler(inline_query, block=False))   # needs /setinline in @BotFather
+
+    # /check conversation (block=False: a running analysis must not stall the update loop)
     conv_check = ConversationHandler(
         entry_points=[CommandHandler("check", check_start)],
-        states={ ASK_CA_CHECK: [MessageHandler(filters.TEXT & ~filters.COMMAND, check_receive_ca)] },
+        states={ ASK_CA_CHECK: [MessageHandler(filters.TEXT & ~filters.COMMAND, check_receive_ca, block=False)] },
         fallbacks=[CommandHandler("cancel", check_cancel)],
         allow_reentry=True,
     )
@@ -563,11 +3077,19 @@ def main():
     if jq is None:
         print('⚠️ JobQueue not available. Install with: pip install "python-telegram-bot[job-queue]"')
     else:
+        # alerts / whale watches are per user, so every shard runs them over its own users
         jq.run_repeating(price_alerts_job, interval=120, first=15)
         jq.run_repeating(whale_job,        interval=180, first=30)
+        if PREWARM_MAX > 0:   # worker 0 warms; the others only exchange checks with it through the store
+            jq.run_repeating(prewarm_job if global_jobs else prewarm_sync_job, interval=PREWARM_INTERVAL, first=45)
+    return app
 
+def main():
+    if WEBHOOK_URL:
+        run_webhook(); return
+    app = build_app()
     print("🚀 Bot läuft…")
-    app.run_polling()
+    app.run_polling(allowed_updates=Update.ALL_TYPES)   # chat_member updates are opt-in
 
 if __name__ == "__main__":
     main()